@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a Maven repository, used by the benchmark suite.
+
+Serves synthetic maven-metadata.xml, POMs, JARs and .sha1 files for a
+configurable catalog, with injectable latency, 429s, 5xx errors, truncated
+bodies and a request rate limit. Every response is derived from the request
+path and the seed, so two servers with the same settings serve identical
+content.
+
+Run standalone to poke at it by hand:
+    python fake_maven.py --port 18081 --artifacts 100 --versions 50 --latency-ms 20
+"""
+
+import argparse
+import hashlib
+import http.server
+import json
+import random
+import socketserver
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# (groupId, artifactId prefix) pairs the classifier rules recognise, so
+# compatibility ranges are exercised the way real dependencies exercise them
+ARTIFACT_FAMILIES = [
+    ('org.apache.kafka', 'kafka-clients'),
+    ('com.fasterxml.jackson.core', 'jackson-databind'),
+    ('com.google.guava', 'guava'),
+    ('io.grpc', 'grpc-core'),
+    ('org.apache.avro', 'avro'),
+    ('io.netty', 'netty-handler'),
+    ('org.apache.hadoop', 'hadoop-common'),
+    ('org.slf4j', 'slf4j-api'),
+    ('com.google.protobuf', 'protobuf-java'),
+    ('org.apache.commons', 'commons-lang3'),
+    ('com.example.unclassified', 'widget'),
+]
+
+
+class SyntheticCatalog:
+    """Deterministic catalog of artifacts, versions and POM dependencies"""
+
+    def __init__(self, artifacts: int = 100, versions: int = 50, jar_size: int = 16 * 1024,
+                 pom_dependencies: int = 2, seed: int = 0):
+        self.artifacts = artifacts
+        self.versions = versions
+        self.jar_size = jar_size
+        self.pom_dependencies = pom_dependencies
+        self.seed = seed
+        self.coordinates: List[Tuple[str, str]] = []
+        for i in range(artifacts):
+            group_id, prefix = ARTIFACT_FAMILIES[i % len(ARTIFACT_FAMILIES)]
+            self.coordinates.append((group_id, f"{prefix}-b{i}"))
+        self._by_path = {(g.replace('.', '/'), a): i for i, (g, a) in enumerate(self.coordinates)}
+
+    def version_list(self, index: int) -> List[str]:
+        """Published versions of one artifact, oldest first"""
+        offset = index % 7
+        result = []
+        for j in range(self.versions):
+            n = j + offset
+            version = f"{1 + n // 100}.{(n // 10) % 10}.{n % 10}"
+            result.append(version)
+            if j % 9 == 4:
+                result.append(f"{version}-RC1")
+        return result
+
+    def current_version(self, index: int) -> str:
+        """Version declared in the generated versions file (mid-history, so updates exist)"""
+        versions = [v for v in self.version_list(index) if '-' not in v]
+        return versions[len(versions) // 2]
+
+    def lookup(self, group_path: str, artifact_id: str) -> Optional[int]:
+        return self._by_path.get((group_path, artifact_id))
+
+    def metadata(self, index: int) -> bytes:
+        group_id, artifact_id = self.coordinates[index]
+        versions = self.version_list(index)
+        body = ''.join(f"<version>{v}</version>" for v in versions)
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n<metadata><groupId>{group_id}</groupId>'
+                f'<artifactId>{artifact_id}</artifactId><versioning><latest>{versions[-1]}</latest>'
+                f'<release>{versions[-1]}</release><versions>{body}</versions>'
+                f'<lastUpdated>20250101000000</lastUpdated></versioning></metadata>').encode('utf-8')
+
+    def pom(self, index: int, version: str) -> bytes:
+        group_id, artifact_id = self.coordinates[index]
+        deps = []
+        for k in range(1, self.pom_dependencies + 1):
+            dep_index = (index + k * 31) % self.artifacts
+            if dep_index == index:
+                continue
+            dep_group, dep_artifact = self.coordinates[dep_index]
+            deps.append(f"<dependency><groupId>{dep_group}</groupId><artifactId>{dep_artifact}</artifactId>"
+                        f"<version>{self.current_version(dep_index)}</version></dependency>")
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n<project><modelVersion>4.0.0</modelVersion>'
+                f'<groupId>{group_id}</groupId><artifactId>{artifact_id}</artifactId><version>{version}</version>'
+                f'<dependencies>{"".join(deps)}</dependencies></project>').encode('utf-8')
+
+    def jar(self, path: str) -> bytes:
+        block = hashlib.sha256(f"{self.seed}:{path}".encode('utf-8')).digest()
+        return (block * (self.jar_size // len(block) + 1))[:self.jar_size]
+
+    def versions_file(self, repository: str) -> Dict:
+        """A dependency-versions.json declaring every artifact of the catalog"""
+        dependencies: Dict[str, Dict] = {}
+        for i, (group_id, artifact_id) in enumerate(self.coordinates):
+            category = group_id.split('.')[-1]
+            dependencies.setdefault(category, {})[artifact_id] = {
+                'groupId': group_id,
+                'artifactId': artifact_id,
+                'version': self.current_version(i),
+                'description': 'Synthetic benchmark artifact',
+                'repository': repository
+            }
+        return {
+            'metadata': {'flink_version': '2.0.0', 'last_updated': '2025-01-01T00:00:00'},
+            'dependencies': dependencies
+        }
+
+
+class FaultPlan:
+    """Which requests get delayed, throttled, failed or cut short"""
+
+    def __init__(self, latency_ms: float = 0.0, rate_429: float = 0.0, rate_5xx: float = 0.0,
+                 rate_truncate: float = 0.0, seed: int = 0, max_rps: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_truncate = rate_truncate
+        self.max_rps = max_rps
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Refill the rate-limit bucket and restart the fault sequence, so runs do not affect each other"""
+        with self._lock:
+            self._tokens = self.max_rps
+            self._updated = time.monotonic()
+            self._random = random.Random(self.seed)
+
+    def admit(self) -> bool:
+        """Take a token from the server-wide bucket; False means the request is over the rate limit"""
+        if not self.max_rps:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_rps, self._tokens + (now - self._updated) * self.max_rps)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def draw(self) -> Optional[str]:
+        """Fault for the next request: '429', '5xx', 'truncate' or None"""
+        with self._lock:
+            roll = self._random.random()
+        for fault, rate in (('429', self.rate_429), ('5xx', self.rate_5xx), ('truncate', self.rate_truncate)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+
+class FakeMavenRepository:
+    """Threaded HTTP server serving a SyntheticCatalog"""
+
+    def __init__(self, catalog: SyntheticCatalog, faults: FaultPlan = None, port: int = 0):
+        self.catalog = catalog
+        self.faults = faults or FaultPlan()
+        self.stats = {'requests': 0, 'bytes': 0, '429': 0, '5xx': 0, 'truncate': 0, '404': 0}
+        self._stats_lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), _make_handler(self))
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> 'FakeMavenRepository':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-maven', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+        self._server.server_close()
+
+    def record(self, **counts: int):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self.stats)
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on truncated bodies; that is the point, not an error
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def _make_handler(repo: FakeMavenRepository):
+    catalog = repo.catalog
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self._serve(head=False)
+
+        def do_HEAD(self):
+            self._serve(head=True)
+
+        def _send(self, status: int, body: bytes = b'', headers: Dict[str, str] = None,
+                  head: bool = False, truncate: bool = False):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            if truncate:
+                self.send_header('Connection', 'close')
+            self.end_headers()
+            if head:
+                return
+            payload = body[:len(body) // 2] if truncate else body
+            self.wfile.write(payload)
+            repo.record(bytes=len(payload))
+            if truncate:
+                self.close_connection = True
+
+        def _serve(self, head: bool):
+            repo.record(requests=1)
+            if repo.faults.latency:
+                time.sleep(repo.faults.latency)
+            fault = repo.faults.draw()
+            if fault == '429' or not repo.faults.admit():
+                repo.record(**{'429': 1})
+                return self._send(429, b'Too Many Requests', {'Retry-After': '1'}, head)
+            if fault == '5xx':
+                repo.record(**{'5xx': 1})
+                return self._send(503, b'Service Unavailable', head=head)
+
+            parsed = self._parse_path()
+            if parsed is None:
+                repo.record(**{'404': 1})
+                return self._send(404, head=head)
+            index, version, filename = parsed
+            truncate = fault == 'truncate'
+            if truncate:
+                repo.record(truncate=1)
+
+            if filename == 'maven-metadata.xml':
+                body = catalog.metadata(index)
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, headers={'ETag': etag}, head=True)
+                return self._send(200, body, {'Content-Type': 'text/xml', 'ETag': etag}, head, truncate)
+            if filename.endswith('.pom'):
+                return self._send(200, catalog.pom(index, version), {'Content-Type': 'text/xml'}, head, truncate)
+            if filename.endswith('.jar.sha1'):
+                jar_path = self.path[:-len('.sha1')]
+                return self._send(200, hashlib.sha1(catalog.jar(jar_path)).hexdigest().encode(), head=head)
+            if filename.endswith('.jar'):
+                body = catalog.jar(self.path)
+                headers = {'X-Checksum-Sha1': hashlib.sha1(body).hexdigest()}
+                return self._send(200, body, headers, head, truncate)
+            repo.record(**{'404': 1})
+            return self._send(404, head=head)
+
+        def _parse_path(self) -> Optional[Tuple[int, Optional[str], str]]:
+            """Map /g/r/o/u/p/artifact[/version]/file to (catalog index, version, file)"""
+            parts = self.path.split('?', 1)[0].strip('/').split('/')
+            if len(parts) < 3:
+                return None
+            filename = parts[-1]
+            if filename == 'maven-metadata.xml':
+                index = catalog.lookup('/'.join(parts[:-2]), parts[-2])
+                return None if index is None else (index, None, filename)
+            if len(parts) < 4:
+                return None
+            index = catalog.lookup('/'.join(parts[:-3]), parts[-3])
+            return None if index is None else (index, parts[-2], filename)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic Maven repository")
+    parser.add_argument('--port', type=int, default=18081)
+    parser.add_argument('--artifacts', type=int, default=100)
+    parser.add_argument('--versions', type=int, default=50)
+    parser.add_argument('--jar-size', type=int, default=16 * 1024)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--rate-5xx', type=float, default=0.0)
+    parser.add_argument('--rate-truncate', type=float, default=0.0)
+    parser.add_argument('--max-rps', type=float, default=0.0, help='Answer 429 above this many requests per second')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--write-versions', metavar='FILE', help='Write a matching versions file and exit')
+    args = parser.parse_args()
+
+    catalog = SyntheticCatalog(args.artifacts, args.versions, args.jar_size, seed=args.seed)
+    repo = FakeMavenRepository(catalog, FaultPlan(args.latency_ms, args.rate_429, args.rate_5xx,
+                                                  args.rate_truncate, args.seed, args.max_rps), port=args.port)
+    if args.write_versions:
+        with open(args.write_versions, 'w') as f:
+            json.dump(catalog.versions_file(repo.url), f, indent=2)
+        repo.stop()
+        return
+    print(f"Serving {args.artifacts} artifacts on {repo.url}")
+    repo.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        repo.stop()
+
+
+if __name__ == '__main__':
+    main()
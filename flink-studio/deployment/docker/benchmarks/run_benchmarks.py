@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the dependency manager.
+
+Each scenario starts a local fake Maven repository (see fake_maven.py),
+writes a versions file declaring its synthetic catalog and runs the
+commands in-process. For every command it records wall time (median of
+--repeat runs), requests, bytes served and peak Python memory (tracemalloc,
+measured in a separate run so it does not inflate the timings).
+
+Before the scenarios, a repack check merges the same synthetic JAR at two
+deflate levels and fails unless the outputs differ, since a level that is
+silently ignored does not show up in any timing.
+
+Results are compared with baseline.json; any metric more than --tolerance
+above its baseline counts as a regression and the script exits with 1.
+Request and byte counts do not depend on the machine, so they are the most
+reliable signal in CI; timings should be baselined on the CI runner itself
+with --update-baseline.
+
+Usage:
+    python benchmarks/run_benchmarks.py                       # all scenarios vs baseline
+    python benchmarks/run_benchmarks.py --scenario small -r 5
+    python benchmarks/run_benchmarks.py --update-baseline
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+from dependency_manager import DependencyManager, JarRepacker, Logger  # noqa: E402
+from fake_maven import FakeMavenRepository, FaultPlan, SyntheticCatalog  # noqa: E402
+
+DEFAULT_BASELINE = BENCH_DIR / 'baseline.json'
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    'small': {'artifacts': 50, 'versions': 40},
+    'large': {'artifacts': 2000, 'versions': 200},
+    'slow-network': {'artifacts': 200, 'versions': 60, 'latency_ms': 20},
+    'faulty': {'artifacts': 200, 'versions': 60, 'latency_ms': 2,
+               'rate_429': 0.02, 'rate_5xx': 0.02, 'rate_truncate': 0.01},
+    # How fast AIMD pacing converges on the server's limit depends on the machine, so only
+    # the traffic is compared, not the time
+    'throttled': {'artifacts': 200, 'versions': 60, 'latency_ms': 2, 'max_rps': 50,
+                  'metrics': ['requests', 'faults']},
+}
+
+# Commands exercised per scenario; fetch is limited to small catalogs to keep runs short
+COMMANDS = ['check', 'check-ndjson', 'validate', 'report', 'resolve', 'fetch']
+FETCH_MAX_ARTIFACTS = 500
+
+# Metrics that must not grow beyond the tolerance, unless a scenario lists its own
+COMPARED_METRICS = ['seconds', 'requests', 'bytes', 'peak_mb']
+METRIC_SLACK = {'seconds': 0.05, 'faults': 10}
+
+
+def run_command(command: str, versions_file: Path, work_dir: Path) -> Callable[[], Any]:
+    """Build a callable that runs one command against a fresh manager (no metadata cache)"""
+    def run():
+        manager = DependencyManager(str(versions_file), Logger(verbose=False))
+        if command == 'check':
+            return manager.check_updates()
+        if command == 'check-ndjson':
+            with open(os.devnull, 'w') as out:
+                return DependencyManager.write_results(manager.stream_results('check'), 'ndjson', out)
+        if command == 'validate':
+            return manager.validate_dependencies()
+        if command == 'report':
+            return manager.generate_report(str(work_dir / 'report.md'))
+        if command == 'resolve':
+            return manager.resolve_transitive(output_file=str(work_dir / 'resolve.json'))
+        if command == 'fetch':
+            dest = Path(tempfile.mkdtemp(prefix='fetch-', dir=work_dir))
+            return manager.fetch_artifacts(str(dest), require_checksums=True)
+        raise ValueError(f"Unknown command {command}")
+    return run
+
+
+def check_repack_levels(seed: int) -> List[str]:
+    """Merge one synthetic JAR at deflate levels 1 and 9; returns a problem if the bytes are equal"""
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghijklmnop') for _ in range(rng.randint(3, 9))) for _ in range(400)]
+    with tempfile.TemporaryDirectory(prefix='bench-repack-') as tmp:
+        work_dir = Path(tmp)
+        source = work_dir / 'source.jar'
+        with zipfile.ZipFile(source, 'w') as jar:
+            for i in range(20):
+                jar.writestr(f'com/example/C{i}.class', ' '.join(rng.choice(words) for _ in range(4000)))
+        outputs = {}
+        for level in (1, 9):
+            output = work_dir / f'level-{level}.jar'
+            JarRepacker('deflate', level).merge(output, [source])
+            outputs[level] = output.read_bytes()
+    if outputs[1] == outputs[9]:
+        return ["repack --level has no effect: levels 1 and 9 wrote identical JARs"]
+    return []
+
+
+def measure(repo: FakeMavenRepository, run: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Median wall time over `repeat` runs, plus traffic and peak memory of one more run"""
+    timings = []
+    traffic = None
+    for _ in range(repeat):
+        repo.faults.reset()
+        before = repo.snapshot()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        after = repo.snapshot()
+        traffic = {key: after[key] - before[key] for key in after}
+
+    repo.faults.reset()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': round(statistics.median(timings), 4),
+        'requests': traffic['requests'],
+        'bytes': traffic['bytes'],
+        'peak_mb': round(peak / 1048576, 2),
+        'faults': traffic['429'] + traffic['5xx'] + traffic['truncate']
+    }
+
+
+def run_scenario(name: str, config: Dict[str, Any], commands: List[str], repeat: int,
+                 seed: int) -> Dict[str, Dict[str, float]]:
+    catalog = SyntheticCatalog(config['artifacts'], config['versions'], seed=seed)
+    faults = FaultPlan(config.get('latency_ms', 0), config.get('rate_429', 0), config.get('rate_5xx', 0),
+                       config.get('rate_truncate', 0), seed=seed, max_rps=config.get('max_rps', 0))
+    repo = FakeMavenRepository(catalog, faults).start()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix=f'bench-{name}-') as tmp:
+            work_dir = Path(tmp)
+            versions_file = work_dir / 'dependency-versions.json'
+            versions_file.write_text(json.dumps(catalog.versions_file(repo.url), indent=2))
+            for command in commands:
+                if command == 'fetch' and config['artifacts'] > FETCH_MAX_ARTIFACTS:
+                    continue
+                results[command] = measure(repo, run_command(command, versions_file, work_dir), repeat)
+                metrics = results[command]
+                print(f"  {name:<13} {command:<12} {metrics['seconds']:>9.3f}s {metrics['requests']:>7} req "
+                      f"{metrics['bytes'] / 1048576:>8.2f}MB {metrics['peak_mb']:>8.2f}MB peak "
+                      f"{metrics['faults']:>4} faults")
+    finally:
+        repo.stop()
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, float]]], baseline: Dict[str, Any],
+            tolerance: float) -> List[str]:
+    """Describe every metric that regressed beyond the tolerance"""
+    regressions = []
+    for scenario, commands in results.items():
+        for command, metrics in commands.items():
+            expected = baseline.get('results', {}).get(scenario, {}).get(command)
+            if expected is None:
+                continue
+            for metric in SCENARIOS.get(scenario, {}).get('metrics', COMPARED_METRICS):
+                if metric not in expected:
+                    continue
+                # Small absolute slack keeps near-zero timings and fault counts from flapping
+                limit = expected[metric] * (1 + tolerance) + METRIC_SLACK.get(metric, 0)
+                if metrics[metric] > limit:
+                    regressions.append(f"{scenario}/{command} {metric}: {metrics[metric]} "
+                                       f"> {expected[metric]} (+{tolerance:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dependency manager against a fake repository")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run (repeatable, default: all)')
+    parser.add_argument('--command', action='append', choices=COMMANDS,
+                        help='Command to run (repeatable, default: all)')
+    parser.add_argument('--artifacts', type=int, help='Override the catalog size of every scenario')
+    parser.add_argument('--versions', type=int, help='Override the versions per artifact of every scenario')
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='Timed runs per command (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for content and fault injection')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='Baseline file (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed growth over the baseline (default: %(default)s)')
+    parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+    commands = args.command or COMMANDS
+    problems = check_repack_levels(args.seed)
+    for problem in problems:
+        print(f"FAILED {problem}")
+    if problems:
+        sys.exit(1)
+    results = {}
+    print(f"  {'scenario':<13} {'command':<12} {'time':>10} {'requests':>11} {'served':>10} {'memory':>13}")
+    for name in scenarios:
+        config = dict(SCENARIOS[name])
+        if args.artifacts:
+            config['artifacts'] = args.artifacts
+        if args.versions:
+            config['versions'] = args.versions
+        results[name] = run_scenario(name, config, commands, max(1, args.repeat), args.seed)
+
+    report = {
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'cpus': os.cpu_count(),
+        'scenarios': {name: SCENARIOS[name] for name in scenarios},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.artifacts or args.versions:
+        print("Catalog size overridden; skipping baseline comparison")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,16 +16,44 @@ import sys
 import argparse
 import requests
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Any
 import re
 import shutil
-from urllib.parse import urljoin
+import email.utils
+import subprocess
+import tarfile
+import zipfile
+import gzip
+from urllib.parse import parse_qs, urljoin, urlparse
 import hashlib
 import time
 import logging
-from packaging import version as pkg_version
+import threading
+import tempfile
+import mmap
+import struct
+import zlib
+import bisect
+import fnmatch
+import glob
+import functools
+import itertools
+import random
+import cProfile
+import heapq
+import collections
+import signal
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from requests.adapters import HTTPAdapter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no flock, cache runs unlocked
+    fcntl = None
 
 
 class Colors:
@@ -41,165 +69,1001 @@ class Colors:
 class Logger:
     """Custom logger with colored output"""
     
-    def __init__(self, verbose: bool = False):
+    def __init__(self, verbose: bool = False, stream=None):
         self.verbose = verbose
+        # None means stdout; machine-readable output formats move log lines to stderr
+        self.stream = stream
+        # Metadata is fetched from worker threads, keep lines from interleaving
+        self._lock = threading.Lock()
+    
+    def _emit(self, line: str):
+        with self._lock:
+            print(line, file=self.stream)
         
     def info(self, message: str):
-        print(f"{Colors.BLUE}[INFO]{Colors.NC} {message}")
+        self._emit(f"{Colors.BLUE}[INFO]{Colors.NC} {message}")
         
     def success(self, message: str):
-        print(f"{Colors.GREEN}[SUCCESS]{Colors.NC} {message}")
+        self._emit(f"{Colors.GREEN}[SUCCESS]{Colors.NC} {message}")
         
     def warning(self, message: str):
-        print(f"{Colors.YELLOW}[WARNING]{Colors.NC} {message}")
+        self._emit(f"{Colors.YELLOW}[WARNING]{Colors.NC} {message}")
         
     def error(self, message: str):
-        print(f"{Colors.RED}[ERROR]{Colors.NC} {message}")
+        self._emit(f"{Colors.RED}[ERROR]{Colors.NC} {message}")
         
     def debug(self, message: str):
         if self.verbose:
-            print(f"{Colors.BLUE}[DEBUG]{Colors.NC} {message}")
+            self._emit(f"{Colors.BLUE}[DEBUG]{Colors.NC} {message}")
+
+
+class Timings:
+    """Per-phase spans and per-request HTTP statistics collected for --timings.
+    
+    Spans nest per thread: a span's self time excludes the spans opened inside
+    it on the same thread, so the self times of the main thread's phases add up
+    to the wall time of the run. Spans opened on worker threads (XML parsing
+    during concurrent fetches) overlap each other and count thread time.
+    A disabled instance records nothing and costs one attribute check per call.
+    """
+    
+    # Upper bounds (seconds) of the request latency histogram buckets
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self.requests: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.retries: Dict[str, int] = {}
+        self.hedges: Dict[str, int] = {}
+        self.cache_stats: Optional[Dict[str, int]] = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    @contextmanager
+    def span(self, name: str):
+        """Time the enclosed block as one call of the named phase"""
+        if not self.enabled:
+            yield
+            return
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        # [start, time spent in nested spans]
+        frame = [time.perf_counter(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            if stack:
+                stack[-1][1] += elapsed
+            with self._lock:
+                stats = self.spans.get(name)
+                if stats is None:
+                    stats = self.spans[name] = {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0, 'max_seconds': 0.0}
+                stats['calls'] += 1
+                stats['seconds'] += elapsed
+                stats['self_seconds'] += elapsed - frame[1]
+                stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+    
+    def request(self, kind: str, url: str, seconds: float, status: Optional[int] = None, transferred: int = 0):
+        """Record one HTTP request; status None means it failed before a response arrived"""
+        if not self.enabled:
+            return
+        host = urlparse(url).netloc
+        outcome = f"{status // 100}xx" if status else 'error'
+        bucket = bisect.bisect_left(self.LATENCY_BUCKETS, seconds)
+        with self._lock:
+            stats = self.requests.get((kind, host))
+            if stats is None:
+                stats = self.requests[(kind, host)] = {
+                    'count': 0, 'seconds': 0.0, 'bytes': 0, 'responses': {},
+                    'buckets': [0] * (len(self.LATENCY_BUCKETS) + 1)
+                }
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['bytes'] += transferred
+            stats['responses'][outcome] = stats['responses'].get(outcome, 0) + 1
+            stats['buckets'][bucket] += 1
+    
+    def retry(self, kind: str):
+        """Count a request that is about to be retried"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.retries[kind] = self.retries.get(kind, 0) + 1
+    
+    def hedge(self, kind: str):
+        """Count a second request sent to another mirror because the first was slow"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.hedges[kind] = self.hedges.get(kind, 0) + 1
+    
+    def to_dict(self) -> Dict[str, Any]:
+        requests_out = []
+        for (kind, host), stats in sorted(self.requests.items()):
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.LATENCY_BUCKETS + ('+Inf',), stats['buckets']):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            requests_out.append({
+                'kind': kind,
+                'host': host,
+                'count': stats['count'],
+                'seconds': round(stats['seconds'], 6),
+                'bytes': stats['bytes'],
+                'responses': dict(sorted(stats['responses'].items())),
+                'latency_buckets': buckets
+            })
+        cache = None
+        if self.cache_stats is not None:
+            lookups = sum(self.cache_stats.values())
+            served = self.cache_stats.get('hits', 0) + self.cache_stats.get('revalidated', 0)
+            cache = dict(self.cache_stats, hit_ratio=round(served / lookups, 4) if lookups else None)
+        return {
+            'wall_seconds': round(time.perf_counter() - self.started, 6),
+            'spans': {name: {key: round(value, 6) if isinstance(value, float) else value
+                             for key, value in stats.items()}
+                      for name, stats in sorted(self.spans.items())},
+            'requests': requests_out,
+            'bytes': sum(stats['bytes'] for stats in self.requests.values()),
+            'retries': dict(sorted(self.retries.items())),
+            'hedges': dict(sorted(self.hedges.items())),
+            'cache': cache
+        }
+    
+    def write_json(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write('\n')
+    
+    @staticmethod
+    def _labels(**labels: str) -> str:
+        pairs = []
+        for key, value in labels.items():
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+            pairs.append(f'{key}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+    
+    def to_prometheus(self, command: str) -> str:
+        """Render the run in the Prometheus text exposition format"""
+        data = self.to_dict()
+        lines = []
+        
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        metric('flink_deps_run_seconds', 'gauge', 'Wall time of the last run')
+        lines.append(f"flink_deps_run_seconds{self._labels(command=command)} {data['wall_seconds']}")
+        metric('flink_deps_phase_seconds', 'gauge', 'Self time spent in each phase during the last run')
+        for phase, stats in data['spans'].items():
+            lines.append(f"flink_deps_phase_seconds{self._labels(command=command, phase=phase)} "
+                         f"{stats['self_seconds']}")
+        metric('flink_deps_phase_calls', 'gauge', 'Times each phase was entered during the last run')
+        for phase, stats in data['spans'].items():
+            lines.append(f"flink_deps_phase_calls{self._labels(command=command, phase=phase)} {stats['calls']}")
+        
+        metric('flink_deps_http_request_duration_seconds', 'histogram', 'HTTP request latency')
+        for stats in data['requests']:
+            base = {'command': command, 'kind': stats['kind'], 'host': stats['host']}
+            for bound, count in stats['latency_buckets'].items():
+                lines.append(f"flink_deps_http_request_duration_seconds_bucket{self._labels(**base, le=bound)} "
+                             f"{count}")
+            lines.append(f"flink_deps_http_request_duration_seconds_sum{self._labels(**base)} {stats['seconds']}")
+            lines.append(f"flink_deps_http_request_duration_seconds_count{self._labels(**base)} {stats['count']}")
+        metric('flink_deps_http_responses', 'gauge', 'HTTP responses by status class')
+        for stats in data['requests']:
+            for outcome, count in stats['responses'].items():
+                labels = self._labels(command=command, kind=stats['kind'], host=stats['host'], code=outcome)
+                lines.append(f"flink_deps_http_responses{labels} {count}")
+        metric('flink_deps_http_bytes', 'gauge', 'Response bytes received')
+        for stats in data['requests']:
+            labels = self._labels(command=command, kind=stats['kind'], host=stats['host'])
+            lines.append(f"flink_deps_http_bytes{labels} {stats['bytes']}")
+        metric('flink_deps_http_retries', 'gauge', 'Requests retried after a failure')
+        for kind, count in data['retries'].items():
+            lines.append(f"flink_deps_http_retries{self._labels(command=command, kind=kind)} {count}")
+        metric('flink_deps_http_hedges', 'gauge', 'Requests hedged to another mirror after the first was slow')
+        for kind, count in data['hedges'].items():
+            lines.append(f"flink_deps_http_hedges{self._labels(command=command, kind=kind)} {count}")
+        
+        if data['cache'] is not None:
+            metric('flink_deps_cache_lookups', 'gauge', 'Metadata cache lookups by outcome')
+            for outcome in ('hits', 'revalidated', 'misses'):
+                lines.append(f"flink_deps_cache_lookups{self._labels(command=command, outcome=outcome)} "
+                             f"{data['cache'].get(outcome, 0)}")
+            if data['cache']['hit_ratio'] is not None:
+                metric('flink_deps_cache_hit_ratio', 'gauge', 'Share of metadata lookups served from the cache')
+                lines.append(f"flink_deps_cache_hit_ratio{self._labels(command=command)} "
+                             f"{data['cache']['hit_ratio']}")
+        return '\n'.join(lines) + '\n'
+    
+    def write_prometheus(self, path: str, command: str):
+        """Write a node_exporter textfile; the rename keeps scrapes from seeing a partial file"""
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=str(target.parent), prefix='.tmp-', suffix='.prom')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.to_prometheus(command))
+            os.replace(tmp_name, target)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+    
+    def summary_lines(self) -> List[str]:
+        """Human readable digest of the run for the console"""
+        data = self.to_dict()
+        lines = [f"Wall time: {data['wall_seconds']:.3f}s"]
+        for phase, stats in sorted(data['spans'].items(), key=lambda item: -item[1]['self_seconds']):
+            lines.append(f"  {phase:<14} {stats['self_seconds']:>9.3f}s self {stats['seconds']:>9.3f}s total "
+                         f"{stats['calls']:>7} calls")
+        for stats in data['requests']:
+            mean = stats['seconds'] / stats['count'] if stats['count'] else 0.0
+            lines.append(f"  {stats['kind']:<8} {stats['host']:<28} {stats['count']:>6} req "
+                         f"{mean * 1000:>8.1f}ms avg {stats['bytes'] / 1048576:>8.2f}MB")
+        if data['retries']:
+            lines.append("  Retries: " + ', '.join(f"{kind} {count}" for kind, count in data['retries'].items()))
+        if data['hedges']:
+            lines.append("  Hedges: " + ', '.join(f"{kind} {count}" for kind, count in data['hedges'].items()))
+        if data['cache'] is not None and data['cache']['hit_ratio'] is not None:
+            lines.append(f"  Metadata cache hit ratio: {data['cache']['hit_ratio']:.1%}")
+        return lines
+
+
+class StackSampler:
+    """Samples the stacks of every thread at a fixed interval for flamegraphs.
+    
+    cProfile only sees the thread that enabled it, while most of the network
+    and parsing time is spent in worker pools; sampling covers all threads.
+    Stacks are written in the collapsed format read by flamegraph.pl and
+    speedscope, with the thread pool name as the root frame.
+    """
+    
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Fold pool workers (maven-metadata_3) into one root per pool
+                root = re.sub(r'_\d+$', '', names.get(thread_id, 'thread'))
+                stack.append(root)
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+    
+    def write_collapsed(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+
+
+class MavenVersion:
+    """A version string ordered the way Maven's ComparableVersion orders it.
+    
+    Versions are split into numeric and qualifier items (``1.2.0-rc1`` becomes
+    ``[1, 2, [rc, [1]]]``) and trailing null items are dropped, so ``1.0`` equals
+    ``1`` and ``1.0-ga`` equals ``1.0``. Use ``maven_version()`` to get a
+    memoized instance instead of constructing one directly.
+    """
+    
+    # Known qualifiers in ascending order; '' is a release, anything unknown
+    # sorts after 'sp' alphabetically
+    QUALIFIERS = ('alpha', 'beta', 'milestone', 'rc', 'snapshot', '', 'sp')
+    ALIASES = {'ga': '', 'final': '', 'release': '', 'cr': 'rc'}
+    SHORT_QUALIFIERS = {'a': 'alpha', 'b': 'beta', 'm': 'milestone'}
+    PRERELEASE_QUALIFIERS = frozenset(('alpha', 'beta', 'milestone', 'rc', 'snapshot', 'preview', 'ea', 'dev'))
+    _RELEASE_INDEX = str(QUALIFIERS.index(''))
+    
+    __slots__ = ('original', 'items', 'numeric_prefix', 'is_snapshot', 'is_prerelease', '_hash')
+    
+    def __init__(self, version: str):
+        self.original = version
+        self.items = self._parse(version.lower())
+        # Leading numeric items decide most comparisons; sorting on this tuple
+        # first keeps the Python-level comparator off the hot path
+        prefix = []
+        for item in self.items:
+            if not isinstance(item, int):
+                break
+            prefix.append(item)
+        while prefix and prefix[-1] == 0:
+            prefix.pop()
+        self.numeric_prefix = tuple(prefix)
+        qualifiers = set(self._qualifiers(self.items))
+        self.is_snapshot = 'snapshot' in qualifiers
+        self.is_prerelease = bool(qualifiers & self.PRERELEASE_QUALIFIERS)
+        self._hash = hash(self._canonical(self.items))
+    
+    @classmethod
+    def _string_item(cls, value: str, followed_by_digit: bool) -> str:
+        if followed_by_digit and value in cls.SHORT_QUALIFIERS:
+            value = cls.SHORT_QUALIFIERS[value]
+        return cls.ALIASES.get(value, value)
+    
+    @classmethod
+    def _parse(cls, version: str) -> list:
+        """Port of ComparableVersion.parseVersion: ints, qualifier strings and nested lists"""
+        items: list = []
+        current = items
+        stack = [items]
+        is_digit = False
+        start = 0
+        
+        def new_sublist():
+            nonlocal current
+            sublist: list = []
+            current.append(sublist)
+            current = sublist
+            stack.append(sublist)
+        
+        def parse_item(digit: bool, token: str):
+            return int(token) if digit else cls._string_item(token, False)
+        
+        for i, c in enumerate(version):
+            if c == '.' or c == '-':
+                current.append(0 if i == start else parse_item(is_digit, version[start:i]))
+                start = i + 1
+                if c == '-':
+                    new_sublist()
+            elif c.isdigit():
+                if not is_digit and i > start:
+                    # 1.0.0.X1 < 1.0.0-X2: treat a qualifier followed by digits as a sublist
+                    if current:
+                        new_sublist()
+                    current.append(cls._string_item(version[start:i], True))
+                    start = i
+                    new_sublist()
+                is_digit = True
+            else:
+                if is_digit and i > start:
+                    current.append(parse_item(True, version[start:i]))
+                    start = i
+                    new_sublist()
+                is_digit = False
+        
+        if len(version) > start:
+            if not is_digit and current:
+                new_sublist()
+            current.append(parse_item(is_digit, version[start:]))
+        
+        while stack:
+            cls._normalize(stack.pop())
+        return items
+    
+    @staticmethod
+    def _is_null(item) -> bool:
+        return item == 0 or item == '' or item == []
+    
+    @classmethod
+    def _normalize(cls, items: list):
+        """Drop trailing null items (0, '' and empty lists) before the last sublist"""
+        for i in range(len(items) - 1, -1, -1):
+            if cls._is_null(items[i]):
+                del items[i]
+            elif not isinstance(items[i], list):
+                break
+    
+    @classmethod
+    def _qualifiers(cls, items: list):
+        for item in items:
+            if isinstance(item, list):
+                yield from cls._qualifiers(item)
+            elif isinstance(item, str):
+                yield item
+    
+    @classmethod
+    def _canonical(cls, items: list) -> tuple:
+        return tuple(cls._canonical(item) if isinstance(item, list) else item for item in items)
+    
+    @classmethod
+    def _comparable_qualifier(cls, qualifier: str) -> str:
+        if qualifier in cls.QUALIFIERS:
+            return str(cls.QUALIFIERS.index(qualifier))
+        return f"{len(cls.QUALIFIERS)}-{qualifier}"
+    
+    @classmethod
+    def _compare_item(cls, left, right) -> int:
+        """Compare one item with another item or with None (padding)"""
+        if isinstance(left, int):
+            if right is None:
+                return 0 if left == 0 else 1
+            if isinstance(right, int):
+                return (left > right) - (left < right)
+            return 1  # ints sort after qualifiers and sublists
+        if isinstance(left, str):
+            if right is None:
+                a, b = cls._comparable_qualifier(left), cls._RELEASE_INDEX
+            elif isinstance(right, str):
+                a, b = cls._comparable_qualifier(left), cls._comparable_qualifier(right)
+            else:
+                return -1  # qualifiers sort before ints and sublists
+            return (a > b) - (a < b)
+        # left is a sublist
+        if right is None:
+            return cls._compare_item(left[0], None) if left else 0
+        if isinstance(right, int):
+            return -1
+        if isinstance(right, str):
+            return 1
+        for i in range(max(len(left), len(right))):
+            l = left[i] if i < len(left) else None
+            r = right[i] if i < len(right) else None
+            if l is None:
+                result = 0 if r is None else -cls._compare_item(r, None)
+            else:
+                result = cls._compare_item(l, r)
+            if result:
+                return result
+        return 0
+    
+    def compare(self, other: 'MavenVersion') -> int:
+        """Return -1, 0 or 1 like Java's compareTo"""
+        return self._compare_item(self.items, other.items)
+    
+    def __lt__(self, other: 'MavenVersion') -> bool:
+        return self.compare(other) < 0
+    
+    def __le__(self, other: 'MavenVersion') -> bool:
+        return self.compare(other) <= 0
+    
+    def __gt__(self, other: 'MavenVersion') -> bool:
+        return self.compare(other) > 0
+    
+    def __ge__(self, other: 'MavenVersion') -> bool:
+        return self.compare(other) >= 0
+    
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MavenVersion) and self.compare(other) == 0
+    
+    def __hash__(self) -> int:
+        return self._hash
+    
+    def __repr__(self) -> str:
+        return f"MavenVersion({self.original!r})"
+    
+    @property
+    def sort_key(self) -> Tuple[Tuple[int, ...], 'MavenVersion']:
+        """Key that sorts in Maven order while comparing mostly native tuples"""
+        return (self.numeric_prefix, self)
+
+
+@functools.lru_cache(maxsize=None)
+def maven_version(version: str) -> MavenVersion:
+    """Parse a version string once; every caller shares the memoized result"""
+    return MavenVersion(version)
+
+
+class VersionRange:
+    """Inclusive version bounds compiled from a compatibility rule"""
+    
+    __slots__ = ('low', 'high', 'allowed')
+    
+    def __init__(self, low: MavenVersion = None, high: MavenVersion = None, allowed: bool = True):
+        self.low = low
+        self.high = high
+        self.allowed = allowed
+    
+    def contains(self, version: MavenVersion) -> bool:
+        if not self.allowed:
+            return False
+        if self.low is not None and version.sort_key < self.low.sort_key:
+            return False
+        if self.high is not None and version.sort_key > self.high.sort_key:
+            return False
+        return True
+
+
+VersionRange.ANY = VersionRange()
+VersionRange.NONE = VersionRange(allowed=False)
+
+
+class VersionIndex:
+    """All published versions of one artifact, parsed once and sorted.
+    
+    Versions are ordered by their compatibility form (see
+    ``CompatibilityMatrix.clean_version``) and then by the raw Maven version,
+    so the latest version inside a compatibility range is found with a binary
+    search instead of testing every release.
+    """
+    
+    __slots__ = ('versions', '_keys', '_raw', '_latest_cache')
+    
+    def __init__(self, versions: Iterable[str], clean=None):
+        clean = clean or (lambda v: v)
+        entries = []
+        # A dict is already de-duplicated (MavenMetadata.parse hands one over)
+        for v in (versions if isinstance(versions, dict) else dict.fromkeys(versions)):
+            raw = maven_version(v)
+            entries.append(((maven_version(clean(v)).sort_key, raw.sort_key), v, raw))
+        entries.sort(key=lambda entry: entry[0])
+        self.versions = [v for _, v, _ in entries]
+        self._keys = [key[0] for key, _, _ in entries]
+        self._raw = [raw for _, _, raw in entries]
+        self._latest_cache: Dict[bool, Optional[str]] = {}
+    
+    def __len__(self) -> int:
+        return len(self.versions)
+    
+    def _eligible(self, i: int, include_prereleases: bool) -> bool:
+        raw = self._raw[i]
+        return not raw.is_snapshot and (include_prereleases or not raw.is_prerelease)
+    
+    def latest(self, include_prereleases: bool = False) -> Optional[str]:
+        """Latest non-snapshot version, skipping pre-releases unless requested"""
+        if include_prereleases not in self._latest_cache:
+            self._latest_cache[include_prereleases] = next(
+                (self.versions[i] for i in range(len(self.versions) - 1, -1, -1)
+                 if self._eligible(i, include_prereleases)), None)
+        return self._latest_cache[include_prereleases]
+    
+    def latest_in(self, version_range: VersionRange, include_prereleases: bool = False) -> Optional[str]:
+        """Latest eligible version inside a range, found by bisecting on the upper bound"""
+        if not version_range.allowed:
+            return None
+        if version_range.low is None and version_range.high is None:
+            return self.latest(include_prereleases)
+        
+        end = len(self._keys)
+        if version_range.high is not None:
+            end = bisect.bisect_right(self._keys, version_range.high.sort_key)
+        low_key = version_range.low.sort_key if version_range.low is not None else None
+        for i in range(end - 1, -1, -1):
+            if low_key is not None and self._keys[i] < low_key:
+                break
+            if self._eligible(i, include_prereleases):
+                return self.versions[i]
+        return None
+
+    def eligible(self, include_prereleases: bool = False, version_range: VersionRange = None) -> List[str]:
+        """Eligible versions in ascending order, bisected down to a range when one is given"""
+        start, end = 0, len(self._keys)
+        if version_range is not None:
+            if not version_range.allowed:
+                return []
+            if version_range.low is not None:
+                start = bisect.bisect_left(self._keys, version_range.low.sort_key)
+            if version_range.high is not None:
+                end = bisect.bisect_right(self._keys, version_range.high.sort_key)
+        return [self.versions[i] for i in range(start, end) if self._eligible(i, include_prereleases)]
+
+
+class DependencyRules:
+    """Classification and compatibility rules loaded from dependency-rules.json.
+    
+    Classifier rules are compiled into a trie keyed by groupId segments. Each
+    node holds exact artifactId rules and glob rules in file order. A lookup
+    walks the groupId and takes the deepest node with a matching rule, exact
+    before glob. The compiled form is cached on disk and rebuilt when the
+    rules file's mtime or size changes.
+    """
+    
+    DEFAULT_FILE = Path(__file__).resolve().parent / 'dependency-rules.json'
+    COMPILED_VERSION = 4
+    
+    _loaded: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+    
+    def __init__(self, compiled: Dict[str, Any], path: Path = None):
+        self.path = path
+        self.trie = compiled['trie']
+        self.compatibility = compiled['compatibility']
+        self.kafka_brokers = compiled['kafka_brokers']
+        self.problems = compiled['problems']
+        self.rule_count = compiled['rule_count']
+        # {family name: DependencyFamily.to_dict()}, overridden by families in the versions file
+        self.families = compiled['families']
+        self._memo: Dict[Tuple[str, str], str] = {}
+    
+    @classmethod
+    def load(cls, path: str = None, cache_dir: str = None, logger: Logger = None) -> 'DependencyRules':
+        """Load compiled rules, recompiling only when the rules file changed"""
+        rules_path = Path(path) if path else cls.DEFAULT_FILE
+        if not rules_path.exists():
+            raise FileNotFoundError(f"Rules file not found: {rules_path}")
+        stat = rules_path.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        key = str(rules_path.resolve())
+        
+        loaded = cls._loaded.get(key)
+        if loaded is not None and loaded[0] == stamp:
+            return cls(loaded[1], rules_path)
+        
+        compiled = None
+        cache_file = None
+        if cache_dir:
+            digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+            # JSON, not pickle: the cache directory is shared, and reading it must never run code
+            cache_file = Path(cache_dir) / 'rules' / f"{rules_path.stem}-{digest}.json"
+            try:
+                with open(cache_file, 'r') as f:
+                    cached = json.load(f)
+                if cached.get('stamp') == list(stamp) and cached.get('version') == cls.COMPILED_VERSION:
+                    compiled = cls._thaw(cached['compiled'])
+            except (OSError, ValueError, KeyError, TypeError, AttributeError, re.error):
+                compiled = None
+        
+        if compiled is None:
+            compiled = cls.compile(rules_path)
+            # Problems are reported whenever the rules are recompiled
+            if logger is not None:
+                for problem in compiled['problems']:
+                    logger.warning(f"Rules: {problem}")
+            if cache_file is not None:
+                try:
+                    cache_file.parent.mkdir(parents=True, exist_ok=True)
+                    MetadataCache._write_atomic(cache_file, json.dumps(
+                        {'version': cls.COMPILED_VERSION, 'stamp': stamp,
+                         'compiled': cls._freeze(compiled)}).encode('utf-8'))
+                except OSError as e:
+                    if logger is not None:
+                        logger.debug(f"Could not cache compiled rules: {e}")
+        
+        cls._loaded[key] = (stamp, compiled)
+        return cls(compiled, rules_path)
+    
+    @classmethod
+    def _freeze(cls, compiled: Dict[str, Any]) -> Dict[str, Any]:
+        """JSON-safe copy of compiled rules: glob regexes are stored as their pattern"""
+        def node(trie: Dict[str, Any]) -> Dict[str, Any]:
+            return {
+                'children': {segment: node(child) for segment, child in trie['children'].items()},
+                'exact': trie['exact'],
+                'globs': [(artifact, regex.pattern, dep_type, label) for artifact, regex, dep_type, label in trie['globs']]
+            }
+        return dict(compiled, trie=node(compiled['trie']))
+    
+    @classmethod
+    def _thaw(cls, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Inverse of _freeze"""
+        def node(trie: Dict[str, Any]) -> Dict[str, Any]:
+            return {
+                'children': {segment: node(child) for segment, child in trie['children'].items()},
+                'exact': {artifact: tuple(rule) for artifact, rule in trie['exact'].items()},
+                'globs': [(artifact, re.compile(pattern), dep_type, label)
+                          for artifact, pattern, dep_type, label in trie['globs']]
+            }
+        compatibility = {key: {dep_type: tuple(bounds) for dep_type, bounds in rules.items()}
+                         for key, rules in data['compatibility'].items()}
+        return dict(data, trie=node(data['trie']), compatibility=compatibility)
+    
+    @staticmethod
+    def _object_pairs(problems: List[str]):
+        """json hook that records duplicate keys instead of silently keeping the last one"""
+        def hook(pairs):
+            result = {}
+            for key, value in pairs:
+                if key in result:
+                    kind = "duplicate" if result[key] == value else "ambiguous"
+                    problems.append(f"{kind} key '{key}' (last definition wins)")
+                result[key] = value
+            return result
+        return hook
+    
+    @classmethod
+    def compile(cls, path: Path) -> Dict[str, Any]:
+        """Parse the rules file into the trie and parsed compatibility ranges"""
+        problems: List[str] = []
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f, object_pairs_hook=cls._object_pairs(problems))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in rules file {path}: {e}")
+        
+        trie = cls._new_node()
+        produced_types = set()
+        for number, rule in enumerate(data.get('classifiers', []), 1):
+            group = rule.get('group', '')
+            artifact = rule.get('artifact', '*')
+            dep_type = rule.get('type')
+            if not dep_type:
+                problems.append(f"classifier #{number} has no type")
+                continue
+            produced_types.add(dep_type)
+            label = f"#{number} ({group or '*'}:{artifact} -> {dep_type})"
+            
+            node = trie
+            for segment in (group.split('.') if group else []):
+                node = node['children'].setdefault(segment, cls._new_node())
+            
+            if not any(ch in artifact for ch in '*?['):
+                previous = node['exact'].get(artifact)
+                if previous is not None:
+                    kind = "duplicate" if previous[0] == dep_type else "ambiguous"
+                    problems.append(f"{kind} classifier {label} repeats {previous[1]}")
+                    continue
+                node['exact'][artifact] = (dep_type, label)
+                continue
+            
+            # A glob is shadowed when an earlier glob on the same groupId matches everything it could
+            shadowing = next((g for g in node['globs'] if fnmatch.fnmatchcase(artifact, g[0])), None)
+            if shadowing is not None:
+                kind = "duplicate" if shadowing[0] == artifact and shadowing[2] == dep_type else "shadowed"
+                problems.append(f"{kind} classifier {label}: never reached after {shadowing[3]}")
+                continue
+            node['globs'].append((artifact, re.compile(fnmatch.translate(artifact)), dep_type, label))
+        
+        compatibility = {}
+        parents = {}
+        for flink_key, type_rules in data.get('compatibility', {}).items():
+            compatibility[flink_key] = {}
+            for dep_type, spec in type_rules.items():
+                if dep_type == 'note':
+                    continue
+                if dep_type == 'extends':
+                    parents[flink_key] = spec
+                    continue
+                bounds = spec.get('range') if isinstance(spec, dict) else spec
+                if not isinstance(bounds, list) or len(bounds) != 2:
+                    problems.append(f"compatibility rule {flink_key}/{dep_type} needs a [min, max] range")
+                    continue
+                compatibility[flink_key][dep_type] = tuple(bounds)
+                if dep_type not in produced_types:
+                    problems.append(f"compatibility rule {flink_key}/{dep_type} is never produced by a classifier")
+        
+        # A Flink version may extend another and override only the ranges that changed
+        def inherited(flink_key: str, seen: Tuple[str, ...]) -> Dict[str, Tuple[str, str]]:
+            parent = parents.get(flink_key)
+            if parent is None:
+                return compatibility[flink_key]
+            if parent not in compatibility or parent in seen:
+                problems.append(f"compatibility rule {flink_key} extends unknown or cyclic {parent}")
+                return compatibility[flink_key]
+            return {**inherited(parent, seen + (parent,)), **compatibility[flink_key]}
+        compatibility = {key: inherited(key, (key,)) for key in compatibility}
+        
+        brokers = data.get('kafka_brokers', {})
+        kafka_brokers = {
+            'default': brokers.get('default'),
+            'environments': dict(brokers.get('environments', {})),
+            'constrains': list(brokers.get('constrains', ['kafka', 'kafka-clients']))
+        }
+        for dep_type in kafka_brokers['constrains']:
+            if dep_type not in produced_types:
+                problems.append(f"kafka_brokers constrains {dep_type}, which no classifier produces")
+        
+        families = {}
+        for name, spec in data.get('families', {}).items():
+            try:
+                families[name] = DependencyFamily.from_dict(name, spec, 'rules').to_dict()
+            except ValueError as e:
+                problems.append(f"family {name}: {e}")
+        
+        return {
+            'trie': trie,
+            'compatibility': compatibility,
+            'kafka_brokers': kafka_brokers,
+            'families': families,
+            'problems': problems,
+            'rule_count': len(data.get('classifiers', []))
+        }
+    
+    @staticmethod
+    def _new_node() -> Dict[str, Any]:
+        return {'children': {}, 'exact': {}, 'globs': []}
+    
+    def classify(self, group_id: str, artifact_id: str) -> str:
+        """Dependency type for a coordinate, or 'unknown'"""
+        key = (group_id, artifact_id)
+        dep_type = self._memo.get(key)
+        if dep_type is not None:
+            return dep_type
+        
+        # Collect the nodes along the groupId path, then search deepest first
+        path = [self.trie]
+        node = self.trie
+        for segment in group_id.lower().split('.'):
+            node = node['children'].get(segment)
+            if node is None:
+                break
+            path.append(node)
+        
+        artifact = artifact_id.lower()
+        dep_type = 'unknown'
+        for node in reversed(path):
+            exact = node['exact'].get(artifact)
+            if exact is not None:
+                dep_type = exact[0]
+                break
+            match = next((glob for glob in node['globs'] if glob[1].match(artifact)), None)
+            if match is not None:
+                dep_type = match[2]
+                break
+        
+        self._memo[key] = dep_type
+        return dep_type
+
+
+class CompatibilityTarget:
+    """A Flink version or Kafka broker that dependencies are evaluated against.
+    
+    Targets are written as ``flink-<version>``, ``kafka-<environment>`` (broker of
+    an environment under kafka-setup/manifests), ``kafka-all`` (every such
+    environment) or ``kafka-<version>`` (a broker version directly).
+    """
+    
+    # Relative to the repository checkout; absent (and only needed for kafka- targets) inside the image build
+    DEFAULT_MANIFESTS_DIR = Path(os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'kafka-setup', 'manifests')))
+    
+    def __init__(self, name: str, kind: str, version: str, source: str = None):
+        self.name = name
+        self.kind = kind  # 'flink' or 'kafka'
+        self.version = version
+        self.source = source  # where a broker version came from
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {'name': self.name, 'kind': self.kind, 'version': self.version, 'source': self.source}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'CompatibilityTarget':
+        """Create from dictionary"""
+        return cls(data['name'], data['kind'], data['version'], data.get('source'))
+    
+    @staticmethod
+    def kafka_environments(manifests_dir: Path = None) -> Dict[str, Dict[str, str]]:
+        """Kafka environments found under kafka-setup/manifests, with their cluster name and bootstrap servers"""
+        manifests_dir = Path(manifests_dir) if manifests_dir else CompatibilityTarget.DEFAULT_MANIFESTS_DIR
+        environments = {}
+        if not manifests_dir.is_dir():
+            return environments
+        for manifest in sorted(manifests_dir.glob('*/kafka-setup.yaml')):
+            text = manifest.read_text()
+            details = {}
+            for key, env_var in (('cluster', 'KAFKA_CLUSTERS_0_NAME'),
+                                 ('bootstrap', 'KAFKA_CLUSTERS_0_BOOTSTRAPSERVERS')):
+                match = re.search(rf'name:\s*{env_var}\s*\n\s*value:\s*"?([^"\n]+)"?', text)
+                if match:
+                    details[key] = match.group(1).strip()
+            environments[manifest.parent.name] = details
+        return environments
+    
+    @classmethod
+    def parse(cls, specs: str, rules: DependencyRules, manifests_dir: str = None,
+              broker_versions: Dict[str, str] = None) -> List['CompatibilityTarget']:
+        """Parse a comma-separated target list"""
+        broker_versions = broker_versions or {}
+        targets: List[CompatibilityTarget] = []
+        environments = None
+        
+        def broker(environment: str) -> 'CompatibilityTarget':
+            # The manifests name the brokers but do not record their version
+            if environment in broker_versions:
+                version, source = broker_versions[environment], 'command line'
+            elif environment in rules.kafka_brokers['environments']:
+                version, source = rules.kafka_brokers['environments'][environment], 'rules file'
+            elif rules.kafka_brokers['default']:
+                version, source = rules.kafka_brokers['default'], 'default'
+            else:
+                raise ValueError(f"No broker version for Kafka environment {environment}; "
+                                 f"pass --broker-version {environment}=<version>")
+            return cls(f"kafka-{environment}", 'kafka', version, source)
+        
+        for spec in (s.strip() for s in specs.split(',')):
+            if not spec:
+                continue
+            if spec.startswith('flink-'):
+                if spec not in rules.compatibility:
+                    raise ValueError(f"No compatibility rules for {spec} "
+                                     f"(known: {', '.join(sorted(rules.compatibility))})")
+                targets.append(cls(spec, 'flink', spec[len('flink-'):]))
+            elif spec.startswith('kafka-'):
+                name = spec[len('kafka-'):]
+                if name[:1].isdigit():
+                    targets.append(cls(spec, 'kafka', name, 'command line'))
+                    continue
+                if environments is None:
+                    environments = cls.kafka_environments(manifests_dir)
+                if name == 'all':
+                    if not environments:
+                        raise ValueError(f"No Kafka environments found under "
+                                         f"{manifests_dir or cls.DEFAULT_MANIFESTS_DIR}")
+                    targets.extend(broker(environment) for environment in environments)
+                elif name in environments or name in broker_versions:
+                    targets.append(broker(name))
+                else:
+                    raise ValueError(f"Unknown Kafka environment {name} "
+                                     f"(known: {', '.join(environments) or 'none'})")
+            else:
+                raise ValueError(f"Unknown target {spec}; use flink-<version>, kafka-<environment>, "
+                                 "kafka-all or kafka-<version>")
+        
+        # Keep the first occurrence of each target so kafka-all does not duplicate named environments
+        unique: Dict[str, CompatibilityTarget] = {}
+        for target in targets:
+            unique.setdefault(target.name, target)
+        return list(unique.values())
 
 
 class CompatibilityMatrix:
     """Manages compatibility rules for Flink dependencies"""
     
-    def __init__(self, logger: Logger = None):
+    def __init__(self, logger: Logger = None, rules: DependencyRules = None):
         self.logger = logger
-        self.rules = {
-            'flink-2.0.0': {
-                # Kafka ecosystem - based on Kafka broker version 3.8.1
-                'kafka': ('3.6.0', '3.8.1'),  # Kafka broker/server libraries must match broker version
-                'kafka-clients': ('3.6.0', '3.8.1'),  # Must be compatible with Kafka broker 3.8.1
-                'schema-registry': ('7.4.0', '8.99.99'),  # Confluent Schema Registry compatibility (separate versioning)
-                
-                # Flink connectors - official Flink 2.0.0 versions  
-                'flink-connector': ('4.0.0', '4.99.99'),  # Flink 2.0.0 uses 4.0.0-2.0 format
-                
-                # Avro and schema registry - based on Flink 2.0.0 docs
-                'avro': ('1.11.0', '2.99.99'),  # Allow both external Avro and Flink native versions
-                'confluent-avro': ('2.0.0', '7.99.99'),  # Allow Flink native and Confluent versions
-                'schema-registry': ('7.4.0', '8.99.99'),  # Confluent Schema Registry compatibility
-                
-                # JSON processing - Jackson versions compatible with Flink 2.0.0
-                'jackson': ('2.15.0', '2.18.99'),  # Jackson 2.15+ for Java compatibility
-                'jackson-core': ('2.15.0', '2.18.99'),
-                'jackson-databind': ('2.15.0', '2.18.99'),
-                'jackson-annotations': ('2.15.0', '2.18.99'),
-                
-                # Scala - Flink 2.0.0 uses Scala 2.12
-                'scala': ('2.12.0', '2.12.99'),
-                'scala-library': ('2.12.0', '2.12.99'),
+        self._ranges: Dict[Tuple[str, str], VersionRange] = {}
+        rules = rules or DependencyRules.load(logger=logger)
+        # {'flink-<version>': {dependency type: (min, max)}}, loaded from dependency-rules.json
+        self.rules = rules.compatibility
+        # Types whose upper bound is the Kafka broker version
+        self.broker_types = set(rules.kafka_brokers['constrains'])
                 
-                # Google libraries - liberal ranges for utility libraries
-                'google-guava': ('30.0', '35.99.99'),  # Google Guava broad compatibility
-                'google-auth': ('1.0.0', '2.99.99'),   # Google Auth libraries
-                'google-cloud': ('1.0.0', '4.99.99'),  # Google Cloud libraries  
-                'google-api': ('1.30.0', '3.99.99'),   # Google API client
-                'google-http': ('1.40.0', '2.99.99'),  # Google HTTP client
-                'gson': ('2.8.0', '2.99.99'),          # Google JSON library
-                'jsr305': ('1.0.0', '3.99.99'),        # JSR305 annotations (stable)
-                'failureaccess': ('1.0.0', '1.99.99'), # Guava dependency
-                'listenablefuture': ('1.0', '9999.99.99'), # Empty jar, version irrelevant
-                'protobuf': ('3.19.0', '4.99.99'),     # Protocol Buffers
-                'grpc': ('1.50.0', '1.99.99'),         # gRPC broader range
-                'perfmark': ('0.25.0', '0.99.99'),     # Performance marking
-                
-                # Hadoop ecosystem - compatible with Flink 2.0.0
-                'hadoop': ('3.3.0', '3.99.99'),
-                'hadoop-client': ('3.3.0', '3.99.99'),
-                'hadoop-common': ('3.3.0', '3.99.99'),
-                
-                # Logging - standard logging libraries
-                'slf4j': ('1.7.30', '2.99.99'),
-                'logback': ('1.2.10', '1.99.99'),
-                'log4j': ('2.17.0', '2.99.99'),
-                
-                # Apache commons - stable utility libraries
-                'commons-lang3': ('3.12.0', '3.99.99'),
-                'commons-cli': ('1.5.0', '1.99.99'),
-                'commons-io': ('2.11.0', '2.99.99'),
-                'commons-compress': ('1.20.0', '1.99.99'),
-                
-                # Compression libraries - broad compatibility
-                'snappy': ('1.1.8', '1.99.99'),
-                'lz4': ('1.8.0', '1.99.99'),
-                'zstd': ('1.5.0', '1.99.99'),
-                
-                # Netty - network library
-                'netty': ('4.1.90', '4.1.99'),
-                
-                # OpenCensus/Observability - monitoring libraries
-                'opencensus': ('0.28.0', '0.99.99'),
-                
-                # Miscellaneous - stable formats and utilities
-                'snakeyaml': ('1.30.0', '2.99.99'),
-                'swagger': ('2.2.0', '2.99.99'),
-                
-                # Other connectors and formats - broad compatibility
-                'elasticsearch': ('7.17.0', '8.99.99'),
-                'cassandra': ('4.0.0', '5.99.99'),
-                'mongodb': ('4.10.0', '6.99.99'),
-            }
-        }
-    
-    def is_compatible(self, flink_version: str, dependency_type: str, dep_version: str, dep_name: str = '') -> bool:
-        """Check if a dependency version is compatible with Flink version"""
+    def compiled_range(self, flink_version: str, dependency_type: str) -> VersionRange:
+        """Get the compatible range with its bounds parsed once per rule"""
         key = f'flink-{flink_version}'
-        
-        # Special case handling for specific dependencies
-        if dependency_type == 'kafka' and 'schema-registry' in dep_name.lower():
-            # Schema registry client has different versioning
-            dependency_type = 'schema-registry'
-        elif dependency_type == 'kafka' and 'managed-kafka-auth' in dep_name.lower():
-            # Google managed Kafka auth handler has its own versioning
-            dependency_type = 'google-cloud'
-        elif dependency_type == 'jackson' and 'google-http-client' in dep_name.lower():
-            # Google HTTP client Jackson integration has different versioning
-            dependency_type = 'google-http'
+        cache_key = (key, dependency_type)
+        if cache_key in self._ranges:
+            return self._ranges[cache_key]
         
         # If no rules defined for this Flink version, be conservative
         if key not in self.rules:
             self.logger.warning(f"No compatibility rules defined for Flink {flink_version}")
-            return False
-            
+            version_range = VersionRange.NONE
         # If no specific rule for this dependency type, check if it's a known type
-        if dependency_type not in self.rules[key]:
-            if dependency_type == 'unknown':
-                # For unknown types, we can't determine compatibility
-                return False
-            else:
-                # For known types without rules, log warning but allow
-                return True
+        elif dependency_type not in self.rules[key]:
+            # Unknown types cannot be judged; known types without rules are allowed
+            version_range = VersionRange.NONE if dependency_type == 'unknown' else VersionRange.ANY
+        else:
+            min_ver, max_ver = self.rules[key][dependency_type]
+            version_range = VersionRange(self.parse_version(min_ver), self.parse_version(max_ver))
+            
+        self._ranges[cache_key] = version_range
+        return version_range
             
-        min_ver, max_ver = self.rules[key][dependency_type]
+    def parse_version(self, version: str) -> MavenVersion:
+        """Parse a version in the form used for compatibility checks (memoized)"""
+        return maven_version(self._clean_version(version))
         
-        try:
-            # Handle special version formats
-            clean_dep_version = self._clean_version(dep_version)
-            clean_min_version = self._clean_version(min_ver)
-            clean_max_version = self._clean_version(max_ver)
+    def is_compatible(self, flink_version: str, dependency_type: str, dep_version: str) -> bool:
+        """Check if a dependency version is compatible with Flink version"""
+        version_range = self.compiled_range(flink_version, dependency_type)
+        if version_range.low is None and version_range.high is None:
+            return version_range.allowed
             
-            dep_pkg_version = pkg_version.parse(clean_dep_version)
-            min_pkg_version = pkg_version.parse(clean_min_version)
-            max_pkg_version = pkg_version.parse(clean_max_version)
+        is_in_range = version_range.contains(self.parse_version(dep_version))
             
-            is_in_range = min_pkg_version <= dep_pkg_version <= max_pkg_version
+        if not is_in_range:
+            # Log detailed compatibility information
+            self.logger.debug(f"Version {dep_version} is outside compatible range "
+                              f"[{version_range.low.original}, {version_range.high.original}] "
+                              f"for {dependency_type}")
             
-            if not is_in_range:
-                # Log detailed compatibility information
-                if hasattr(self, 'logger'):
-                    self.logger.debug(f"Version {dep_version} is outside compatible range [{min_ver}, {max_ver}] for {dependency_type}")
+        return is_in_range
             
-            return is_in_range
+    def latest_compatible(self, index: VersionIndex, flink_version: str, dependency_type: str,
+                          include_prereleases: bool = False) -> Optional[str]:
+        """Find the latest compatible version in an index with one binary search"""
+        return index.latest_in(self.compiled_range(flink_version, dependency_type), include_prereleases)
             
-        except Exception as e:
-            # Version parsing failed - this is a real issue
-            if hasattr(self, 'logger'):
-                self.logger.warning(f"Failed to parse version {dep_version} for {dependency_type}: {e}")
-            return False
-    
-    def _clean_version(self, version: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _clean_version(version: str) -> str:
         """Clean version string for parsing"""
         # Handle Flink-specific versions like "4.0.0-2.0"
         if '-' in version and version.count('-') == 1:
@@ -208,301 +1072,4019 @@ class CompatibilityMatrix:
                 # This looks like a connector version, keep the first part
                 return parts[0]
         
-        # Handle Maven classifier suffixes like "33.2.1-jre"
-        if '-jre' in version:
-            return version.replace('-jre', '')
-        if '-android' in version:
-            return version.replace('-android', '')
+        # Handle Maven classifier suffixes like "33.2.1-jre"
+        if '-jre' in version:
+            return version.replace('-jre', '')
+        if '-android' in version:
+            return version.replace('-android', '')
+        
+        # Handle special case for listenablefuture empty jar
+        if 'empty-to-avoid-conflict' in version:
+            # Extract the version number before the descriptor
+            parts = version.split('-')
+            if parts and parts[0]:
+                return parts[0]
+            return '9999.0'  # Default high version for empty jar
+        
+        return version
+    
+    def target_range(self, target: CompatibilityTarget, dependency_type: str) -> VersionRange:
+        """Compiled range of a dependency type for one target"""
+        if target.kind == 'flink':
+            return self.compiled_range(target.version, dependency_type)
+        cache_key = (target.name, target.version, dependency_type)
+        if cache_key not in self._ranges:
+            # A broker only bounds the Kafka libraries; everything else is left to the Flink targets
+            self._ranges[cache_key] = (VersionRange(high=self.parse_version(target.version))
+                                       if dependency_type in self.broker_types else VersionRange.ANY)
+        return self._ranges[cache_key]
+    
+    @staticmethod
+    def intersect(ranges: List[VersionRange]) -> VersionRange:
+        """Range satisfying every given range at once"""
+        if not all(r.allowed for r in ranges):
+            return VersionRange.NONE
+        lows = [r.low for r in ranges if r.low is not None]
+        highs = [r.high for r in ranges if r.high is not None]
+        low = max(lows, key=lambda v: v.sort_key) if lows else None
+        high = min(highs, key=lambda v: v.sort_key) if highs else None
+        if low is not None and high is not None and low.sort_key > high.sort_key:
+            return VersionRange.NONE
+        return VersionRange(low, high)
+    
+    def get_compatible_range(self, flink_version: str, dependency_type: str) -> Optional[Tuple[str, str]]:
+        """Get the compatible version range for a dependency"""
+        key = f'flink-{flink_version}'
+        if key in self.rules and dependency_type in self.rules[key]:
+            return self.rules[key][dependency_type]
+        return None
+
+
+class MetadataCache:
+    """Persistent on-disk cache for maven-metadata.xml responses.
+    
+    Entries are keyed by repository, groupId and artifactId and store the raw
+    XML next to the ETag/Last-Modified validators needed for conditional
+    requests. Each entry is guarded by an flock so parallel CI jobs can share
+    one cache directory.
+    """
+    
+    DEFAULT_TTL = 3600  # seconds a cached entry is trusted without revalidation
+    DEFAULT_NEGATIVE_TTL = 300  # seconds a 404 is remembered
+    
+    def __init__(self, cache_dir: str, ttl: int = DEFAULT_TTL, logger: Logger = None,
+                 negative_ttl: int = DEFAULT_NEGATIVE_TTL):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.logger = logger
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0}
+        self._stats_lock = threading.Lock()
+    
+    @staticmethod
+    def default_dir() -> str:
+        """Resolve the default cache directory ($FLINK_DEPS_CACHE_DIR, then XDG)"""
+        if os.environ.get('FLINK_DEPS_CACHE_DIR'):
+            return os.environ['FLINK_DEPS_CACHE_DIR']
+        xdg_cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(xdg_cache, 'flink-deps')
+    
+    def _entry_dir(self, repository: str, group_id: str, artifact_id: str) -> Path:
+        """Directory holding the cached files for one artifact"""
+        parsed = urlparse(repository)
+        repo_digest = hashlib.sha1(repository.rstrip('/').encode('utf-8')).hexdigest()[:12]
+        repo_key = f"{parsed.netloc or 'local'}-{repo_digest}"
+        return self.cache_dir / 'metadata' / repo_key / group_id / artifact_id
+    
+    def record(self, outcome: str):
+        """Count a cache outcome (hits, revalidated or misses)"""
+        with self._stats_lock:
+            self.stats[outcome] += 1
+    
+    @contextmanager
+    def lock(self, repository: str, group_id: str, artifact_id: str):
+        """Hold an exclusive lock on one artifact's cache entry"""
+        entry_dir = self._entry_dir(repository, group_id, artifact_id)
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        with open(entry_dir / '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def load(self, repository: str, group_id: str, artifact_id: str) -> Optional[Dict[str, Any]]:
+        """Load a cached entry, or None if it is missing or unreadable"""
+        entry_dir = self._entry_dir(repository, group_id, artifact_id)
+        try:
+            with open(entry_dir / 'maven-metadata.json', 'r') as f:
+                entry = json.load(f)
+            entry['content'] = (entry_dir / 'maven-metadata.xml').read_bytes()
+        except (OSError, ValueError):
+            return None
+        return entry
+    
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        """Check whether an entry is young enough to use without revalidation"""
+        return time.time() - entry.get('fetched_at', 0) < self.ttl
+    
+    def store(self, repository: str, group_id: str, artifact_id: str, url: str,
+              content: bytes, etag: str = None, last_modified: str = None,
+              sources: Dict[str, Dict[str, Any]] = None, absent: Dict[str, float] = None):
+        """Write an entry; callers must hold the entry lock.
+        
+        With mirrors, ``sources`` holds the validators of each mirror that
+        answered (``{'missing': True}`` for a 404) and ``absent`` the time each
+        mirror that did not may be asked again.
+        """
+        headers = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time()
+        }
+        if sources:
+            headers['sources'] = sources
+        if absent:
+            headers['absent'] = absent
+        self.update(repository, group_id, artifact_id, headers, content)
+    
+    def update(self, repository: str, group_id: str, artifact_id: str, entry: Dict[str, Any],
+               content: bytes = None):
+        """Rewrite an entry's headers, and its body when given, keeping its fetched_at"""
+        entry_dir = self._entry_dir(repository, group_id, artifact_id)
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        if content is not None:
+            self._write_atomic(entry_dir / 'maven-metadata.xml', content)
+        self._write_headers(entry_dir, {k: v for k, v in entry.items() if k != 'content'})
+    
+    def touch(self, repository: str, group_id: str, artifact_id: str, entry: Dict[str, Any]):
+        """Mark an entry as revalidated now (after a 304 Not Modified)"""
+        self.update(repository, group_id, artifact_id, dict(entry, fetched_at=time.time()))
+    
+    def _pom_path(self, group_id: str, artifact_id: str, version: str) -> Path:
+        return self.cache_dir / 'poms' / group_id / artifact_id / f"{artifact_id}-{version}.pom"
+    
+    def load_pom(self, group_id: str, artifact_id: str, version: str) -> Optional[bytes]:
+        """Released POMs never change, so cached copies are used without revalidation"""
+        try:
+            return self._pom_path(group_id, artifact_id, version).read_bytes()
+        except OSError:
+            return None
+    
+    def store_pom(self, group_id: str, artifact_id: str, version: str, content: bytes):
+        path = self._pom_path(group_id, artifact_id, version)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(path, content)
+    
+    def _missing_marker(self, repository: Optional[str], group_id: str, artifact_id: str,
+                        version: str = None) -> Path:
+        if version is None:
+            return self._entry_dir(repository, group_id, artifact_id) / 'missing'
+        return self._pom_path(group_id, artifact_id, version).with_suffix('.missing')
+    
+    def is_missing(self, repository: Optional[str], group_id: str, artifact_id: str, version: str = None) -> bool:
+        """Whether a 404 for metadata (or, with a version, a POM) is younger than the negative TTL"""
+        try:
+            marker = self._missing_marker(repository, group_id, artifact_id, version).stat()
+        except OSError:
+            return False
+        return time.time() - marker.st_mtime < self.negative_ttl
+    
+    def mark_missing(self, repository: Optional[str], group_id: str, artifact_id: str, version: str = None):
+        """Remember a 404 so other runs sharing the cache do not ask again until it expires"""
+        marker = self._missing_marker(repository, group_id, artifact_id, version)
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(marker, b'')
+    
+    def _write_headers(self, entry_dir: Path, headers: Dict[str, Any]):
+        self._write_atomic(entry_dir / 'maven-metadata.json', json.dumps(headers, indent=2).encode('utf-8'))
+    
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        """Write via a temp file and rename so readers never see partial files"""
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+class MavenMetadata:
+    """The parts of an artifact's maven-metadata.xml the manager uses.
+    
+    ``parse`` never builds an ElementTree. Only the text of
+    <versioning><versions><version> and <versioning><lastUpdated> is kept, and
+    the versions go straight into the VersionIndex. Metadata for long-lived
+    artifacts lists thousands of versions, so this saves one Element per
+    version plus the lists that used to be built from the tree.
+    """
+    
+    __slots__ = ('index', 'last_updated')
+    
+    # Repository-generated metadata is plain: no comments, CDATA, entities or
+    # prefixed names. Such documents are scanned by the regex engine in one
+    # pass; anything else goes through the XML parser target below.
+    _VERSION = re.compile(r'<version>\s*([^<\s]+)\s*</version>')
+    _LAST_UPDATED = re.compile(r'<lastUpdated>\s*([^<\s]+)\s*</lastUpdated>')
+    _LAST_UPDATED_BYTES = re.compile(rb'<lastUpdated>\s*([^<\s]+)\s*</lastUpdated>')
+    _NOT_PLAIN = ('<!', '&', 'xmlns:')
+    
+    def __init__(self, index: Optional[VersionIndex], last_updated: str = None):
+        self.index = index  # None when no versions are published
+        self.last_updated = last_updated  # yyyyMMddHHmmss as written by the repository
+    
+    class _Target:
+        """XMLParser target collecting versions without building elements"""
+        
+        def __init__(self):
+            self.path: List[str] = []
+            self.text: List[str] = []
+            self.versions: Dict[str, None] = {}  # ordered and de-duplicated
+            self.last_updated: Optional[str] = None
+        
+        def start(self, tag: str, attrib: Dict[str, str]):
+            self.path.append(tag.rpartition('}')[2])
+            self.text.clear()
+        
+        def data(self, data: str):
+            self.text.append(data)
+        
+        def end(self, tag: str):
+            path = self.path
+            if len(path) >= 3 and path[-1] == 'version' and path[-2] == 'versions' and path[-3] == 'versioning':
+                version = ''.join(self.text).strip()
+                if version:
+                    self.versions[version] = None
+            elif len(path) >= 2 and path[-1] == 'lastUpdated' and path[-2] == 'versioning':
+                self.last_updated = ''.join(self.text).strip() or None
+            path.pop()
+            self.text.clear()
+        
+        def close(self):
+            return self
+    
+    @classmethod
+    def _scan_plain(cls, content: bytes) -> Optional[Tuple[Dict[str, None], Optional[str]]]:
+        """Versions and lastUpdated of a plain, complete document, or None to fall back to the parser"""
+        try:
+            text = content.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        # A body cut short must still fail loudly, as the XML parser would make it
+        if not text.rstrip().endswith('</metadata>') or any(marker in text for marker in cls._NOT_PLAIN):
+            return None
+        start = text.find('<versions>')
+        end = text.find('</versions>', start) if start >= 0 else -1
+        versions = dict.fromkeys(cls._VERSION.findall(text, start, end)) if end >= 0 else {}
+        last_updated = cls._LAST_UPDATED.search(text)
+        return versions, last_updated.group(1) if last_updated else None
+    
+    @classmethod
+    def _extract(cls, content: bytes) -> Tuple[Dict[str, None], Optional[str]]:
+        """Versions and lastUpdated of a body, scanned when plain and parsed otherwise"""
+        scanned = cls._scan_plain(content)
+        if scanned is None:
+            parser = ET.XMLParser(target=cls._Target())
+            parser.feed(content)
+            target = parser.close()
+            scanned = target.versions, target.last_updated
+        return scanned
+    
+    @staticmethod
+    def timestamp(last_updated: Optional[str]) -> Optional[float]:
+        """Epoch seconds of a lastUpdated stamp (UTC), or None if it is missing or malformed"""
+        try:
+            return datetime.strptime(last_updated, '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            return None
+    
+    @classmethod
+    def read_last_updated(cls, content: bytes) -> Optional[str]:
+        """The lastUpdated stamp of a body, found without parsing the rest of it"""
+        match = cls._LAST_UPDATED_BYTES.search(content)
+        return match.group(1).decode('utf-8', 'replace') if match else None
+    
+    @classmethod
+    def parse(cls, content: bytes, timings: Timings = None) -> 'MavenMetadata':
+        """Parse a maven-metadata.xml body; raises ET.ParseError when it is malformed"""
+        timings = timings or Timings(enabled=False)
+        with timings.span('parse'):
+            versions, last_updated = cls._extract(content)
+        with timings.span('sort'):
+            index = VersionIndex(versions, clean=CompatibilityMatrix._clean_version) if versions else None
+        return cls(index, last_updated)
+
+    @classmethod
+    def merge(cls, contents: List[bytes]) -> bytes:
+        """One metadata body listing the versions of every body, newest lastUpdated wins.
+        
+        Used when an artifact is published to more than one repository. Only the
+        elements ``parse`` reads are written; raises ET.ParseError like parse.
+        """
+        versions: Dict[str, None] = {}
+        last_updated = None
+        for content in contents:
+            listed, stamp = cls._extract(content)
+            versions.update(listed)
+            if stamp and (last_updated is None or stamp > last_updated):
+                last_updated = stamp
+        root = ET.Element('metadata')
+        versioning = ET.SubElement(root, 'versioning')
+        if last_updated:
+            ET.SubElement(versioning, 'lastUpdated').text = last_updated
+        listed = ET.SubElement(versioning, 'versions')
+        for version in versions:
+            ET.SubElement(listed, 'version').text = version
+        return ET.tostring(root, encoding='utf-8')
+
+
+class MirrorHealth:
+    """Latency and error rate of each repository, used to order and hedge mirrors.
+    
+    Both are exponentially weighted moving averages, so a mirror that starts
+    failing or slows down loses its place within a few requests. The last
+    WINDOW latencies give the percentile after which a request is hedged to
+    the next mirror. Kept in the cache directory between runs.
+    """
+    
+    FORMAT_VERSION = 1
+    ALPHA = 0.2
+    WINDOW = 64
+    DEFAULT_LATENCY = 0.5  # assumed for repositories never contacted
+    DEFAULT_HEDGE_DELAY = 1.0  # until a repository has MIN_SAMPLES latencies
+    MIN_HEDGE_DELAY = 0.02
+    MIN_SAMPLES = 8
+    HEDGE_PERCENTILE = 0.9
+    ERROR_PENALTY = 4.0
+    
+    def __init__(self, path: Path = None):
+        self.path = path
+        self.repositories: Dict[str, Dict[str, Any]] = {}
+        self.changed = False
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def load(cls, path: Path = None) -> 'MirrorHealth':
+        """Read saved health, starting over when the file is missing or from another format"""
+        health = cls(path)
+        if path is None:
+            return health
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return health
+        if data.get('format') == cls.FORMAT_VERSION:
+            for repository, stats in data.get('repositories', {}).items():
+                stats['samples'] = collections.deque(stats.get('samples', []), maxlen=cls.WINDOW)
+                health.repositories[repository] = stats
+        return health
+    
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        with self._lock:
+            data = {'format': self.FORMAT_VERSION,
+                    'repositories': {repository: dict(stats, samples=[round(s, 6) for s in stats['samples']])
+                                     for repository, stats in sorted(self.repositories.items())}}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        MetadataCache._write_atomic(self.path, json.dumps(data, indent=2).encode('utf-8'))
+    
+    def _stats(self, repository: str) -> Dict[str, Any]:
+        stats = self.repositories.get(repository)
+        if stats is None:
+            stats = self.repositories[repository] = {
+                'latency': None, 'errors': 0.0, 'requests': 0, 'failures': 0, 'hedges': 0, 'wins': 0,
+                'samples': collections.deque(maxlen=self.WINDOW)
+            }
+        return stats
+    
+    def record(self, repository: str, seconds: float, failed: bool):
+        """Fold one request into the averages; a failure only moves the error rate"""
+        with self._lock:
+            self.changed = True
+            stats = self._stats(repository)
+            stats['requests'] += 1
+            stats['errors'] += self.ALPHA * ((1.0 if failed else 0.0) - stats['errors'])
+            if failed:
+                stats['failures'] += 1
+                return
+            if stats['latency'] is None:
+                stats['latency'] = seconds
+            else:
+                stats['latency'] += self.ALPHA * (seconds - stats['latency'])
+            stats['samples'].append(seconds)
+    
+    def count(self, repository: str, outcome: str):
+        """Count a hedge sent to, or a race won by, a repository"""
+        with self._lock:
+            self._stats(repository)[outcome] += 1
+    
+    def score(self, repository: str) -> float:
+        """Expected cost of a request, lower is better"""
+        stats = self.repositories.get(repository)
+        if stats is None:
+            return self.DEFAULT_LATENCY
+        latency = stats['latency'] if stats['latency'] is not None else self.DEFAULT_LATENCY
+        return latency * (1 + self.ERROR_PENALTY * stats['errors'])
+    
+    def order(self, repositories: List[str]) -> List[str]:
+        """Repositories from healthiest to least healthy; ties keep the configured order"""
+        with self._lock:
+            return sorted(repositories, key=self.score)
+    
+    def hedge_delay(self, repository: str) -> float:
+        """Seconds to wait for a repository before asking the next mirror as well"""
+        with self._lock:
+            stats = self.repositories.get(repository)
+            samples = sorted(stats['samples']) if stats is not None else []
+        if len(samples) < self.MIN_SAMPLES:
+            return self.DEFAULT_HEDGE_DELAY
+        return max(self.MIN_HEDGE_DELAY, samples[min(len(samples) - 1, int(len(samples) * self.HEDGE_PERCENTILE))])
+    
+    def summary_lines(self) -> List[str]:
+        lines = []
+        with self._lock:
+            repositories = sorted(self.repositories.items(), key=lambda item: self.score(item[0]))
+        for repository, stats in repositories:
+            latency = f"{stats['latency'] * 1000:.1f}ms" if stats['latency'] is not None else 'n/a'
+            lines.append(f"  {repository:<44} {latency:>9} ewma {stats['errors']:>6.1%} errors "
+                         f"{stats['wins']:>5} won {stats['hedges']:>5} hedged")
+        return lines
+
+
+class RequestScheduler:
+    """Paces the requests sent to each repository host with an adaptive token bucket.
+    
+    Hosts start unpaced, up to ``max_rate`` requests per second when one is
+    given. A host is throttling when at least THROTTLE_RATIO of the requests
+    sent to it in the last second were answered 429 (or 503 with Retry-After).
+    Its rate is then cut to DECREASE times what was actually sent, at most
+    once per second. A Retry-After header pauses the host for every thread. The
+    rate grows back by INCREASE requests per second each second (AIMD).
+    Throughput settles just under what each repository tolerates. The odd
+    throttled request only delays its own retry.
+    """
+    
+    MIN_RATE = 1.0
+    INCREASE = 5.0
+    DECREASE = 0.7
+    THROTTLE_RATIO = 0.1
+    WINDOW = 1.0  # seconds of sent requests the current rate is measured over
+    BACKOFF_BASE = 0.5
+    BACKOFF_CAP = 30.0
+    MAX_RETRY_AFTER = 120.0
+    
+    def __init__(self, max_rate: float = None):
+        self.max_rate = max_rate
+        self.throttled = 0
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+    
+    def _host(self, url: str, now: float) -> Dict[str, Any]:
+        host = urlparse(url).netloc
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {
+                'rate': self.max_rate, 'tokens': self.max_rate or 0.0, 'updated': now,
+                'paused_until': 0.0, 'decreased': 0.0, 'sent': collections.deque(),
+                'throttled': collections.deque()
+            }
+        return state
+    
+    def acquire(self, url: str):
+        """Wait until the host serving a URL may be sent another request"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                state = self._host(url, now)
+                elapsed = now - state['updated']
+                state['updated'] = now
+                if state['rate'] is not None:
+                    ceiling = self.max_rate or float('inf')
+                    state['rate'] = min(ceiling, state['rate'] + self.INCREASE * elapsed)
+                    # A bucket holds at most one second of requests
+                    state['tokens'] = min(state['rate'], state['tokens'] + state['rate'] * elapsed)
+                delay = state['paused_until'] - now
+                if delay <= 0 and state['rate'] is not None and state['tokens'] < 1:
+                    delay = (1 - state['tokens']) / state['rate']
+                if delay <= 0:
+                    if state['rate'] is not None:
+                        state['tokens'] -= 1
+                    sent = state['sent']
+                    sent.append(now)
+                    while sent[0] < now - self.WINDOW:
+                        sent.popleft()
+                    return
+            time.sleep(delay)
+    
+    def feedback(self, url: str, response: requests.Response):
+        """Slow a host down when it is throttling the requests sent to it"""
+        retry_after = self.retry_after(response)
+        # Without Retry-After a 503 is an outage rather than a rate limit
+        if response.status_code != 429 and not (response.status_code == 503 and retry_after is not None):
+            return
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            state = self._host(url, now)
+            throttled = state['throttled']
+            throttled.append(now)
+            while throttled[0] < now - self.WINDOW:
+                throttled.popleft()
+            sent = sum(1 for stamp in state['sent'] if stamp >= now - self.WINDOW)
+            if len(throttled) < 2 or len(throttled) < self.THROTTLE_RATIO * sent:
+                return
+            if now - state['decreased'] >= self.WINDOW:
+                if retry_after:
+                    state['paused_until'] = max(state['paused_until'],
+                                                now + min(retry_after, self.MAX_RETRY_AFTER))
+                current = state['rate'] if state['rate'] is not None else sent / self.WINDOW
+                state['rate'] = max(self.MIN_RATE, min(current, sent / self.WINDOW or current) * self.DECREASE)
+                state['tokens'] = 0.0
+                state['decreased'] = now
+    
+    @staticmethod
+    def retry_after(response: Optional[requests.Response]) -> Optional[float]:
+        """Seconds a Retry-After header (delay or HTTP date) asks to wait, if any"""
+        value = response.headers.get('Retry-After', '').strip() if response is not None else ''
+        if not value:
+            return None
+        if value.isdigit():
+            return float(value)
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, when.timestamp() - time.time())
+    
+    @staticmethod
+    def classify(status: Optional[int]) -> str:
+        """Outcome of a failed request: missing, throttled, transient (None: no response) or fatal"""
+        if status in (404, 410):
+            return 'missing'
+        if status in (429, 503):
+            return 'throttled'
+        if status is None or status == 408 or status >= 500:
+            return 'transient'
+        return 'fatal'
+    
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        """Seconds to sleep before retry ``attempt`` (from 1): full jitter, at least Retry-After"""
+        delay = self._random.uniform(0, min(self.BACKOFF_CAP, self.BACKOFF_BASE * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.MAX_RETRY_AFTER))
+        return delay
+
+
+class MavenRepository:
+    """Handles Maven repository interactions.
+    
+    Every artifact is looked up in its own repository plus the configured
+    mirrors, healthiest first. When the preferred mirror has not answered
+    within its usual latency the request is hedged to the next one and the
+    first answer wins, so a slow mirror does not set the tail latency.
+    """
+    
+    DEFAULT_MAX_WORKERS = 16
+    DEFAULT_PER_REPOSITORY_LIMIT = 8
+    
+    def __init__(self, logger: Logger, timeout: int = 30, max_retries: int = 3,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 per_repository_limit: int = DEFAULT_PER_REPOSITORY_LIMIT,
+                 cache: MetadataCache = None, offline: bool = False, timings: Timings = None,
+                 mirrors: List[str] = None, health: MirrorHealth = None, rate_limit: float = None):
+        self.logger = logger
+        self.timings = timings or Timings(enabled=False)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_workers = max(1, max_workers)
+        self.per_repository_limit = max(1, per_repository_limit)
+        self.cache = cache
+        self.offline = offline
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': 'Flink-Dependency-Manager/1.0'
+        })
+        # Size the connection pool to the worker count so concurrent requests
+        # reuse keep-alive connections instead of opening throwaway ones
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._repository_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._repository_slots_lock = threading.Lock()
+        self.mirrors: List[str] = []
+        self.add_mirrors(mirrors or [])
+        self.health = health or MirrorHealth()
+        self.scheduler = RequestScheduler(rate_limit)
+        # Artifacts every repository answered 404 for, until the negative TTL runs out
+        self.negative_ttl = cache.negative_ttl if cache is not None else MetadataCache.DEFAULT_NEGATIVE_TTL
+        self._missing: Dict[Tuple[str, ...], float] = {}
+        self._missing_lock = threading.Lock()
+        # Hedged requests run here so the caller's thread can wait on whichever answers first;
+        # created on the first hedge, so runs without mirrors never start its threads
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        self._hedge_pool_lock = threading.Lock()
+    
+    def add_mirrors(self, mirrors: Iterable[str]):
+        """Add repositories tried for every artifact after its own one"""
+        for mirror in mirrors:
+            mirror = mirror.rstrip('/')
+            if mirror and mirror not in self.mirrors:
+                self.mirrors.append(mirror)
+    
+    def candidates(self, repository: str = None) -> List[str]:
+        """An artifact's repository and the mirrors, healthiest first"""
+        repositories = [(repository or "https://repo1.maven.org/maven2").rstrip('/')]
+        repositories += [mirror for mirror in self.mirrors if mirror != repositories[0]]
+        return self.health.order(repositories) if len(repositories) > 1 else repositories
+    
+    def _attempt(self, repository: str, send) -> requests.Response:
+        """Call send(repository), folding its latency and outcome into the mirror health.
+        
+        The latency includes the wait for a slot on the repository's host, so
+        a mirror we already keep busy looks slower and the load spreads out.
+        """
+        started = time.perf_counter()
+        try:
+            response = send(repository)
+        except Exception:
+            self.health.record(repository, time.perf_counter() - started, failed=True)
+            raise
+        # A 404 only means this repository does not publish the artifact
+        failed = response.status_code >= 400 and RequestScheduler.classify(response.status_code) != 'missing'
+        self.health.record(repository, time.perf_counter() - started, failed)
+        return response
+    
+    @staticmethod
+    def _discard(future):
+        """Close the response of a request that lost the race"""
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+    
+    def _hedge_executor(self) -> ThreadPoolExecutor:
+        """The pool hedged requests run on, started on first use"""
+        with self._hedge_pool_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=self.max_workers * 2,
+                                                      thread_name_prefix='maven-hedge')
+            return self._hedge_pool
+    
+    def hedged(self, repositories: List[str], send, kind: str, gather: bool = False
+               ) -> Tuple[str, requests.Response, List[Tuple[str, requests.Response]]]:
+        """Send a request to the first repository, hedging to the next ones when it is slow.
+        
+        ``send`` is called with a repository base URL and returns its response.
+        The next mirror is asked after the current one's hedge delay, or at once
+        when it fails or does not have the artifact. Returns (repository,
+        response, others): the first successful answer plus any other successful
+        answers already in by then. Without one, a failure worth retrying is
+        returned (or raised) in preference to a 404, so an artifact is only
+        reported missing when no repository could have served it.
+        
+        With ``gather``, the repositories not asked yet are asked once the first
+        answer is in, and all of them get up to that repository's hedge delay
+        to answer. ``others`` then holds every answer, failures included, so a
+        repository missing from it did not answer in time.
+        """
+        if len(repositories) == 1:
+            return repositories[0], self._attempt(repositories[0], send), []
+        
+        pool = self._hedge_executor()
+        queue = list(repositories)
+        pending = {}
+        winner = None
+        others = []
+        fallback = None
+        error = None
+        
+        def launch():
+            repository = queue.pop(0)
+            pending[pool.submit(self._attempt, repository, send)] = repository
+            return repository
+        
+        def keep(repository, response):
+            # Prefer a failure worth retrying over a 404 as the answer without a winner
+            nonlocal fallback
+            if fallback is None or RequestScheduler.classify(fallback[1].status_code) == 'missing':
+                if fallback is not None:
+                    fallback[1].close()
+                fallback = (repository, response)
+            else:
+                response.close()
+        
+        current = launch()
+        try:
+            while pending:
+                timeout = self.health.hedge_delay(current) if queue else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    current = launch()
+                    self.health.count(current, 'hedges')
+                    self.timings.hedge(kind)
+                    continue
+                failed = False
+                for future in done:
+                    repository = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        error, failed = e, True
+                        continue
+                    if response.status_code < 400:
+                        if winner is None:
+                            winner = (repository, response)
+                        else:
+                            others.append((repository, response))
+                    elif gather:
+                        others.append((repository, response))
+                        failed = True
+                    else:
+                        keep(repository, response)
+                        failed = True
+                if winner is not None:
+                    break
+                if failed and queue:
+                    current = launch()
+            if gather and winner is not None:
+                while queue:
+                    launch()
+                done, _ = wait(pending, timeout=self.health.hedge_delay(winner[0]))
+                for future in done:
+                    repository = pending.pop(future)
+                    if future.exception() is None:
+                        others.append((repository, future.result()))
+        finally:
+            for future, repository in list(pending.items()):
+                if winner is not None and future.done() and future.exception() is None \
+                        and future.result().status_code < 400:
+                    others.append((repository, future.result()))
+                else:
+                    future.cancel()
+                    future.add_done_callback(self._discard)
+        
+        if winner is not None:
+            self.health.count(winner[0], 'wins')
+            if fallback is not None:
+                fallback[1].close()
+            return winner[0], winner[1], others
+        for repository, response in others:
+            keep(repository, response)
+        if fallback is not None and (error is None
+                                     or RequestScheduler.classify(fallback[1].status_code) != 'missing'):
+            return fallback[0], fallback[1], []
+        if fallback is not None:
+            fallback[1].close()
+        raise error
+    
+    def _repository_slot(self, url: str) -> threading.BoundedSemaphore:
+        """Get the semaphore bounding in-flight requests to the host serving a URL"""
+        host = urlparse(url).netloc
+        with self._repository_slots_lock:
+            if host not in self._repository_slots:
+                self._repository_slots[host] = threading.BoundedSemaphore(self.per_repository_limit)
+            return self._repository_slots[host]
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request paced by its host's token bucket, reporting throttling back to it"""
+        self.scheduler.acquire(url)
+        response = self.session.request(method, url, **kwargs)
+        self.scheduler.feedback(url, response)
+        return response
+    
+    def is_missing(self, repository: Optional[str], group_id: str, artifact_id: str, version: str = None) -> bool:
+        """Whether metadata (or, with a version, a POM) was missing everywhere within the negative TTL"""
+        key = (repository, group_id, artifact_id, version)
+        with self._missing_lock:
+            expires = self._missing.get(key)
+            if expires is not None and expires <= time.monotonic():
+                del self._missing[key]
+                expires = None
+        if expires is not None:
+            return True
+        return self.cache is not None and self.cache.is_missing(repository, group_id, artifact_id, version)
+    
+    def mark_missing(self, repository: Optional[str], group_id: str, artifact_id: str, version: str = None):
+        with self._missing_lock:
+            self._missing[(repository, group_id, artifact_id, version)] = time.monotonic() + self.negative_ttl
+        if self.cache is not None:
+            self.cache.mark_missing(repository, group_id, artifact_id, version)
+    
+    def _get(self, url: str, kind: str, **kwargs) -> requests.Response:
+        """GET a URL within its host's slot, recording latency and size for --timings"""
+        # Pace before taking the repository slot, and only hold the slot for
+        # the request itself, so neither throttling nor a retry backing off
+        # starves other artifacts
+        self.scheduler.acquire(url)
+        with self._repository_slot(url):
+            started = time.perf_counter()
+            response = None
+            try:
+                response = self.session.get(url, timeout=self.timeout, **kwargs)
+                self.scheduler.feedback(url, response)
+                return response
+            finally:
+                self.timings.request(kind, url, time.perf_counter() - started,
+                                     response.status_code if response is not None else None,
+                                     len(response.content) if response is not None else 0)
+    
+    def get_metadata(self, group_id: str, artifact_id: str, repository: str = None) -> Optional[MavenMetadata]:
+        """Fetch Maven metadata for an artifact"""
+        document = self.fetch_metadata(group_id, artifact_id, repository)
+        if document is None:
+            return None
+        return self.parse_metadata(document[0], group_id, artifact_id)
+    
+    def parse_metadata(self, content: bytes, group_id: str, artifact_id: str) -> Optional[MavenMetadata]:
+        """Parse a metadata body, or None (with a warning) when it is malformed"""
+        try:
+            return MavenMetadata.parse(content, self.timings)
+        except ET.ParseError as e:
+            self.logger.warning(f"Invalid metadata for {group_id}:{artifact_id}: {e}")
+            return None
+    
+    def fetch_metadata(self, group_id: str, artifact_id: str, repository: str = None,
+                       etag: str = None) -> Optional[Tuple[Optional[bytes], Optional[str]]]:
+        """Fetch the raw maven-metadata.xml body and its ETag without parsing it.
+        
+        Without a cache, ``etag`` is sent as If-None-Match and a 304 answer is
+        returned as (None, etag). Returns None when the metadata is unavailable.
+        Entries are cached under the artifact's own repository whichever
+        mirror answered.
+        """
+        if repository is None:
+            repository = "https://repo1.maven.org/maven2"
+        
+        if self.is_missing(repository, group_id, artifact_id):
+            if self.cache is not None:
+                self.cache.record('hits')
+            self.logger.warning(f"No metadata published for {group_id}:{artifact_id} (cached 404)")
+            return None
+        
+        if self.cache is not None:
+            # Hold the entry lock across the fetch so concurrent processes
+            # sharing the cache wait for one download instead of racing
+            with self.cache.lock(repository, group_id, artifact_id):
+                return self._get_cached_metadata(repository, group_id, artifact_id)
+        
+        if self.offline:
+            self.logger.warning(f"Offline mode without a cache, cannot resolve {group_id}:{artifact_id}")
+            return None
+        downloaded = self._download_metadata(repository, group_id, artifact_id, {'etag': etag} if etag else None)
+        if downloaded is None:
+            return None
+        _, content, validators = downloaded
+        if content is None:
+            return None, etag
+        return content, validators['etag']
+    
+    def _get_cached_metadata(self, repository: str, group_id: str,
+                             artifact_id: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Serve metadata from the cache, revalidating stale entries with a conditional request"""
+        entry = self.cache.load(repository, group_id, artifact_id)
+        
+        if entry is not None and (self.offline or self.cache.is_fresh(entry)):
+            if not self.offline and self._repair_due(repository, entry):
+                self.cache.record('revalidated')
+                return self._repair_metadata(repository, group_id, artifact_id, entry), entry.get('etag')
+            self.cache.record('hits')
+            self.logger.debug(f"Cache hit for {group_id}:{artifact_id}")
+            return entry['content'], entry.get('etag')
+        
+        if self.offline:
+            self.cache.record('misses')
+            self.logger.warning(f"Offline mode: no cached metadata for {group_id}:{artifact_id}")
+            return None
+        
+        downloaded = self._download_metadata(repository, group_id, artifact_id, entry)
+        if downloaded is None:
+            if entry is not None:
+                self.cache.record('hits')
+                self.logger.warning(f"Using stale cached metadata for {group_id}:{artifact_id}")
+                return entry['content'], entry.get('etag')
+            self.cache.record('misses')
+            return None
+        
+        url, content, validators = downloaded
+        if content is None:
+            self.cache.record('revalidated')
+            self.logger.debug(f"Metadata not modified for {group_id}:{artifact_id}")
+            if 'sources' in validators:
+                entry['sources'] = validators['sources']
+                entry.pop('absent', None)
+                if validators['absent']:
+                    entry['absent'] = validators['absent']
+            self.cache.touch(repository, group_id, artifact_id, entry)
+            return entry['content'], entry.get('etag')
+        
+        self.cache.record('misses')
+        self.cache.store(repository, group_id, artifact_id, url, content, etag=validators['etag'],
+                         last_modified=validators['last_modified'], sources=validators.get('sources'),
+                         absent=validators.get('absent'))
+        return content, validators['etag']
+    
+    def _repair_due(self, repository: str, entry: Dict[str, Any]) -> bool:
+        """Whether a mirror a cached entry lacks may be asked again"""
+        now = time.time()
+        candidates = self.candidates(repository)
+        return any(base in candidates and retry_at <= now for base, retry_at in entry.get('absent', {}).items())
+    
+    def _repair_metadata(self, repository: str, group_id: str, artifact_id: str,
+                         entry: Dict[str, Any]) -> bytes:
+        """Ask only the mirrors a cached merged entry lacks, folding what they publish into it.
+        
+        They get up to the hedge delay of a mirror that did answer; one that
+        still does not is asked again after the negative TTL.
+        """
+        group_path = group_id.replace('.', '/')
+        metadata_path = f"/{group_path}/{artifact_id}/maven-metadata.xml"
+        candidates = self.candidates(repository)
+        now = time.time()
+        sources = dict(entry.get('sources', {}))
+        absent = {base: retry_at for base, retry_at in entry.get('absent', {}).items() if base in candidates}
+        due = [base for base, retry_at in absent.items() if retry_at <= now]
+        contributors = [base for base in candidates if not sources.get(base, {}).get('missing', True)]
+        
+        pool = self._hedge_executor()
+        pending = {pool.submit(self._attempt, base, lambda base: self._get(base + metadata_path, 'metadata')): base
+                   for base in due}
+        done, _ = wait(pending, timeout=self.health.hedge_delay(contributors[0] if contributors else repository))
+        contents = [entry['content']]
+        for future, base in pending.items():
+            response = future.result() if future in done and future.exception() is None else None
+            if response is None:
+                future.cancel()
+                future.add_done_callback(self._discard)
+            elif response.status_code == 200:
+                contents.append(response.content)
+            if response is None or response.status_code not in (200, 404):
+                absent[base] = now + self.negative_ttl
+                continue
+            del absent[base]
+            sources[base] = ({'etag': response.headers.get('ETag'),
+                              'last_modified': response.headers.get('Last-Modified')}
+                             if response.status_code == 200 else {'missing': True})
+        
+        content = None
+        if len(contents) > 1:
+            try:
+                content = MavenMetadata.merge(contents)
+            except ET.ParseError as e:
+                self.logger.debug(f"Not merging metadata for {group_id}:{artifact_id}: {e}")
+                return entry['content']
+            self.logger.debug(f"Merged metadata of {len(contents) - 1} more repositories "
+                              f"into the cached entry for {group_id}:{artifact_id}")
+        updated = dict(entry, sources=sources)
+        updated.pop('absent', None)
+        if absent:
+            updated['absent'] = absent
+        self.cache.update(repository, group_id, artifact_id, updated, content)
+        return content if content is not None else entry['content']
+    
+    def _download_metadata(self, repository: str, group_id: str, artifact_id: str,
+                           cached_entry: Dict[str, Any] = None
+                           ) -> Optional[Tuple[str, Optional[bytes], Dict[str, Any]]]:
+        """Download metadata with retries, hedged across mirrors and sending cache validators when available.
+        
+        Returns (url, content, validators): content is None for a 304. With
+        mirrors, validators also holds each one's ETag/Last-Modified under
+        'sources' and the mirrors that did not answer under 'absent'. Every
+        repository is asked (see hedged's gather) only to build a merged entry
+        or to fill its gaps; a complete one is revalidated hedged, with each
+        mirror's own validators, and a changed body is merged into it.
+        """
+        group_path = group_id.replace('.', '/')
+        metadata_path = f"/{group_path}/{artifact_id}/maven-metadata.xml"
+        self.logger.debug(f"Fetching metadata: {group_id}:{artifact_id}")
+        
+        candidates = self.candidates(repository)
+        sources = cached_entry.get('sources') if cached_entry is not None else None
+        gather = len(candidates) > 1 and (sources is None or any(base not in sources for base in candidates))
+        if sources is not None:
+            headers = {base: self._conditional_headers(sources.get(base)) for base in candidates}
+        else:
+            headers = dict.fromkeys(candidates, self._conditional_headers(cached_entry))
+        
+        for attempt in range(1, self.max_retries + 1):
+            response = None
+            try:
+                source, response, others = self.hedged(
+                    candidates, lambda base: self._get(base + metadata_path, 'metadata', headers=headers[base]),
+                    'metadata', gather=gather)
+            except requests.RequestException as e:
+                error = e
+            else:
+                if len(candidates) > 1 and response.status_code in (200, 304):
+                    return self._merge_metadata(metadata_path, candidates, [(source, response)] + others,
+                                                cached_entry, gather, group_id, artifact_id)
+                validators = {'etag': response.headers.get('ETag'),
+                              'last_modified': response.headers.get('Last-Modified')}
+                if response.status_code == 304 and cached_entry is not None:
+                    return source + metadata_path, None, validators
+                if response.ok:
+                    return source + metadata_path, response.content, validators
+                error = f"HTTP {response.status_code}"
+                
+            # Only transient failures and throttling are worth another attempt
+            outcome = RequestScheduler.classify(response.status_code if response is not None else None)
+            if outcome == 'missing':
+                self.logger.warning(f"No metadata published for {group_id}:{artifact_id}")
+                self.mark_missing(repository, group_id, artifact_id)
+                return None
+            self.logger.debug(f"Attempt {attempt} failed for {group_id}:{artifact_id}: {error}")
+            if outcome == 'fatal' or attempt == self.max_retries:
+                break
+            self.timings.retry('metadata')
+            time.sleep(self.scheduler.backoff(attempt, RequestScheduler.retry_after(response)))
+                    
+        self.logger.warning(f"Failed to fetch metadata for {group_id}:{artifact_id}")
+        return None
+    
+    @staticmethod
+    def _conditional_headers(validators: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        headers = {}
+        if validators is not None:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+    
+    def _merge_metadata(self, metadata_path: str, candidates: List[str],
+                        answers: List[Tuple[str, requests.Response]], cached_entry: Optional[Dict[str, Any]],
+                        gathered: bool, group_id: str, artifact_id: str
+                        ) -> Tuple[str, Optional[bytes], Dict[str, Any]]:
+        """Combine the repositories' answers, and the cached body, into one metadata result.
+        
+        When ``gathered``, every candidate was asked: those that did not
+        answer are marked absent until the negative TTL runs out. Otherwise
+        only the hedged answers are folded into the cached entry.
+        """
+        source = answers[0][0]
+        now = time.time()
+        previous = cached_entry.get('content') if cached_entry is not None else None
+        cached_sources = (cached_entry.get('sources') if cached_entry is not None else None) or {}
+        answered = {base: response for base, response in answers}
+        bodies = {base: response for base, response in answered.items() if response.status_code == 200}
+        
+        def validators_of(response):
+            return {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        
+        if gathered:
+            sources, absent = {}, {}
+            for base in candidates:
+                response = answered.get(base)
+                status = response.status_code if response is not None else None
+                if status == 200:
+                    sources[base] = validators_of(response)
+                elif status == 304 and base in cached_sources:
+                    sources[base] = cached_sources[base]
+                elif status == 304:
+                    sources[base] = {key: cached_entry.get(key) for key in ('etag', 'last_modified')}
+                elif status == 404:
+                    sources[base] = {'missing': True}
+                else:
+                    absent[base] = now + self.negative_ttl
+        else:
+            sources = dict(cached_sources)
+            sources.update((base, validators_of(response)) for base, response in bodies.items())
+            absent = {}
+        validators = {'etag': None, 'last_modified': None, 'sources': sources, 'absent': absent}
+        if cached_entry is not None and not bodies:
+            validators.update(etag=cached_entry.get('etag'), last_modified=cached_entry.get('last_modified'))
+            return source + metadata_path, None, validators
+        
+        if previous is None:
+            # No cached body to merge into: fetch the unchanged ones again
+            kept = False
+            for base in [base for base, response in answered.items() if response.status_code == 304]:
+                try:
+                    response = self._get(base + metadata_path, 'metadata')
+                except requests.RequestException:
+                    response = None
+                if response is not None and response.status_code == 200:
+                    bodies[base] = response
+                    sources[base] = validators_of(response)
+                elif response is None or response.status_code != 404:
+                    sources.pop(base, None)
+                    absent[base] = now + self.negative_ttl
+        elif cached_sources:
+            # The cached body holds the versions of repositories that sent none this time
+            kept = any(base not in bodies and not validator.get('missing')
+                       for base, validator in cached_sources.items())
+        else:
+            kept = any(base not in bodies for base in candidates
+                       if base not in answered or answered[base].status_code != 404)
+        
+        ordered = [base for base in candidates if base in bodies]
+        contents = ([previous] if kept else []) + [bodies[base].content for base in ordered]
+        if len(contents) == 1:
+            validators.update(sources[ordered[0]])
+            return ordered[0] + metadata_path, contents[0], validators
+        try:
+            content = MavenMetadata.merge(contents)
+        except ET.ParseError as e:
+            # Keep the winner's body; the others are asked again once the negative TTL runs out
+            self.logger.debug(f"Not merging metadata for {group_id}:{artifact_id}: {e}")
+            winner = source if source in bodies else ordered[0]
+            for base in ordered:
+                if base != winner:
+                    sources.pop(base, None)
+                    absent[base] = now + self.negative_ttl
+            validators.update(sources[winner])
+            return winner + metadata_path, bodies[winner].content, validators
+        self.logger.debug(f"Merged metadata of {len(contents)} bodies for {group_id}:{artifact_id}")
+        return (source if source in bodies else ordered[0]) + metadata_path, content, validators
+    
+    def get_pom(self, group_id: str, artifact_id: str, version: str,
+                repositories: List[str]) -> Optional[bytes]:
+        """Fetch a .pom from the first repository that has it (cached on disk).
+        
+        Repositories are tried in order, each hedged across the mirrors.
+        """
+        cacheable = self.cache is not None and not version.endswith('-SNAPSHOT')
+        if cacheable:
+            content = self.cache.load_pom(group_id, artifact_id, version)
+            if content is not None:
+                self.cache.record('hits')
+                return content
+        if self.is_missing(None, group_id, artifact_id, version):
+            return None
+        
+        if self.offline:
+            self.logger.debug(f"Offline mode: no cached POM for {group_id}:{artifact_id}:{version}")
+            return None
+        
+        group_path = group_id.replace('.', '/')
+        pom_path = f"/{group_path}/{artifact_id}/{version}/{artifact_id}-{version}.pom"
+        asked = set()
+        missing = True
+        for repository in repositories:
+            candidates = self.candidates(repository)
+            if self.mirrors:
+                # Mirrors already answered for an earlier repository
+                candidates = [candidate for candidate in candidates if candidate not in asked]
+                if not candidates:
+                    continue
+            asked.update(candidates)
+            for attempt in range(1, self.max_retries + 1):
+                response = None
+                try:
+                    _, response, _ = self.hedged(candidates, lambda base: self._get(base + pom_path, 'pom'), 'pom')
+                except requests.RequestException as e:
+                    error = e
+                else:
+                    if response.ok:
+                        if cacheable:
+                            self.cache.record('misses')
+                            self.cache.store_pom(group_id, artifact_id, version, response.content)
+                        return response.content
+                    error = f"HTTP {response.status_code}"
+            
+                outcome = RequestScheduler.classify(response.status_code if response is not None else None)
+                if outcome == 'missing':
+                    break
+                self.logger.debug(f"Attempt {attempt} failed for {group_id}:{artifact_id}:{version} POM: {error}")
+                if outcome == 'fatal' or attempt == self.max_retries:
+                    missing = False
+                    break
+                self.timings.retry('pom')
+                time.sleep(self.scheduler.backoff(attempt, RequestScheduler.retry_after(response)))
+        # Only remember the POM as missing when no repository failed for another reason
+        if missing:
+            self.mark_missing(None, group_id, artifact_id, version)
+        return None
+    
+    def get_metadata_many(self, coordinates: List[Tuple[str, str, Optional[str]]]) -> List[Optional[MavenMetadata]]:
+        """Fetch metadata for several (groupId, artifactId, repository) tuples concurrently.
+        
+        Results are returned in the same order as the input coordinates.
+        """
+        if not coordinates:
+            return []
+        
+        workers = min(self.max_workers, len(coordinates))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='maven-metadata') as executor:
+            return list(executor.map(lambda coord: self.get_metadata(*coord), coordinates))
+    
+    def iter_metadata(self, items: Iterable[Tuple[Any, ...]], fetch=None) -> Iterator[Tuple[Any, Any]]:
+        """Fetch metadata for (key, groupId, artifactId, repository) items concurrently,
+        yielding (key, metadata) as each download completes.
+        
+        Only a window of twice the worker count is in flight at a time, so
+        neither the input nor the results are ever held in memory as a whole.
+        ``fetch`` replaces get_metadata and is called with the rest of each item.
+        """
+        fetch = fetch or self.get_metadata
+        items = iter(items)
+        window = self.max_workers * 2
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='maven-metadata') as executor:
+            try:
+                for key, *fetch_args in itertools.islice(items, window):
+                    pending[executor.submit(fetch, *fetch_args)] = key
+                while pending:
+                    with self.timings.span('fetch'):
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = pending.pop(future)
+                        for next_key, *fetch_args in itertools.islice(items, 1):
+                            pending[executor.submit(fetch, *fetch_args)] = next_key
+                        yield key, future.result()
+            finally:
+                # A consumer that stops early should not wait for the rest of the window
+                for future in pending:
+                    future.cancel()
+    
+    @staticmethod
+    def get_version_index(metadata: Optional[MavenMetadata]) -> Optional[VersionIndex]:
+        """Sorted version index of an artifact, or None without metadata or versions"""
+        return metadata.index if metadata is not None else None
+        
+    def get_latest_version(self, metadata: MavenMetadata, include_prereleases: bool = False) -> Optional[str]:
+        """Extract latest version from Maven metadata"""
+        index = self.get_version_index(metadata)
+        if index is None:
+            return None
+        # Snapshots are always skipped, pre-releases unless requested
+        return index.latest(include_prereleases)
+
+
+class Dependency:
+    """Represents a single dependency"""
+    
+    __slots__ = ('name', 'group_id', 'artifact_id', 'version', 'description', 'repository')
+    
+    def __init__(self, name: str, group_id: str, artifact_id: str, version: str, 
+                 description: str = "", repository: str = None):
+        self.name = name
+        self.group_id = group_id
+        self.artifact_id = artifact_id
+        self.version = version
+        self.description = description
+        self.repository = repository or "https://repo1.maven.org/maven2"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        result = {
+            'groupId': self.group_id,
+            'artifactId': self.artifact_id,
+            'version': self.version,
+            'description': self.description
+        }
+        if self.repository != "https://repo1.maven.org/maven2":
+            result['repository'] = self.repository
+        return result
+    
+    def coordinate(self) -> str:
+        """Maven coordinate in groupId:artifactId:version form"""
+        return f"{self.group_id}:{self.artifact_id}:{self.version}"
+    
+    def jar_filename(self) -> str:
+        """File name of the artifact's JAR"""
+        return f"{self.artifact_id}-{self.version}.jar"
+    
+    def jar_url(self, repository: str = None) -> str:
+        """Download URL of the artifact's JAR"""
+        group_path = self.group_id.replace('.', '/')
+        return f"{repository or self.repository}/{group_path}/{self.artifact_id}/{self.version}/{self.jar_filename()}"
+    
+    @classmethod
+    def from_dict(cls, name: str, data: Dict[str, Any]) -> 'Dependency':
+        """Create from dictionary"""
+        return cls(
+            name=name,
+            group_id=data['groupId'],
+            artifact_id=data['artifactId'],
+            version=data['version'],
+            description=data.get('description', ''),
+            repository=data.get('repository')
+        )
+    
+    def get_dependency_type(self, rules: DependencyRules) -> str:
+        """Determine dependency type for compatibility checking using groupId and artifactId"""
+        return rules.classify(self.group_id, self.artifact_id)
+
+
+class ScanEntry:
+    """Evaluation of a single dependency captured in a scan snapshot"""
+    
+    __slots__ = ('category', 'name', 'group_id', 'artifact_id', 'repository', 'current_version', 'dep_type',
+                 'current_compatible', 'expected_range', 'resolved', 'latest_version', 'latest_compatible',
+                 'update_available', 'targets', 'latest_all_targets', 'last_updated', 'family', 'family_version')
+    
+    def __init__(self, category: str, name: str, group_id: str, artifact_id: str,
+                 repository: str, current_version: str, dep_type: str,
+                 current_compatible: bool, expected_range: Optional[Tuple[str, str]] = None,
+                 resolved: bool = False, latest_version: str = None,
+                 latest_compatible: bool = None, update_available: bool = False,
+                 targets: Dict[str, Dict[str, Any]] = None, latest_all_targets: str = None,
+                 last_updated: str = None, family: str = None, family_version: str = None):
+        self.category = category
+        self.name = name
+        self.group_id = group_id
+        self.artifact_id = artifact_id
+        self.repository = repository
+        self.current_version = current_version
+        self.dep_type = dep_type
+        self.current_compatible = current_compatible
+        self.expected_range = tuple(expected_range) if expected_range else None
+        self.resolved = resolved  # metadata was requested for this dependency
+        self.latest_version = latest_version  # latest compatible version, if any
+        self.latest_compatible = latest_compatible
+        self.update_available = update_available
+        # Per target: {'current': current version compatible, 'latest': latest compatible version}
+        self.targets = targets or {}
+        self.latest_all_targets = latest_all_targets  # highest version satisfying every target
+        self.last_updated = last_updated  # <lastUpdated> of the metadata, i.e. the newest release
+        self.family = family  # family the latest versions were aligned with
+        self.family_version = family_version  # BOM release (or shared version) the family moves to
+    
+    def to_update_info(self) -> Dict[str, Any]:
+        """Render in the format returned by DependencyManager.check_updates"""
+        return {
+            'name': self.name,
+            'current_version': self.current_version,
+            'latest_version': self.latest_version,
+            'compatible': self.latest_compatible,
+            'type': self.dep_type,
+            'family': self.family
+        }
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'category': self.category,
+            'name': self.name,
+            'groupId': self.group_id,
+            'artifactId': self.artifact_id,
+            'repository': self.repository,
+            'current_version': self.current_version,
+            'type': self.dep_type,
+            'current_compatible': self.current_compatible,
+            'expected_range': list(self.expected_range) if self.expected_range else None,
+            'resolved': self.resolved,
+            'latest_version': self.latest_version,
+            'latest_compatible': self.latest_compatible,
+            'update_available': self.update_available,
+            'targets': self.targets,
+            'latest_all_targets': self.latest_all_targets,
+            'last_updated': self.last_updated,
+            'family': self.family,
+            'family_version': self.family_version
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ScanEntry':
+        """Create from dictionary"""
+        return cls(
+            category=data['category'],
+            name=data['name'],
+            group_id=data['groupId'],
+            artifact_id=data['artifactId'],
+            repository=data.get('repository'),
+            current_version=data['current_version'],
+            dep_type=data['type'],
+            current_compatible=data['current_compatible'],
+            expected_range=data.get('expected_range'),
+            resolved=data.get('resolved', False),
+            latest_version=data.get('latest_version'),
+            latest_compatible=data.get('latest_compatible'),
+            update_available=data.get('update_available', False),
+            targets=data.get('targets'),
+            latest_all_targets=data.get('latest_all_targets'),
+            last_updated=data.get('last_updated'),
+            family=data.get('family'),
+            family_version=data.get('family_version')
+        )
+
+
+class ScanResult:
+    """Snapshot of one scan: metadata resolution, candidate versions,
+    compatibility verdicts and classification for every dependency.
+    
+    Commands render from a snapshot instead of recomputing, and a snapshot can
+    be saved to JSON and loaded later to run without network access.
+    """
+    
+    FORMAT_VERSION = 1
+    
+    def __init__(self, flink_version: str, versions_file: str, versions_digest: str,
+                 include_prereleases: bool, entries: List[ScanEntry], created_at: str = None,
+                 targets: List[CompatibilityTarget] = None):
+        self.flink_version = flink_version
+        self.versions_file = versions_file
+        self.versions_digest = versions_digest
+        self.include_prereleases = include_prereleases
+        self.entries = entries
+        self.created_at = created_at or datetime.now().isoformat(timespec='seconds')
+        self.targets = targets or []
+    
+    def categories(self) -> List[str]:
+        """Categories in versions-file order"""
+        return list(dict.fromkeys(entry.category for entry in self.entries))
+    
+    def entries_in(self, category: str) -> List[ScanEntry]:
+        """Entries of one category in versions-file order"""
+        return [entry for entry in self.entries if entry.category == category]
+    
+    def covers(self, category: str = None, exclude: List[str] = None) -> bool:
+        """Check whether every dependency in scope had its metadata resolved"""
+        exclude = exclude or []
+        return all(
+            entry.resolved for entry in self.entries
+            if (category is None or entry.category == category) and entry.name not in exclude
+        )
+    
+    def covers_targets(self, targets: List[CompatibilityTarget] = None) -> bool:
+        """Check whether every requested target was evaluated with the same version"""
+        evaluated = {(target.name, target.version) for target in self.targets}
+        return all((target.name, target.version) in evaluated for target in targets or [])
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'format_version': self.FORMAT_VERSION,
+            'created_at': self.created_at,
+            'flink_version': self.flink_version,
+            'versions_file': self.versions_file,
+            'versions_digest': self.versions_digest,
+            'include_prereleases': self.include_prereleases,
+            'targets': [target.to_dict() for target in self.targets],
+            'entries': [entry.to_dict() for entry in self.entries]
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ScanResult':
+        """Create from dictionary"""
+        if data.get('format_version') != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported scan format version: {data.get('format_version')}")
+        return cls(
+            flink_version=data['flink_version'],
+            versions_file=data['versions_file'],
+            versions_digest=data['versions_digest'],
+            include_prereleases=data['include_prereleases'],
+            entries=[ScanEntry.from_dict(entry) for entry in data['entries']],
+            created_at=data.get('created_at'),
+            targets=[CompatibilityTarget.from_dict(target) for target in data.get('targets', [])]
+        )
+    
+    def save(self, path: str):
+        """Write the snapshot to a JSON file"""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+    
+    @classmethod
+    def load(cls, path: str) -> 'ScanResult':
+        """Read a snapshot from a JSON file"""
+        scan_path = Path(path)
+        if not scan_path.exists():
+            raise FileNotFoundError(f"Scan file not found: {path}")
+        try:
+            with open(scan_path, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in scan file: {e}")
+        return cls.from_dict(data)
+
+
+class ScanState:
+    """Per-artifact state carried from one scan to the next.
+    
+    Each record holds the metadata's lastUpdated stamp and ETag, a digest of
+    the inputs the entry was evaluated from (coordinate, repository, rules,
+    Flink version, targets) and the evaluated entry itself. When the inputs
+    match and the repository answers 304 or serves the same lastUpdated or
+    ETag, the stored entry is reused and the version history is neither
+    parsed nor sorted again.
+    
+    The file is checkpointed while a scan runs. A scan that stops early leaves
+    its run open, and the next scan with the same inputs resumes it: entries
+    recorded by the open run are reused without contacting the repository.
+    """
+    
+    FORMAT_VERSION = 1
+    CHECKPOINT_SECONDS = 5.0  # how often a running scan flushes the file
+    
+    def __init__(self, path: Path, artifacts: Dict[str, Dict[str, Dict[str, Any]]] = None,
+                 run: Dict[str, Any] = None):
+        self.path = Path(path)
+        self.artifacts = artifacts or {}
+        self.run = run  # {'id', 'context', 'complete'} of the latest scan
+        self.stats = {'resumed': 0, 'unchanged': 0, 'evaluated': 0}
+        self._dirty = False
+        self._saved_at = time.monotonic()
+    
+    @staticmethod
+    def digest(*parts: Any) -> str:
+        """Stable digest of JSON-serializable inputs"""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    
+    def begin(self, context: str) -> bool:
+        """Start a scan for a context digest; True when it resumes an interrupted scan"""
+        run = self.run
+        if run is not None and not run.get('complete') and run.get('context') == context:
+            return True
+        self.run = {'id': f"{datetime.now().isoformat(timespec='seconds')}-{os.getpid()}",
+                    'context': context, 'complete': False}
+        self._dirty = True
+        return False
+    
+    def finish(self, dependencies: Dict[str, Dict[str, Dependency]]):
+        """Close the current scan and drop records of dependencies no longer declared"""
+        for category in list(self.artifacts):
+            for name in list(self.artifacts[category]):
+                if name not in dependencies.get(category, {}):
+                    del self.artifacts[category][name]
+            if not self.artifacts[category]:
+                del self.artifacts[category]
+        self.run['complete'] = True
+        self._dirty = True
+    
+    def get(self, category: str, name: str, inputs: str) -> Optional[Dict[str, Any]]:
+        """The record of a dependency if it was evaluated from the same inputs"""
+        record = self.artifacts.get(category, {}).get(name)
+        return record if record is not None and record.get('inputs') == inputs else None
+    
+    def resumable(self, record: Optional[Dict[str, Any]]) -> bool:
+        """Check whether a record was written by the scan being resumed"""
+        return record is not None and record.get('run') == self.run['id']
+    
+    @staticmethod
+    def unchanged(record: Dict[str, Any], etag: Optional[str], last_updated: Optional[str]) -> bool:
+        """Check whether fetched metadata is the one a record was evaluated from"""
+        return bool((last_updated and last_updated == record.get('last_updated'))
+                    or (etag and etag == record.get('etag')))
+    
+    def set(self, category: str, name: str, inputs: str, etag: Optional[str], last_updated: Optional[str],
+            entry: ScanEntry):
+        """Record an evaluated entry for the current scan"""
+        self.artifacts.setdefault(category, {})[name] = {
+            'inputs': inputs,
+            'etag': etag,
+            'last_updated': last_updated,
+            'run': self.run['id'],
+            'entry': entry.to_dict()
+        }
+        self._dirty = True
+        self.checkpoint()
+    
+    def touch(self, record: Dict[str, Any], etag: Optional[str], last_updated: Optional[str]):
+        """Mark a record as confirmed by the current scan"""
+        record['run'] = self.run['id']
+        record['etag'] = etag or record.get('etag')
+        record['last_updated'] = last_updated or record.get('last_updated')
+        self._dirty = True
+        self.checkpoint()
+    
+    def checkpoint(self):
+        """Save if the last save is older than CHECKPOINT_SECONDS"""
+        if time.monotonic() - self._saved_at >= self.CHECKPOINT_SECONDS:
+            self.save()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'state_version': self.FORMAT_VERSION,
+            'run': self.run,
+            'artifacts': self.artifacts
+        }
+    
+    def save(self):
+        """Write the state atomically if anything changed since the last save"""
+        if self._dirty:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            MetadataCache._write_atomic(self.path, json.dumps(self.to_dict(), separators=(',', ':')).encode('utf-8'))
+            self._dirty = False
+        self._saved_at = time.monotonic()
+    
+    @classmethod
+    def load(cls, path: str, logger: Logger = None) -> 'ScanState':
+        """Read a state file; a missing or unusable one gives an empty state"""
+        state_path = Path(path)
+        if not state_path.exists():
+            return cls(state_path)
+        try:
+            with open(state_path, 'r') as f:
+                data = json.load(f)
+            if data.get('state_version') != cls.FORMAT_VERSION:
+                raise ValueError(f"unsupported state version {data.get('state_version')}")
+        except ValueError as e:
+            # The state only saves work, so a bad file costs one full scan
+            if logger is not None:
+                logger.warning(f"Ignoring state file {path}: {e}")
+            return cls(state_path)
+        return cls(state_path, data.get('artifacts', {}), data.get('run'))
+
+
+class PomDependency:
+    """A <dependency> entry of a POM (also used for dependencyManagement entries)"""
+    
+    def __init__(self, group_id: str, artifact_id: str, version: str = None, scope: str = None,
+                 dep_type: str = None, classifier: str = None, optional: bool = False,
+                 exclusions: List[Tuple[str, str]] = None):
+        self.group_id = group_id
+        self.artifact_id = artifact_id
+        self.version = version
+        self.scope = scope
+        self.dep_type = dep_type or 'jar'
+        self.classifier = classifier
+        self.optional = optional
+        self.exclusions = exclusions or []
+    
+    def key(self) -> str:
+        """Management key: groupId:artifactId, plus type/classifier when not a plain JAR"""
+        key = f"{self.group_id}:{self.artifact_id}"
+        if self.dep_type != 'jar':
+            key += f":{self.dep_type}"
+        if self.classifier:
+            key += f":{self.classifier}"
+        return key
+    
+    def interpolate(self, properties: Dict[str, str]) -> 'PomDependency':
+        value = PomResolver.interpolate
+        return PomDependency(
+            value(self.group_id, properties), value(self.artifact_id, properties),
+            value(self.version, properties), value(self.scope, properties),
+            value(self.dep_type, properties), value(self.classifier, properties),
+            self.optional, [(value(g, properties), value(a, properties)) for g, a in self.exclusions]
+        )
+
+
+class PomModel:
+    """Effective POM: inherited properties, managed versions and dependencies"""
+    
+    def __init__(self, group_id: str, artifact_id: str, version: str, properties: Dict[str, str],
+                 raw_managed: Dict[str, PomDependency], raw_dependencies: Dict[str, PomDependency],
+                 managed: Dict[str, PomDependency], dependencies: List[PomDependency],
+                 unresolved: List[str] = None):
+        self.group_id = group_id
+        self.artifact_id = artifact_id
+        self.version = version
+        self.properties = properties
+        # Uninterpolated entries, inherited by child POMs and interpolated in their context
+        self.raw_managed = raw_managed
+        self.raw_dependencies = raw_dependencies
+        self.managed = managed
+        self.dependencies = dependencies
+        # Parents and imported BOMs, here or further up, skipped for lack of a concrete version
+        self.unresolved = unresolved or []
+
+
+class PomResolver:
+    """Walks the transitive runtime dependency graph of the declared dependencies.
+    
+    POMs are fetched concurrently level by level (and cached on disk by
+    MavenRepository). Parent POMs and dependencyManagement imports are
+    followed, test/provided/system scopes, optional dependencies and
+    exclusions are honoured, and versions are mediated nearest-wins like
+    Maven, with the declared dependencies as the nearest level.
+    """
+    
+    CENTRAL = "https://repo1.maven.org/maven2"
+    # Supplied by the Flink distribution itself, never expected in the declared set
+    PROVIDED_BY_FLINK = ('org.apache.flink:*', 'org.slf4j:*', 'org.apache.logging.log4j:*')
+    RUNTIME_SCOPES = ('compile', 'runtime')
+    
+    _PROPERTY = re.compile(r'\$\{([^}]+)\}')
+    _RANGE = re.compile(r'([\[(])([^,\])]*)(,?)([^\])]*)([\])])')
+    
+    def __init__(self, maven: MavenRepository, logger: Logger, repositories: List[str]):
+        self.maven = maven
+        self.logger = logger
+        self.repositories = list(dict.fromkeys(repositories + [self.CENTRAL]))
+        self._models: Dict[Tuple[str, str, str], Optional[PomModel]] = {}
+        self._inflight: Dict[Tuple[str, str, str], threading.Event] = {}
+        # Thread building each in-flight model, and the key each blocked thread waits for
+        self._owners: Dict[Tuple[str, str, str], int] = {}
+        self._waiting: Dict[int, Tuple[str, str, str]] = {}
+        self._lock = threading.Lock()
+        self._building = threading.local()
+    
+    @classmethod
+    def interpolate(cls, value: Optional[str], properties: Dict[str, str]) -> Optional[str]:
+        """Expand ${...} references, following nested properties a few levels deep"""
+        if not value or '${' not in value:
+            return value
+        for _ in range(10):
+            expanded = cls._PROPERTY.sub(lambda m: properties.get(m.group(1), m.group(0)), value)
+            if expanded == value:
+                break
+            value = expanded
+        return value.strip()
+    
+    @staticmethod
+    def _strip_namespaces(root: ET.Element):
+        for element in root.iter():
+            if isinstance(element.tag, str) and '}' in element.tag:
+                element.tag = element.tag.split('}', 1)[1]
+    
+    @staticmethod
+    def _text(element: Optional[ET.Element], tag: str) -> Optional[str]:
+        child = element.find(tag) if element is not None else None
+        return child.text.strip() if child is not None and child.text else None
+    
+    @classmethod
+    def _parse_dependencies(cls, container: Optional[ET.Element]) -> List[PomDependency]:
+        dependencies = []
+        if container is None:
+            return dependencies
+        for dep in container.findall('dependency'):
+            exclusions = [(cls._text(exc, 'groupId') or '*', cls._text(exc, 'artifactId') or '*')
+                          for exc in dep.findall('exclusions/exclusion')]
+            dependencies.append(PomDependency(
+                cls._text(dep, 'groupId'), cls._text(dep, 'artifactId'), cls._text(dep, 'version'),
+                cls._text(dep, 'scope'), cls._text(dep, 'type'), cls._text(dep, 'classifier'),
+                (cls._text(dep, 'optional') or 'false').lower() == 'true', exclusions
+            ))
+        return dependencies
+    
+    def model(self, group_id: str, artifact_id: str, version: str,
+              repositories: List[str] = None) -> Optional[PomModel]:
+        """Effective model of one POM, built once and shared between threads"""
+        key = (group_id, artifact_id, version)
+        building = getattr(self._building, 'keys', None)
+        if building is None:
+            building = self._building.keys = set()
+        if key in building:
+            self.logger.warning(f"Cycle in parent/import chain at {':'.join(key)}")
+            return None
+        
+        me = threading.get_ident()
+        with self._lock:
+            if key in self._models:
+                return self._models[key]
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+                self._owners[key] = me
+            elif self._waits_on(self._owners.get(key), me):
+                # Another thread builds this key and is itself waiting on a model this thread builds
+                self.logger.warning(f"Cycle in parent/import chain at {':'.join(key)}")
+                return None
+            else:
+                self._waiting[me] = key
+        
+        if not owner:
+            event.wait()
+            with self._lock:
+                self._waiting.pop(me, None)
+            return self._models.get(key)
+        
+        model = None
+        building.add(key)
+        try:
+            model = self._build_model(group_id, artifact_id, version, repositories or self.repositories)
+        except ET.ParseError as e:
+            self.logger.warning(f"Invalid POM for {':'.join(key)}: {e}")
+        finally:
+            building.discard(key)
+            with self._lock:
+                self._models[key] = model
+                self._owners.pop(key, None)
+                self._inflight.pop(key).set()
+        return model
+    
+    def _waits_on(self, thread: Optional[int], target: int) -> bool:
+        """Whether a thread is blocked, directly or through others, on a model target builds (lock held)"""
+        seen = set()
+        while thread is not None and thread not in seen:
+            if thread == target:
+                return True
+            seen.add(thread)
+            waiting_for = self._waiting.get(thread)
+            thread = self._owners.get(waiting_for) if waiting_for is not None else None
+        return False
+    
+    def _concrete(self, kind: str, group_id: Optional[str], artifact_id: Optional[str], version: Optional[str],
+                  child: str, unresolved: List[str]) -> bool:
+        """Whether a parent or imported BOM can be fetched; records it in ``unresolved`` when it cannot"""
+        if group_id and artifact_id and version and '${' not in version:
+            return True
+        coordinate = f"{group_id}:{artifact_id}:{version or ''}"
+        self.logger.debug(f"Skipping {kind} {coordinate} of {child}: no concrete version")
+        if coordinate not in unresolved:
+            unresolved.append(coordinate)
+        return False
+    
+    def _build_model(self, group_id: str, artifact_id: str, version: str,
+                     repositories: List[str]) -> Optional[PomModel]:
+        content = self.maven.get_pom(group_id, artifact_id, version, repositories)
+        if content is None:
+            self.logger.debug(f"POM not found: {group_id}:{artifact_id}:{version}")
+            return None
+        
+        with self.maven.timings.span('parse'):
+            root = ET.fromstring(content)
+            self._strip_namespaces(root)
+        
+        child = f"{group_id}:{artifact_id}:{version}"
+        unresolved = []
+        parent = None
+        parent_elem = root.find('parent')
+        if parent_elem is not None:
+            coordinates = (self._text(parent_elem, 'groupId'), self._text(parent_elem, 'artifactId'),
+                           self._text(parent_elem, 'version'))
+            if self._concrete('parent', *coordinates, child, unresolved):
+                parent = self.model(*coordinates, repositories)
+        if parent is not None:
+            unresolved.extend(coordinate for coordinate in parent.unresolved if coordinate not in unresolved)
+        
+        properties = dict(parent.properties) if parent else {}
+        properties_elem = root.find('properties')
+        if properties_elem is not None:
+            for prop in properties_elem:
+                if isinstance(prop.tag, str):
+                    properties[prop.tag] = (prop.text or '').strip()
+        for prefix in ('project.', 'pom.', ''):
+            properties[f'{prefix}groupId'] = group_id
+            properties[f'{prefix}artifactId'] = artifact_id
+            properties[f'{prefix}version'] = version
+        if parent is not None:
+            for prefix in ('project.parent.', 'parent.'):
+                properties[f'{prefix}groupId'] = parent.group_id
+                properties[f'{prefix}version'] = parent.version
+        
+        # Child entries override inherited ones; both are interpolated with the child's properties
+        raw_managed = dict(parent.raw_managed) if parent else {}
+        for dep in self._parse_dependencies(root.find('dependencyManagement/dependencies')):
+            raw_managed[dep.key()] = dep
+        raw_dependencies = dict(parent.raw_dependencies) if parent else {}
+        for dep in self._parse_dependencies(root.find('dependencies')):
+            raw_dependencies[dep.key()] = dep
+        
+        managed = {}
+        imports = []
+        for raw in raw_managed.values():
+            dep = raw.interpolate(properties)
+            if dep.scope == 'import' and dep.dep_type == 'pom':
+                imports.append(dep)
+            else:
+                managed[dep.key()] = dep
+        # Imported BOMs only fill in entries that are not managed explicitly
+        for imported in imports:
+            if not self._concrete('imported BOM', imported.group_id, imported.artifact_id, imported.version,
+                                  child, unresolved):
+                continue
+            bom = self.model(imported.group_id, imported.artifact_id, imported.version, repositories)
+            if bom is None:
+                self.logger.debug(f"Could not import BOM {imported.key()}:{imported.version}")
+                continue
+            unresolved.extend(coordinate for coordinate in bom.unresolved if coordinate not in unresolved)
+            for key, dep in bom.managed.items():
+                managed.setdefault(key, dep)
+        
+        dependencies = []
+        for raw in raw_dependencies.values():
+            dep = raw.interpolate(properties)
+            managed_dep = managed.get(dep.key())
+            if managed_dep is not None:
+                dep.version = dep.version or managed_dep.version
+                dep.scope = dep.scope or managed_dep.scope
+                dep.exclusions = dep.exclusions or managed_dep.exclusions
+            dep.scope = dep.scope or 'compile'
+            dependencies.append(dep)
+        
+        return PomModel(group_id, artifact_id, version, properties,
+                        raw_managed, raw_dependencies, managed, dependencies, unresolved)
+    
+    @staticmethod
+    def _excluded(dep: PomDependency, exclusions: frozenset) -> bool:
+        return any(fnmatch.fnmatchcase(dep.group_id, g) and fnmatch.fnmatchcase(dep.artifact_id, a)
+                   for g, a in exclusions)
+    
+    def _resolve_range(self, dep: PomDependency, repository: str) -> Optional[str]:
+        """Pick the highest released version satisfying a Maven version range"""
+        intervals = self._RANGE.findall(dep.version)
+        index = self.maven.get_version_index(self.maven.get_metadata(dep.group_id, dep.artifact_id, repository))
+        if not intervals or index is None:
+            return None
+        
+        def satisfies(version: str) -> bool:
+            candidate = maven_version(version)
+            for opening, low, comma, high, closing in intervals:
+                if not comma:
+                    # [1.0] pins an exact version
+                    if candidate == maven_version(low):
+                        return True
+                    continue
+                if low and (candidate < maven_version(low) or (opening == '(' and candidate == maven_version(low))):
+                    continue
+                if high and (candidate > maven_version(high) or (closing == ')' and candidate == maven_version(high))):
+                    continue
+                return True
+            return False
+        
+        for version in reversed(index.versions):
+            if not maven_version(version).is_prerelease and satisfies(version):
+                return version
+        return None
+    
+    def resolve(self, declared: List[Tuple[str, str, Dependency]], max_depth: int = None,
+                include_optional: bool = False) -> Dict[str, Any]:
+        """Resolve the runtime graph of the declared dependencies.
+        
+        Returns every node (keyed groupId:artifactId) with its depth and the
+        path that introduced it, version requests that lost mediation, and the
+        POMs, parents and imported BOMs that could not be resolved.
+        """
+        nodes: Dict[str, Dict[str, Any]] = {}
+        conflicts: Dict[str, List[Dict[str, Any]]] = {}
+        unresolved = []
+        level = []
+        for category, name, dep in declared:
+            key = f"{dep.group_id}:{dep.artifact_id}"
+            nodes[key] = {
+                'group_id': dep.group_id, 'artifact_id': dep.artifact_id, 'version': dep.version,
+                'depth': 0, 'declared': f"{category}.{name}", 'repository': dep.repository,
+                'path': [dep.coordinate()]
+            }
+            level.append((key, frozenset()))
+        
+        depth = 0
+        workers = self.maven.max_workers
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pom-resolve') as executor:
+            while level and (max_depth is None or depth < max_depth):
+                def load(item):
+                    node = nodes[item[0]]
+                    repositories = list(dict.fromkeys([node['repository']] + self.repositories))
+                    return self.model(node['group_id'], node['artifact_id'], node['version'], repositories)
+                
+                models = list(executor.map(load, level))
+                next_level = []
+                # Breadth-first and in declaration order, so the first request
+                # seen for an artifact is the nearest one (Maven's mediation)
+                for (key, exclusions), model in zip(level, models):
+                    node = nodes[key]
+                    if model is None:
+                        unresolved.append(node['path'][-1])
+                        continue
+                    unresolved.extend(coordinate for coordinate in model.unresolved if coordinate not in unresolved)
+                    for dep in model.dependencies:
+                        if dep.scope not in self.RUNTIME_SCOPES or (dep.optional and not include_optional):
+                            continue
+                        if dep.dep_type not in ('jar', 'bundle') or self._excluded(dep, exclusions):
+                            continue
+                        if dep.version and dep.version[:1] in '[(':
+                            dep.version = self._resolve_range(dep, node['repository'])
+                        if not dep.version:
+                            self.logger.debug(f"No version for {dep.key()} in {model.group_id}:{model.artifact_id}")
+                            continue
+                        
+                        dep_key = dep.key()
+                        path = node['path'] + [f"{dep_key}:{dep.version}"]
+                        existing = nodes.get(dep_key)
+                        if existing is not None:
+                            if existing['version'] != dep.version:
+                                conflicts.setdefault(dep_key, []).append({'version': dep.version, 'path': path})
+                            continue
+                        nodes[dep_key] = {
+                            'group_id': dep.group_id, 'artifact_id': dep.artifact_id, 'version': dep.version,
+                            'depth': depth + 1, 'declared': None, 'repository': node['repository'],
+                            'path': path, 'scope': dep.scope
+                        }
+                        next_level.append((dep_key, exclusions | frozenset(dep.exclusions)))
+                level = next_level
+                depth += 1
+        
+        return {'nodes': nodes, 'conflicts': conflicts, 'unresolved': unresolved, 'poms': len(self._models)}
+
+
+class DependencyFamily:
+    """Dependencies that must move together, aligned by a BOM or by one shared version.
+    
+    Families come from the ``families`` section of the rules file and from
+    ``metadata.families`` in the versions file, which replaces a rules family
+    of the same name. Members are listed as ``category.name`` or matched by
+    groupId globs; without either, a BOM family takes every dependency its BOM
+    manages. A dependency belongs to the first family that claims it.
+    """
+    
+    __slots__ = ('name', 'bom', 'groups', 'members', 'source')
+    
+    def __init__(self, name: str, bom: str = None, groups: List[str] = None, members: List[str] = None,
+                 source: str = 'rules'):
+        self.name = name
+        self.bom = bom  # groupId:artifactId of the BOM, None for a shared-version family
+        self.groups = groups or []
+        self.members = members or []
+        self.source = source  # 'rules' or 'versions'
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        result = {}
+        if self.bom:
+            result['bom'] = self.bom
+        if self.groups:
+            result['groups'] = self.groups
+        if self.members:
+            result['members'] = self.members
+        return result
+    
+    @classmethod
+    def from_dict(cls, name: str, data: Dict[str, Any], source: str) -> 'DependencyFamily':
+        """Create from dictionary, raising ValueError for a malformed declaration"""
+        if not isinstance(data, dict):
+            raise ValueError("expected an object with bom, groups or members")
+        bom = data.get('bom')
+        if bom is not None and (not isinstance(bom, str) or bom.count(':') != 1 or not all(bom.split(':'))):
+            raise ValueError(f"bom must be groupId:artifactId, got {bom!r}")
+        lists = {}
+        for key in ('groups', 'members'):
+            value = data.get(key, [])
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                raise ValueError(f"{key} must be a list of strings")
+            lists[key] = value
+        if not bom and not lists['groups'] and not lists['members']:
+            raise ValueError("needs a bom, groups or members")
+        return cls(name, bom, lists['groups'], lists['members'], source)
+    
+    def bom_coordinate(self) -> Tuple[str, str]:
+        group_id, artifact_id = self.bom.split(':')
+        return group_id, artifact_id
+    
+    def matches(self, category: str, name: str, dep: Dependency) -> bool:
+        """Whether a declared dependency is a candidate member"""
+        if self.members:
+            return f"{category}.{name}" in self.members
+        if self.groups:
+            return any(fnmatch.fnmatchcase(dep.group_id, group) for group in self.groups)
+        return True
+    
+    @staticmethod
+    def assign(families: List['DependencyFamily'], dependencies: Dict[str, Dict[str, Dependency]]
+               ) -> List[Tuple['DependencyFamily', List[Tuple[str, str, Dependency]]]]:
+        """Candidate members of each family, in file order; families of fewer than two are dropped"""
+        claimed = set()
+        assigned = []
+        for family in families:
+            members = [(cat, dep_name, dep) for cat, deps in dependencies.items()
+                       for dep_name, dep in deps.items()
+                       if (cat, dep_name) not in claimed and family.matches(cat, dep_name, dep)]
+            if len(members) < 2:
+                continue
+            claimed.update((cat, dep_name) for cat, dep_name, _ in members)
+            assigned.append((family, members))
+        return assigned
+
+
+class FamilySolver:
+    """Finds the newest version set of a family that is consistent and compatible.
+    
+    A BOM family costs one metadata fetch, for the BOM. Newer BOM releases
+    manage newer member versions, so the newest release whose members all stay
+    under their upper bounds is found by bisecting the BOM's version index,
+    reading O(log n) BOM POMs (cached on disk) instead of every member's
+    metadata. A family without a BOM moves in lockstep: the newest version
+    every member has published and every member's range allows.
+    """
+    
+    def __init__(self, maven: MavenRepository, logger: Logger):
+        self.maven = maven
+        self.logger = logger
+        self.resolver = PomResolver(maven, logger, [])
+        self._indexes: Dict[Tuple[str, str, str], Optional[VersionIndex]] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _parse(version: str) -> MavenVersion:
+        return maven_version(CompatibilityMatrix._clean_version(version))
+    
+    @staticmethod
+    def _key(dep: Dependency) -> str:
+        return f"{dep.group_id}:{dep.artifact_id}"
+    
+    def bom_index(self, family: DependencyFamily, repository: str) -> Optional[VersionIndex]:
+        """Version index of a family's BOM, fetched once per solver"""
+        group_id, artifact_id = family.bom_coordinate()
+        key = (group_id, artifact_id, repository)
+        with self._lock:
+            if key in self._indexes:
+                return self._indexes[key]
+        index = self.maven.get_version_index(self.maven.get_metadata(group_id, artifact_id, repository))
+        with self._lock:
+            self._indexes[key] = index
+        return index
+    
+    def managed(self, family: DependencyFamily, release: str, repository: str) -> Dict[str, PomDependency]:
+        """Entries a BOM release manages, with its imported BOMs folded in"""
+        group_id, artifact_id = family.bom_coordinate()
+        repositories = list(dict.fromkeys([repository] + self.resolver.repositories))
+        model = self.resolver.model(group_id, artifact_id, release, repositories)
+        return model.managed if model is not None else {}
+    
+    def bom_members(self, family: DependencyFamily, candidates: List[Tuple[str, str, Dependency]],
+                    include_prereleases: bool = False
+                    ) -> Tuple[List[Tuple[str, str, Dependency]], List[Tuple[str, str, Dependency]]]:
+        """Split candidates into those the newest BOM release manages and the rest"""
+        repository = candidates[0][2].repository
+        index = self.bom_index(family, repository)
+        releases = index.eligible(include_prereleases) if index is not None else []
+        if not releases:
+            self.logger.warning(f"Could not read the {family.bom} BOM; {family.name} members are checked one by one")
+            return [], candidates
+        managed = self.managed(family, releases[-1], repository)
+        members = [member for member in candidates if self._key(member[2]) in managed]
+        return members, [member for member in candidates if self._key(member[2]) not in managed]
+    
+    def solve(self, family: DependencyFamily, members: List[Tuple[str, str, Dependency]],
+              ranges: List[VersionRange], include_prereleases: bool = False,
+              indexes: List[Optional[VersionIndex]] = None) -> Optional[Tuple[str, List[str]]]:
+        """Newest consistent versions of the members, each inside its range.
+        
+        Returns (BOM release or shared version, version of each member), or
+        None when no published set satisfies every range. A member the chosen
+        BOM release does not manage yet gets None and is left unaligned.
+        """
+        if not members or not all(version_range.allowed for version_range in ranges):
+            return None
+        if family.bom:
+            return self._solve_bom(family, members, ranges, include_prereleases)
+        return self._solve_shared(indexes or [], ranges, include_prereleases)
+    
+    def _solve_bom(self, family: DependencyFamily, members: List[Tuple[str, str, Dependency]],
+                   ranges: List[VersionRange], include_prereleases: bool) -> Optional[Tuple[str, List[str]]]:
+        repository = members[0][2].repository
+        index = self.bom_index(family, repository)
+        releases = index.eligible(include_prereleases) if index is not None else []
+        keys = [self._key(dep) for _, _, dep in members]
+        
+        def versions_at(release: str) -> List[Optional[str]]:
+            managed = self.managed(family, release, repository)
+            return [managed[key].version if key in managed else None for key in keys]
+        
+        def too_new(release: str) -> bool:
+            return any(version is not None and version_range.high is not None
+                       and self._parse(version).sort_key > version_range.high.sort_key
+                       for version, version_range in zip(versions_at(release), ranges))
+        
+        # Managed versions only grow with the BOM, so "too new" splits the releases in two
+        low, high = 0, len(releases)
+        while low < high:
+            middle = (low + high) // 2
+            if too_new(releases[middle]):
+                high = middle
+            else:
+                low = middle + 1
+        if low == 0:
+            return None
+        release = releases[low - 1]
+        versions = versions_at(release)
+        # Membership comes from the newest release; older ones may not manage every member yet
+        managed = [(version, version_range) for version, version_range in zip(versions, ranges) if version is not None]
+        if not managed or not all(version_range.contains(self._parse(version)) for version, version_range in managed):
+            return None
+        unmanaged = [name for (_, name, _), version in zip(members, versions) if version is None]
+        if unmanaged:
+            self.logger.debug(f"{family.bom} {release} does not manage {', '.join(unmanaged)} yet, "
+                              f"so they stay unaligned")
+        return release, versions
+    
+    @staticmethod
+    def _solve_shared(indexes: List[Optional[VersionIndex]], ranges: List[VersionRange],
+                      include_prereleases: bool) -> Optional[Tuple[str, List[str]]]:
+        if not indexes or any(index is None for index in indexes):
+            return None
+        # One version for every member has to be inside every member's range
+        combined = CompatibilityMatrix.intersect(ranges)
+        smallest = min(indexes, key=len)
+        published = [set(index.versions) for index in indexes if index is not smallest]
+        for version in reversed(smallest.eligible(include_prereleases, combined)):
+            if all(version in versions for versions in published):
+                return version, [version] * len(indexes)
+        return None
+
+
+class DependencyLock:
+    """Resolved artifacts for every dependency: URL, checksums, size and repository.
+    
+    The lockfile mirrors the category/name layout of the versions file and
+    contains no timestamps, so locking the same inputs always produces the
+    same bytes.
+    """
+    
+    FORMAT_VERSION = 1
+    
+    def __init__(self, path: Path, artifacts: Dict[str, Dict[str, Dict[str, Any]]] = None):
+        self.path = Path(path)
+        self.artifacts = artifacts or {}
+    
+    @staticmethod
+    def default_path(versions_file: Path) -> Path:
+        """dependency-versions.json -> dependency-versions.lock.json"""
+        return versions_file.with_name(f"{versions_file.stem}.lock.json")
+    
+    def get(self, category: str, name: str) -> Optional[Dict[str, Any]]:
+        return self.artifacts.get(category, {}).get(name)
+    
+    def set(self, category: str, name: str, entry: Dict[str, Any]):
+        self.artifacts.setdefault(category, {})[name] = entry
+    
+    @staticmethod
+    def is_current(entry: Optional[Dict[str, Any]], dependency: Dependency) -> bool:
+        """Check whether a lock entry still describes the dependency as configured"""
+        return (entry is not None
+                and entry.get('coordinate') == dependency.coordinate()
+                and entry.get('repository') == dependency.repository
+                and all(entry.get(key) for key in ('url', 'sha256', 'sha1', 'size')))
+    
+    def retain(self, dependencies: Dict[str, Dict[str, Dependency]]) -> int:
+        """Drop entries for dependencies no longer in the versions file"""
+        removed = 0
+        for category in list(self.artifacts):
+            for name in list(self.artifacts[category]):
+                if name not in dependencies.get(category, {}):
+                    del self.artifacts[category][name]
+                    removed += 1
+            if not self.artifacts[category]:
+                del self.artifacts[category]
+        return removed
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'lockfile_version': self.FORMAT_VERSION,
+            'artifacts': self.artifacts
+        }
+    
+    def save(self):
+        """Write the lockfile atomically with stable formatting"""
+        content = json.dumps(self.to_dict(), indent=2, sort_keys=True) + '\n'
+        MetadataCache._write_atomic(self.path, content.encode('utf-8'))
+    
+    @classmethod
+    def load(cls, path: Path, required: bool = False) -> 'DependencyLock':
+        """Read a lockfile; a missing file gives an empty lock unless required"""
+        lock_path = Path(path)
+        if not lock_path.exists():
+            if required:
+                raise FileNotFoundError(f"Lockfile not found: {path} (run the 'lock' command first)")
+            return cls(lock_path)
+        try:
+            with open(lock_path, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in lockfile: {e}")
+        if data.get('lockfile_version') != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported lockfile version: {data.get('lockfile_version')}")
+        return cls(lock_path, data.get('artifacts', {}))
+
+
+class DependencyProfile:
+    """Subset of the declared dependencies that a set of SQL pipelines needs.
+    
+    Written by analyze-pipelines and read by `fetch --profile` and
+    `layers build --profile`. Every required dependency carries the reason it
+    is needed. Dependencies the profile does not mention yet (added to the
+    versions file after the analysis) are kept, so a stale profile can make
+    the image larger but never leaves a JAR out by accident.
+    """
+    
+    FORMAT_VERSION = 1
+    
+    def __init__(self, path: Path, required: Dict[str, List[str]] = None, excluded: List[str] = None,
+                 pipelines: List[str] = None, usage: Dict[str, List[str]] = None, unresolved: List[str] = None,
+                 savings: Dict[str, int] = None):
+        self.path = Path(path)
+        self.required = required or {}  # category/name -> reasons
+        self.excluded = excluded or []
+        self.pipelines = pipelines or []
+        self.usage = usage or {}  # kind -> identifiers or class names found in the pipelines
+        self.unresolved = unresolved or []  # identifiers no declared JAR provides (built into Flink)
+        self.savings = savings or {}
+    
+    @staticmethod
+    def default_path(versions_file: Path) -> Path:
+        """dependency-versions.json -> dependency-versions.profile.json"""
+        return versions_file.with_name(f"{versions_file.stem}.profile.json")
+    
+    def includes(self, category: str, name: str) -> bool:
+        return f"{category}/{name}" not in self.excluded
+    
+    def unknown(self, dependencies: Dict[str, Dict[str, Dependency]]) -> List[str]:
+        """Declared dependencies the profile neither requires nor excludes"""
+        known = set(self.required) | set(self.excluded)
+        return [f"{cat}/{name}" for cat, deps in dependencies.items() for name in deps
+                if f"{cat}/{name}" not in known]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'profile_version': self.FORMAT_VERSION,
+            'pipelines': self.pipelines,
+            'usage': self.usage,
+            'unresolved': self.unresolved,
+            'required': self.required,
+            'excluded': self.excluded,
+            'savings': self.savings
+        }
+    
+    def save(self):
+        """Write the profile atomically with stable formatting"""
+        content = json.dumps(self.to_dict(), indent=2, sort_keys=True) + '\n'
+        MetadataCache._write_atomic(self.path, content.encode('utf-8'))
+    
+    @classmethod
+    def load(cls, path: Path) -> 'DependencyProfile':
+        profile_path = Path(path)
+        if not profile_path.exists():
+            raise FileNotFoundError(f"Profile not found: {path} (run the 'analyze-pipelines' command first)")
+        try:
+            with open(profile_path, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in profile: {e}")
+        if data.get('profile_version') != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported profile version: {data.get('profile_version')}")
+        return cls(profile_path, data.get('required', {}), data.get('excluded', []), data.get('pipelines', []),
+                   data.get('usage', {}), data.get('unresolved', []), data.get('savings', {}))
+
+
+class VersionsHistory:
+    """Append-only, content-addressed history of one versions file.
+    
+    Every distinct revision of the file is stored once as a zlib-compressed
+    object named by its SHA-256, so recording an unchanged file costs
+    nothing. An index line per snapshot holds its time, reason, object
+    digest and the dependency versions that changed since the previous
+    snapshot (the oldest snapshot lists every version). Replaying the index
+    gives the versions at any snapshot, so history, diff and restore lookups
+    never open the objects.
+    
+    Layout: <dir>/objects/<2 hex>/<sha256> and <dir>/<versions file name>.jsonl.
+    Several versions files can share one directory and its objects.
+    """
+    
+    DEFAULT_DIR_NAME = '.dependency-history'
+    
+    def __init__(self, versions_file: Path, history_dir: str = None, logger: Logger = None):
+        self.versions_file = Path(versions_file)
+        self.history_dir = Path(history_dir) if history_dir else self.default_dir(self.versions_file)
+        self.index_path = self.history_dir / f"{self.versions_file.name}.jsonl"
+        self.logger = logger
+    
+    @classmethod
+    def default_dir(cls, versions_file: Path) -> Path:
+        """dependency-versions.json -> .dependency-history next to it"""
+        return versions_file.parent / cls.DEFAULT_DIR_NAME
+    
+    def _object_path(self, sha256: str) -> Path:
+        return self.history_dir / 'objects' / sha256[:2] / sha256
+    
+    @staticmethod
+    def versions_of(content: bytes) -> Dict[str, str]:
+        """category/name -> version of a versions file body"""
+        data = json.loads(content)
+        return {f"{category}/{name}": dep.get('version')
+                for category, deps in data.get('dependencies', {}).items()
+                for name, dep in deps.items()}
+    
+    @staticmethod
+    def changes(before: Dict[str, str], after: Dict[str, str]) -> Dict[str, List[Optional[str]]]:
+        """category/name -> [old, new] for every version that differs; None means absent"""
+        return {key: [before.get(key), after.get(key)]
+                for key in sorted(set(before) | set(after)) if before.get(key) != after.get(key)}
+    
+    def entries(self) -> List[Dict[str, Any]]:
+        """Snapshots oldest first"""
+        try:
+            with open(self.index_path, 'r') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return []
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # A line cut short by a crash during append; the object it names is still intact
+                continue
+        return entries
+    
+    def replay(self) -> Iterator[Tuple[Dict[str, Any], Dict[str, str]]]:
+        """Yield (snapshot, versions at that snapshot) oldest first"""
+        versions: Dict[str, str] = {}
+        for entry in self.entries():
+            if entry.get('base'):
+                versions = {}
+            for key, (_, new) in entry['changes'].items():
+                if new is None:
+                    versions.pop(key, None)
+                else:
+                    versions[key] = new
+            yield entry, dict(versions)
+    
+    @contextmanager
+    def _locked(self):
+        """Serialize writers of this history directory"""
+        self.history_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.history_dir / '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def record(self, content: bytes, reason: str) -> Tuple[Dict[str, Any], bool]:
+        """Snapshot a versions file body; returns (snapshot, False) when it equals the latest one"""
+        sha256 = hashlib.sha256(content).hexdigest()
+        versions = self.versions_of(content)
+        with self._locked():
+            latest, latest_versions = None, {}
+            for latest, latest_versions in self.replay():
+                pass
+            if latest is not None and latest['sha256'] == sha256:
+                return latest, False
+            
+            object_path = self._object_path(sha256)
+            if not object_path.exists():
+                object_path.parent.mkdir(parents=True, exist_ok=True)
+                MetadataCache._write_atomic(object_path, zlib.compress(content, 9))
+            entry = {
+                'id': sha256[:12],
+                'sha256': sha256,
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'reason': reason,
+                'size': len(content),
+                'changes': self.changes(latest_versions, versions)
+            }
+            if latest is None:
+                entry['base'] = True
+            with open(self.index_path, 'a') as f:
+                f.write(json.dumps(entry, sort_keys=True) + '\n')
+        return entry, True
+    
+    def load(self, entry: Dict[str, Any]) -> bytes:
+        """Content of a snapshot, verified against its digest"""
+        try:
+            content = zlib.decompress(self._object_path(entry['sha256']).read_bytes())
+        except (OSError, zlib.error) as e:
+            raise ValueError(f"Snapshot {entry['id']} is unreadable: {e}")
+        if hashlib.sha256(content).hexdigest() != entry['sha256']:
+            raise ValueError(f"Snapshot {entry['id']} is corrupt (digest mismatch)")
+        return content
+    
+    def resolve(self, ref: str) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Newest snapshot whose id starts with ref (or 'latest'), with its versions"""
+        found = None
+        for entry, versions in self.replay():
+            if ref == 'latest' or entry['id'].startswith(ref) or entry['sha256'].startswith(ref):
+                found = entry, versions
+        if found is None:
+            raise ValueError(f"No snapshot matches {ref} (see the 'history' command)")
+        return found
+    
+    @staticmethod
+    def _matches(versions: Dict[str, str], where: Dict[str, str]) -> bool:
+        """Check name=version conditions; a name matches in any category unless given as category/name"""
+        for name, version in where.items():
+            if '/' in name:
+                if versions.get(name) != version:
+                    return False
+            elif not any(key.rpartition('/')[2] == name and value == version for key, value in versions.items()):
+                return False
+        return True
+    
+    @staticmethod
+    def _created_at(entry: Dict[str, Any]) -> datetime:
+        """When a snapshot was taken, as an aware datetime; naive stamps are local time"""
+        return datetime.fromisoformat(entry['created_at']).astimezone()
+    
+    def find(self, before: datetime = None, where: Dict[str, str] = None
+             ) -> Optional[Tuple[Dict[str, Any], Dict[str, str]]]:
+        """Newest snapshot taken before a time and/or with the given dependency versions.
+        
+        A naive ``before`` is taken as local time, like the snapshot stamps.
+        """
+        if before is not None:
+            before = before.astimezone()
+        found = None
+        for entry, versions in self.replay():
+            if before is not None and self._created_at(entry) >= before:
+                continue
+            if where and not self._matches(versions, where):
+                continue
+            found = entry, versions
+        return found
+    
+    def prune(self, keep: int, keep_days: float) -> Dict[str, int]:
+        """Drop snapshots beyond the newest ``keep`` that are older than ``keep_days``.
+        
+        The oldest remaining snapshot is rebased to list every version, and
+        objects no index in the directory refers to any more are deleted.
+        """
+        cutoff = datetime.now().timestamp() - keep_days * 86400
+        with self._locked():
+            replayed = list(self.replay())
+            kept = [(entry, versions) for i, (entry, versions) in enumerate(replayed)
+                    if i >= len(replayed) - max(keep, 1)
+                    or self._created_at(entry).timestamp() >= cutoff]
+            removed = len(replayed) - len(kept)
+            if removed:
+                lines = []
+                previous: Dict[str, str] = {}
+                for i, (entry, versions) in enumerate(kept):
+                    entry = dict(entry)
+                    entry.pop('base', None)
+                    if i == 0:
+                        entry['base'] = True
+                    entry['changes'] = self.changes(previous, versions)
+                    previous = versions
+                    lines.append(json.dumps(entry, sort_keys=True) + '\n')
+                MetadataCache._write_atomic(self.index_path, ''.join(lines).encode('utf-8'))
+            
+            referenced = set()
+            for index_path in self.history_dir.glob('*.jsonl'):
+                with open(index_path, 'r') as f:
+                    for line in f:
+                        try:
+                            referenced.add(json.loads(line)['sha256'])
+                        except (ValueError, KeyError):
+                            continue
+            objects = 0
+            for object_path in (self.history_dir / 'objects').glob('*/*'):
+                if object_path.name not in referenced and not object_path.name.startswith('.'):
+                    object_path.unlink()
+                    objects += 1
+        return {'snapshots': removed, 'objects': objects}
+
+
+class LayerPlan:
+    """Assignment of dependencies to image layers by how often their version changes.
+    
+    Churn is the number of recorded revisions that changed a dependency's
+    version, measured from the snapshot history or, when that is shorter,
+    from the git history of the versions file. A dependency goes to layer
+    min(layers - 1, churn.bit_length()): JARs that never changed share layer
+    0, JARs changed once layer 1, two or three times layer 2, and so on.
+    Dependencies the plan does not know yet go to the most volatile layer.
+    Until at least two revisions are recorded, churn is seeded from how
+    often each category typically moves (CATEGORY_CHURN). Like the
+    lockfile, the plan has no timestamps and is meant to be committed,
+    because image builds see neither the history nor git.
+    """
+    
+    FORMAT_VERSION = 1
+    DOCKERFILE_LAYERS = 4  # layer-N directories the Dockerfile's final stage copies
+    DEFAULT_LAYERS = DOCKERFILE_LAYERS
+    GIT_REVISIONS = 200  # newest revisions of the versions file read from git
+    # Seed churn per category while there is no history: Flink connectors and the Hadoop stack
+    # follow the Flink release, client SDKs follow their vendors' frequent releases
+    CATEGORY_CHURN = {
+        'flink': 0, 'hadoop-azure': 0, 'opencensus': 0,
+        'avro': 1, 'compression': 1, 'misc': 1,
+        'google': 2, 'jackson': 2,
+        'kafka': 4, 'grpc': 4, 'google-cloud': 4,
+    }
+    DEFAULT_CATEGORY_CHURN = 1
+    
+    def __init__(self, path: Path, layers: int = DEFAULT_LAYERS, churn: Dict[str, int] = None,
+                 source: str = None, revisions: int = 0):
+        self.path = Path(path)
+        self.layers = max(1, layers)
+        self.churn = churn or {}  # category/name -> revisions that changed its version
+        self.source = source  # 'history', 'git', 'defaults' or None
+        self.revisions = revisions
+    
+    @staticmethod
+    def default_path(versions_file: Path) -> Path:
+        """dependency-versions.json -> dependency-versions.layers.json"""
+        return versions_file.with_name(f"{versions_file.stem}.layers.json")
+    
+    @staticmethod
+    def name(layer: int) -> str:
+        return f"layer-{layer}"
+    
+    def layer_of(self, key: str) -> int:
+        """Layer index of a category/name key"""
+        churn = self.churn.get(key)
+        if churn is None:
+            return self.layers - 1
+        return min(self.layers - 1, churn.bit_length())
+    
+    @staticmethod
+    def count_changes(revisions: Iterable[Dict[str, str]], keys: Iterable[str]) -> Tuple[Dict[str, int], int]:
+        """Changes per key across consecutive revisions (oldest first), and the revision count"""
+        churn = dict.fromkeys(keys, 0)
+        previous = None
+        count = 0
+        for versions in revisions:
+            count += 1
+            if previous is not None:
+                for key in churn:
+                    if key in previous and key in versions and previous[key] != versions[key]:
+                        churn[key] += 1
+            previous = versions
+        return churn, count
+    
+    @classmethod
+    def _git_revisions(cls, versions_file: Path, logger: Logger = None) -> List[Dict[str, str]]:
+        """Versions of each committed revision of the file, oldest first"""
+        cwd = str(versions_file.resolve().parent)
+        try:
+            log = subprocess.run(['git', 'log', f'-n{cls.GIT_REVISIONS}', '--format=%H', '--', versions_file.name],
+                                 cwd=cwd, capture_output=True, text=True, check=True).stdout.split()
+        except (OSError, subprocess.CalledProcessError) as e:
+            if logger is not None:
+                logger.debug(f"No git history for {versions_file}: {e}")
+            return []
+        revisions = []
+        for commit in reversed(log):
+            try:
+                content = subprocess.run(['git', 'show', f'{commit}:./{versions_file.name}'], cwd=cwd,
+                                         capture_output=True, check=True).stdout
+                revisions.append(VersionsHistory.versions_of(content))
+            except (OSError, subprocess.CalledProcessError, ValueError):
+                continue
+        return revisions
+    
+    @classmethod
+    def seed(cls, path: Path, keys: Iterable[str], layers: int = DEFAULT_LAYERS, revisions: int = 0) -> 'LayerPlan':
+        """Plan from the per-category churn defaults, for when history cannot tell the layers apart"""
+        churn = {key: cls.CATEGORY_CHURN.get(key.split('/', 1)[0], cls.DEFAULT_CATEGORY_CHURN) for key in keys}
+        return cls(path, layers, churn, 'defaults', revisions)
+    
+    @classmethod
+    def measure(cls, path: Path, versions_file: Path, history: VersionsHistory, keys: List[str],
+                layers: int = DEFAULT_LAYERS, logger: Logger = None) -> 'LayerPlan':
+        """Build a plan from whichever of the snapshot history and git holds more revisions"""
+        churn, count = cls.count_changes((versions for _, versions in history.replay()), keys)
+        source = 'history'
+        git_churn, git_count = cls.count_changes(cls._git_revisions(versions_file, logger), keys)
+        if git_count > count:
+            churn, count, source = git_churn, git_count, 'git'
+        if count < 2:
+            # A single revision shows no changes at all and would put every JAR in layer 0
+            return cls.seed(path, keys, layers, count)
+        return cls(path, layers, churn, source, count)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'layers_version': self.FORMAT_VERSION,
+            'layers': self.layers,
+            'source': self.source,
+            'revisions': self.revisions,
+            'churn': dict(sorted(self.churn.items()))
+        }
+    
+    def save(self):
+        """Write the plan atomically with stable formatting"""
+        content = json.dumps(self.to_dict(), indent=2, sort_keys=True) + '\n'
+        MetadataCache._write_atomic(self.path, content.encode('utf-8'))
+    
+    @classmethod
+    def load(cls, path: Path) -> Optional['LayerPlan']:
+        """Read a plan, or None when the file does not exist"""
+        plan_path = Path(path)
+        if not plan_path.exists():
+            return None
+        try:
+            with open(plan_path, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in layer plan: {e}")
+        if data.get('layers_version') != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported layer plan version: {data.get('layers_version')}")
+        return cls(plan_path, data.get('layers', cls.DEFAULT_LAYERS), data.get('churn', {}),
+                   data.get('source'), data.get('revisions', 0))
+
+
+class LayerWriter:
+    """Writes layers whose bytes depend only on the JARs they contain.
+    
+    Entries are sorted, owned by 0:0, mode 0644 and stamped with one fixed
+    mtime, so an unchanged layer gets the same digest on every build and
+    nodes that already hold it never pull it again.
+    """
+    
+    def __init__(self, prefix: str = 'opt/flink/lib', mtime: int = 0):
+        self.prefix = prefix.strip('/')
+        self.mtime = mtime
+    
+    def write_directory(self, layer_dir: Path, jars: List[Path]):
+        """Lay the JARs out under layer_dir/<prefix> for `COPY --link` (copied, never hardlinked,
+        so normalizing mtimes cannot touch artifact store blobs)"""
+        if layer_dir.exists():
+            shutil.rmtree(layer_dir)
+        target_dir = layer_dir / self.prefix
+        target_dir.mkdir(parents=True)
+        for jar in jars:
+            target = target_dir / jar.name
+            shutil.copyfile(jar, target)
+            os.chmod(target, 0o644)
+            os.utime(target, (self.mtime, self.mtime))
+        # Directories last, since adding files bumps their mtime
+        directory = target_dir
+        while True:
+            os.chmod(directory, 0o755)
+            os.utime(directory, (self.mtime, self.mtime))
+            if directory == layer_dir:
+                break
+            directory = directory.parent
+    
+    def write_tarball(self, path: Path, jars: List[Path], compress: bool = False) -> Dict[str, Any]:
+        """Write a layer tarball; returns its OCI descriptor fields"""
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        diff_id = hashlib.sha256()
+        digest = hashlib.sha256()
+        
+        class _Digesting:
+            """File wrapper hashing the compressed and uncompressed streams as they are written"""
+            
+            def __init__(self, raw, hasher):
+                self.raw = raw
+                self.hasher = hasher
+            
+            def write(self, data):
+                self.hasher.update(data)
+                return self.raw.write(data)
+            
+            def flush(self):
+                self.raw.flush()
+        
+        with open(tmp_path, 'wb') as raw:
+            outer = _Digesting(raw, digest)
+            gz = gzip.GzipFile(filename='', mode='wb', fileobj=outer, mtime=0) if compress else None
+            stream = _Digesting(gz if gz is not None else raw, diff_id)
+            with tarfile.open(fileobj=stream, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                for jar in sorted(jars, key=lambda p: p.name):
+                    info = tarfile.TarInfo(f"{self.prefix}/{jar.name}")
+                    info.size = jar.stat().st_size
+                    info.mtime = self.mtime
+                    info.mode = 0o644
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ''
+                    with open(jar, 'rb') as f:
+                        tar.addfile(info, f)
+            if gz is not None:
+                gz.close()
+        if not compress:
+            digest = diff_id
+        os.replace(tmp_path, path)
+        return {
+            'mediaType': 'application/vnd.oci.image.layer.v1.tar' + ('+gzip' if compress else ''),
+            'digest': f"sha256:{digest.hexdigest()}",
+            'size': path.stat().st_size,
+            'diff_id': f"sha256:{diff_id.hexdigest()}"
+        }
+
+
+class JarRepacker:
+    """Merges JAR families into consolidated JARs and rewrites entry compression.
+    
+    Entries with the same name and bytes are written once. Entries with the
+    same name and different bytes are conflicts: the first JAR in classpath
+    (file name) order wins, as it would on the unmerged classpath.
+    META-INF/services files are concatenated instead. Every output has a
+    fresh manifest, sorted entries and a fixed timestamp, so the same inputs
+    always give the same bytes. Signed JARs are never merged, because a
+    merged JAR would fail signature verification.
+    """
+    
+    SIGNATURE = re.compile(r'^META-INF/(?:[^/]+\.(?:SF|DSA|RSA|EC)|SIG-[^/]*)$', re.IGNORECASE)
+    MANIFEST = 'META-INF/MANIFEST.MF'
+    DROPPED = ('META-INF/INDEX.LIST',)  # stale as soon as entries move between JARs
+    # Legal files differ per JAR by nature; the first one is kept without counting a conflict
+    LEGAL = re.compile(r'^META-INF/(?:LICENSE|NOTICE|DEPENDENCIES)(?:\.[a-z]+)?$', re.IGNORECASE)
+    COMPRESSION = {'stored': zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED}
+    
+    def __init__(self, compression: str = 'stored', level: int = None, mtime: int = 0):
+        self.compression = self.COMPRESSION[compression]
+        self.level = level
+        # Zip timestamps cannot go before 1980
+        self.date_time = time.gmtime(max(mtime, 315532800))[:6]
+    
+    @classmethod
+    def is_signed(cls, path: Path) -> bool:
+        with zipfile.ZipFile(path) as jar:
+            return any(cls.SIGNATURE.match(name) for name in jar.namelist())
+    
+    @staticmethod
+    def _multi_release(jar: zipfile.ZipFile) -> bool:
+        try:
+            manifest = jar.read('META-INF/MANIFEST.MF').decode('utf-8', 'replace')
+        except KeyError:
+            return False
+        return re.search(r'^Multi-Release:\s*true\s*$', manifest, re.IGNORECASE | re.MULTILINE) is not None
+    
+    def _entry(self, name: str) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, self.date_time)
+        info.create_system = 3
+        info.external_attr = (0o40755 if name.endswith('/') else 0o100644) << 16
+        info.compress_type = zipfile.ZIP_STORED if name.endswith('/') else self.compression
+        return info
+    
+    def merge(self, output: Path, jars: List[Path]) -> Dict[str, Any]:
+        """Write the entries of jars (in order) into one JAR; returns entry counts and conflicts"""
+        entries: Dict[str, Tuple[int, int, Path]] = {}  # name -> (crc, size, source)
+        contents: Dict[str, bytes] = {}
+        services: Dict[str, List[str]] = {}
+        conflicts = []
+        duplicates = 0
+        multi_release = False
+        for path in jars:
+            with zipfile.ZipFile(path) as jar:
+                multi_release = multi_release or self._multi_release(jar)
+                for info in jar.infolist():
+                    name = info.filename
+                    if (name in (self.MANIFEST, 'META-INF/') or name in self.DROPPED
+                            or name.endswith('module-info.class') or self.SIGNATURE.match(name)):
+                        continue
+                    if name.startswith(ClasspathScanner.SERVICES_PREFIX) and not name.endswith('/'):
+                        providers = services.setdefault(name, [])
+                        for line in jar.read(info).decode('utf-8', 'replace').splitlines():
+                            provider = line.split('#', 1)[0].strip()
+                            if provider and provider not in providers:
+                                providers.append(provider)
+                        continue
+                    known = entries.get(name)
+                    if known is None:
+                        entries[name] = (info.CRC, info.file_size, path)
+                        contents[name] = b'' if name.endswith('/') else jar.read(info)
+                    elif known[:2] == (info.CRC, info.file_size):
+                        duplicates += 1
+                    elif not name.endswith('/') and not self.LEGAL.match(name):
+                        conflicts.append({'entry': name, 'kept': known[2].name, 'dropped': path.name})
+        
+        for name, providers in services.items():
+            contents[name] = ''.join(f"{provider}\n" for provider in providers).encode('utf-8')
+        manifest = 'Manifest-Version: 1.0\r\nCreated-By: dependency_manager repack\r\n'
+        if multi_release:
+            manifest += 'Multi-Release: true\r\n'
+        
+        tmp_path = output.with_name(f".{output.name}.tmp")
+        with zipfile.ZipFile(tmp_path, 'w', compresslevel=self.level) as out:
+            # JarInputStream only finds the manifest as one of the first entries
+            out.writestr(self._entry('META-INF/'), b'')
+            out.writestr(self._entry(self.MANIFEST), (manifest + '\r\n').encode('utf-8'))
+            for name in sorted(contents):
+                # writestr ignores the archive's compresslevel when given a ZipInfo
+                out.writestr(self._entry(name), contents[name], compresslevel=self.level)
+        os.replace(tmp_path, output)
+        return {'entries': len(contents) + 2, 'duplicates': duplicates, 'services': len(services),
+                'conflicts': conflicts}
+    
+    @staticmethod
+    def measure(jars: List[Path], classes: List[str], rounds: int = 3) -> Dict[str, float]:
+        """Time opening the classpath and looking classes up in it the way a URLClassLoader does.
+        
+        Opening parses each JAR's central directory; each lookup probes the
+        JARs in classpath order and reads (inflating if needed) the first hit.
+        The best of several rounds is reported to keep page-cache noise out.
+        """
+        best_open = best_lookup = None
+        found = 0
+        for _ in range(rounds):
+            started = time.perf_counter()
+            opened = [zipfile.ZipFile(path) for path in jars]
+            names = [set(jar.NameToInfo) for jar in opened]
+            open_seconds = time.perf_counter() - started
+            
+            started = time.perf_counter()
+            found = 0
+            for class_name in classes:
+                entry = class_name.replace('.', '/') + '.class'
+                for jar, jar_names in zip(opened, names):
+                    if entry in jar_names:
+                        jar.read(entry)
+                        found += 1
+                        break
+            lookup_seconds = time.perf_counter() - started
+            for jar in opened:
+                jar.close()
+            best_open = open_seconds if best_open is None else min(best_open, open_seconds)
+            best_lookup = lookup_seconds if best_lookup is None else min(best_lookup, lookup_seconds)
+        return {'jars': len(jars), 'bytes': sum(path.stat().st_size for path in jars),
+                'open_seconds': best_open, 'lookup_seconds': best_lookup, 'classes': found}
+
+
+class ArtifactStore:
+    """Content-addressed store for downloaded JARs.
+    
+    Blobs live under blobs/sha256/<xx>/<sha256> and an index maps each Maven
+    coordinate to its blob. Index entries record the last use and drive LRU
+    garbage collection; blob mtimes cannot, since hardlinked outputs share the
+    inode. Files are materialized into target directories as hardlinks,
+    reflinks or, across filesystems, plain copies. Builds share the store
+    through a cache mount, so adding and materializing hold a shared lock and
+    garbage collection an exclusive one.
+    """
+    
+    FICLONE = 0x40049409  # Linux ioctl for copy-on-write clones (btrfs, xfs)
+    
+    def __init__(self, store_dir: str, logger: Logger = None):
+        self.store_dir = Path(store_dir)
+        self.logger = logger
+        self.stats = {'hits': 0, 'misses': 0, 'hardlinked': 0, 'reflinked': 0, 'copied': 0}
+        self._stats_lock = threading.Lock()
+    
+    @staticmethod
+    def default_dir() -> str:
+        """Artifacts are kept next to the metadata cache by default"""
+        return os.path.join(MetadataCache.default_dir(), 'artifacts')
+    
+    def record(self, outcome: str):
+        """Count a store outcome (hits, misses or how a file was materialized)"""
+        with self._stats_lock:
+            self.stats[outcome] += 1
+    
+    def load_stats(self) -> Dict[str, int]:
+        """Cumulative counters across all runs that used this store"""
+        try:
+            with open(self.store_dir / 'stats.json', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    @contextmanager
+    def _locked(self, exclusive: bool = False):
+        """Store-wide lock, shared by every process using this store directory"""
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.store_dir / '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def save_stats(self):
+        """Add this run's counters to the cumulative totals"""
+        with self._locked(exclusive=True):
+            totals = self.load_stats()
+            for key, value in self.stats.items():
+                totals[key] = totals.get(key, 0) + value
+            MetadataCache._write_atomic(self.store_dir / 'stats.json', json.dumps(totals, indent=2).encode('utf-8'))
+    
+    def blob_path(self, sha256: str) -> Path:
+        return self.store_dir / 'blobs' / 'sha256' / sha256[:2] / sha256
+    
+    def _index_path(self, dependency: Dependency) -> Path:
+        return self.store_dir / 'index' / dependency.group_id / dependency.artifact_id / f"{dependency.version}.json"
+    
+    def lookup(self, dependency: Dependency) -> Optional[Dict[str, Any]]:
+        """Return the index entry for a coordinate if its blob is still present"""
+        try:
+            with open(self._index_path(dependency), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        blob = self.blob_path(entry.get('sha256', ''))
+        if not entry.get('sha256') or not blob.exists() or blob.stat().st_size != entry.get('size'):
+            return None
+        return entry
+    
+    def add(self, dependency: Dependency, source: Path, sha256: str, sha1: str, size: int,
+            url: str = None) -> Dict[str, Any]:
+        """Ingest a verified file and index it under its coordinate"""
+        now = time.time()
+        entry = {
+            'coordinate': dependency.coordinate(),
+            'file': dependency.jar_filename(),
+            'sha256': sha256,
+            'sha1': sha1,
+            'size': size,
+            'url': url,
+            'stored_at': now,
+            'used_at': now
+        }
+        blob = self.blob_path(sha256)
+        with self._locked():
+            if not blob.exists():
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                self._link_or_copy(source, blob)
+            self._write_entry(dependency, entry)
+        return entry
+    
+    def _write_entry(self, dependency: Dependency, entry: Dict[str, Any]):
+        index_path = self._index_path(dependency)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        MetadataCache._write_atomic(index_path, json.dumps(entry, indent=2).encode('utf-8'))
+    
+    def materialize(self, dependency: Dependency, entry: Dict[str, Any], target: Path) -> Optional[str]:
+        """Place a stored blob at target; returns how it was placed, or None if it was evicted meanwhile"""
+        blob = self.blob_path(entry['sha256'])
+        with self._locked():
+            if not blob.exists():
+                return None
+            # Record the use for LRU garbage collection
+            entry['used_at'] = time.time()
+            self._write_entry(dependency, entry)
+            if target.exists() and os.path.samefile(blob, target):
+                return 'hardlinked'
+            target.parent.mkdir(parents=True, exist_ok=True)
+            method = self._link_or_copy(blob, target)
+        self.record(method)
+        return method
+    
+    def _link_or_copy(self, source: Path, target: Path) -> str:
+        """Hardlink, then reflink, then copy source to target atomically"""
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            try:
+                os.link(source, tmp_path)
+                method = 'hardlinked'
+            except OSError:
+                method = 'reflinked' if self._reflink(source, tmp_path) else 'copied'
+                if method == 'copied':
+                    shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return method
+    
+    def _reflink(self, source: Path, target: Path) -> bool:
+        if fcntl is None or not hasattr(fcntl, 'ioctl'):
+            return False
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), self.FICLONE, src.fileno())
+            return True
+        except OSError:
+            if target.exists():
+                target.unlink()
+            return False
+    
+    def usage(self) -> Dict[str, int]:
+        """Count blobs and bytes held by the store"""
+        blobs = list(self._blobs())
+        return {'blobs': len(blobs), 'bytes': sum(stat.st_size for _, stat in blobs)}
+    
+    def _blobs(self):
+        root = self.store_dir / 'blobs' / 'sha256'
+        if not root.exists():
+            return
+        for path in root.glob('*/*'):
+            try:
+                yield path, path.stat()
+            except OSError:
+                continue
+    
+    def _index_entries(self) -> Iterator[Tuple[Path, Dict[str, Any]]]:
+        for index_path in (self.store_dir / 'index').glob('*/*/*.json'):
+            try:
+                with open(index_path, 'r') as f:
+                    yield index_path, json.load(f)
+            except (OSError, ValueError):
+                yield index_path, {}
+    
+    def gc(self, max_bytes: int) -> Dict[str, int]:
+        """Evict least recently used blobs until the store fits in max_bytes"""
+        removed = {'blobs': 0, 'bytes': 0, 'index_entries': 0}
+        with self._locked(exclusive=True):
+            # A blob was last used when any coordinate indexing it was; entries
+            # written before used_at existed fall back to the blob's mtime
+            used: Dict[str, float] = {}
+            for _, entry in self._index_entries():
+                if entry.get('sha256') and 'used_at' in entry:
+                    used[entry['sha256']] = max(used.get(entry['sha256'], 0.0), entry['used_at'])
+            blobs = sorted(self._blobs(), key=lambda item: used.get(item[0].name, item[1].st_mtime))
+            total = sum(stat.st_size for _, stat in blobs)
+            for path, stat in blobs:
+                if total <= max_bytes:
+                    break
+                path.unlink()
+                total -= stat.st_size
+                removed['blobs'] += 1
+                removed['bytes'] += stat.st_size
+        
+            # Drop index entries whose blob is gone
+            if removed['blobs']:
+                for index_path, entry in self._index_entries():
+                    sha256 = entry.get('sha256', '')
+                    if not sha256 or not self.blob_path(sha256).exists():
+                        index_path.unlink()
+                        removed['index_entries'] += 1
+        return removed
+    
+    @staticmethod
+    def parse_size(value: str) -> int:
+        """Parse sizes such as 500M, 2G or 1048576 into bytes"""
+        units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+        value = value.strip().upper().rstrip('B')
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit tuned from observed download throughput.
+    
+    Additive increase while aggregate throughput keeps improving, halving on
+    errors such as timeouts, 429s or 5xx responses (AIMD).
+    """
+    
+    def __init__(self, initial: int = 4, minimum: int = 2, maximum: int = 16):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.active = 0
+        self._condition = threading.Condition()
+        self._window_bytes = 0
+        self._window_started = time.monotonic()
+        self._window_completed = 0
+        self._last_throughput = 0.0
+    
+    def acquire(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+    
+    def release(self, transferred: int = 0, failed: bool = False):
+        with self._condition:
+            self.active -= 1
+            if failed:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._reset_window()
+            else:
+                self._window_bytes += transferred
+                self._window_completed += 1
+                # Re-evaluate once per "round" of completed downloads
+                if self._window_completed >= self.limit:
+                    elapsed = max(time.monotonic() - self._window_started, 1e-6)
+                    throughput = self._window_bytes / elapsed
+                    if throughput >= self._last_throughput * 1.05 and self.limit < self.maximum:
+                        self.limit += 1
+                    self._last_throughput = throughput
+                    self._reset_window()
+            self._condition.notify_all()
+    
+    def _reset_window(self):
+        self._window_bytes = 0
+        self._window_completed = 0
+        self._window_started = time.monotonic()
+
+
+class ArtifactFetcher:
+    """Downloads dependency JARs concurrently, hashing them while they stream to disk"""
+    
+    CHUNK_SIZE = 256 * 1024
+    DEFAULT_MAX_PARALLEL = 16
+    
+    def __init__(self, maven: MavenRepository, logger: Logger, max_parallel: int = DEFAULT_MAX_PARALLEL,
+                 timeout: int = 300, max_retries: int = 3, require_checksums: bool = False,
+                 store: ArtifactStore = None):
+        self.maven = maven
+        self.store = store
+        self.timings = maven.timings
+        self.logger = logger
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.require_checksums = require_checksums
+        self.concurrency = AdaptiveConcurrency(initial=min(4, max_parallel), maximum=max_parallel)
+        self.max_parallel = max_parallel
+        # Set on a lockfile mismatch so queued downloads are abandoned
+        self._abort = threading.Event()
+    
+    def fetch(self, dependencies: List[Tuple[str, str, Dependency]], dest: Path,
+              lock: DependencyLock = None) -> Dict[str, Any]:
+        """Download (category, name, dependency) JARs into dest, largest first.
+        
+        With a lock, URLs, sizes and checksums come from the lockfile: nothing
+        is probed, no checksum files are requested and any mismatch fails.
+        """
+        dest.mkdir(parents=True, exist_ok=True)
+        started = time.monotonic()
+        
+        jobs = []
+        for cat, name, dep in dependencies:
+            job = {'category': cat, 'name': name, 'dependency': dep, 'url': dep.jar_url(),
+                   'path': dest / dep.jar_filename(), 'size': None, 'sha1': None, 'sha256': None}
+            if lock is not None:
+                entry = lock.get(cat, name)
+                job.update(url=entry['url'], size=entry['size'], sha1=entry['sha1'], sha256=entry['sha256'])
+            job['repository'], job['relative'] = self._split_url(job['url'], dep)
+            jobs.append(job)
+        
+        # JARs already in the artifact store are linked into place without any request
+        results = []
+        if self.store is not None:
+            pending = []
+            for job in jobs:
+                cached = self._from_store(job)
+                if cached is not None:
+                    results.append(cached)
+                else:
+                    pending.append(job)
+            jobs = pending
+        
+        # Probe sizes (and published checksums) so the largest downloads start
+        # first and the slowest transfer does not end up last in the queue
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix='jar-probe') as executor:
+            list(executor.map(self._probe, [job for job in jobs if job['size'] is None]))
+        jobs.sort(key=lambda job: job['size'] or 0, reverse=True)
+        
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix='jar-fetch') as executor:
+            results.extend(executor.map(self._fetch_one, jobs))
+        
+        elapsed = time.monotonic() - started
+        summary = {
+            'total': len(results),
+            'downloaded': sum(1 for r in results if r['status'] == 'downloaded'),
+            'unchanged': sum(1 for r in results if r['status'] == 'unchanged'),
+            'cached': sum(1 for r in results if r['status'] == 'cached'),
+            'failed': [r for r in results if r['status'] == 'failed'],
+            'aborted': sum(1 for r in results if r['status'] == 'aborted'),
+            'unverified': [r for r in results if r['status'] in ('downloaded', 'unchanged') and not r['verified']],
+            'bytes': sum(r['bytes'] for r in results),
+            'seconds': elapsed,
+            'results': results
+        }
+        return summary
+    
+    def _split_url(self, url: str, dep: Dependency) -> Tuple[Optional[str], str]:
+        """Split a JAR URL into (repository, path) when a mirror can serve the same path.
+        
+        Locked URLs outside the artifact's repository and the mirrors are
+        fetched from exactly that URL, with no repository.
+        """
+        for repository in [dep.repository.rstrip('/')] + self.maven.mirrors:
+            if url.startswith(repository + '/'):
+                return repository, url[len(repository):]
+        return None, url
+    
+    def _send(self, job: Dict[str, Any], kind: str, send) -> requests.Response:
+        """Call send(url) on the healthiest repository serving the job, hedging to mirrors.
+        
+        The winning URL becomes the job's URL, so checksums and the store record it.
+        """
+        if job['repository'] is None:
+            return send(job['url'])
+        candidates = self.maven.candidates(job['repository'])
+        repository, response, others = self.maven.hedged(candidates, lambda base: send(base + job['relative']), kind)
+        for _, other in others:
+            other.close()
+        if response.ok:
+            job['url'] = repository + job['relative']
+        return response
+    
+    def _probe(self, job: Dict[str, Any]):
+        """Fill in Content-Length and any checksum header with a HEAD request"""
+        def head(url: str) -> requests.Response:
+            started = time.perf_counter()
+            response = None
+            try:
+                response = self.maven.request('HEAD', url, timeout=self.maven.timeout, allow_redirects=True)
+                return response
+            finally:
+                self.timings.request('probe', url, time.perf_counter() - started,
+                                     response.status_code if response is not None else None)
+        
+        try:
+            response = self._send(job, 'probe', head)
+            if response.ok:
+                if response.headers.get('Content-Length', '').isdigit():
+                    job['size'] = int(response.headers['Content-Length'])
+                job['sha1'] = self._checksum_header(response)
+        except requests.RequestException as e:
+            self.logger.debug(f"Size probe failed for {job['url']}: {e}")
+    
+    @staticmethod
+    def _checksum_header(response: requests.Response) -> Optional[str]:
+        """Maven Central and most repository managers publish SHA-1 as a header"""
+        value = response.headers.get('X-Checksum-Sha1') or response.headers.get('X-Checksum-SHA1')
+        return value.strip().lower() if value and len(value.strip()) == 40 else None
+    
+    @staticmethod
+    def _hash_file(path: Path, hashers: List[Any]):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(ArtifactFetcher.CHUNK_SIZE), b''):
+                for hasher in hashers:
+                    hasher.update(chunk)
+    
+    @staticmethod
+    def _result(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {'category': job['category'], 'name': job['name'], 'coordinate': job['dependency'].coordinate(),
+                'file': job['path'].name, 'url': job['url'], 'status': 'failed', 'verified': False,
+                'bytes': 0, 'size': None, 'sha1': None, 'sha256': None}
+    
+    def _from_store(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        entry = self.store.lookup(job['dependency'])
+        if entry is None or (job['sha256'] and entry['sha256'] != job['sha256']):
+            return None
+        method = self.store.materialize(job['dependency'], entry, job['path'])
+        if method is None:
+            return None
+        self.store.record('hits')
+        result = self._result(job)
+        result.update(status='cached', verified=True, size=entry['size'],
+                      sha1=entry['sha1'], sha256=entry['sha256'])
+        self.logger.debug(f"From store ({method}): {job['path'].name}")
+        return result
+    
+    def _store(self, job: Dict[str, Any], result: Dict[str, Any]):
+        if self.store is not None and result['verified']:
+            self.store.record('misses')
+            self.store.add(job['dependency'], job['path'], result['sha256'], result['sha1'],
+                           result['size'], url=job['url'])
+    
+    def _fetch_one(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        path: Path = job['path']
+        result = self._result(job)
+        
+        if self._abort.is_set():
+            result['status'] = 'aborted'
+            return result
+        
+        if path.exists() and job['sha1']:
+            sha1, sha256 = hashlib.sha1(), hashlib.sha256()
+            self._hash_file(path, [sha1, sha256])
+            if sha1.hexdigest() == job['sha1'] and sha256.hexdigest() == (job['sha256'] or sha256.hexdigest()):
+                result.update(status='unchanged', verified=True, size=path.stat().st_size,
+                              sha1=sha1.hexdigest(), sha256=sha256.hexdigest())
+                self.logger.info(f"Up to date: {path.name}")
+                self._store(job, result)
+                return result
+        
+        part_path = path.with_name(path.name + '.part')
+        for attempt in range(1, self.max_retries + 1):
+            self.concurrency.acquire()
+            transferred = 0
+            failed = True
+            response = None
+            try:
+                transferred, sha1, sha256, expected_sha1 = self._stream(job, part_path)
+                failed = False
+            except (requests.RequestException, OSError, ValueError) as e:
+                response = getattr(e, 'response', None)
+                self.logger.warning(f"Download failed (attempt {attempt}/{self.max_retries}): {path.name}: {e}")
+            finally:
+                self.concurrency.release(transferred, failed)
+            
+            if failed:
+                # A missing or forbidden JAR will not appear by asking again
+                if RequestScheduler.classify(response.status_code if response is not None else None) in \
+                        ('missing', 'fatal'):
+                    break
+                if attempt < self.max_retries:
+                    self.timings.retry('jar')
+                    time.sleep(self.maven.scheduler.backoff(attempt, RequestScheduler.retry_after(response)))
+                continue
+            
+            if job['sha256'] and (sha256 != job['sha256'] or sha1 != job['sha1']):
+                # Locked content changed upstream; never retry or fall back
+                self.logger.error(f"Lockfile mismatch for {path.name}: expected sha256 {job['sha256']}, got {sha256}")
+                part_path.unlink()
+                self._abort.set()
+                return result
+            if expected_sha1 is None:
+                expected_sha1 = self._fetch_remote_sha1(job['url'])
+            if expected_sha1 is not None and expected_sha1 != sha1:
+                self.logger.warning(f"Checksum mismatch for {path.name}: expected {expected_sha1}, got {sha1}")
+                part_path.unlink()
+                if attempt < self.max_retries:
+                    self.timings.retry('jar')
+                continue
+            if expected_sha1 is None and self.require_checksums:
+                self.logger.error(f"No published checksum for {path.name}")
+                part_path.unlink()
+                return result
+            
+            os.replace(part_path, path)
+            result.update(status='downloaded', verified=expected_sha1 is not None, bytes=transferred,
+                          size=path.stat().st_size, sha1=sha1, sha256=sha256)
+            verified = "verified" if expected_sha1 else "unverified"
+            self.logger.success(f"Downloaded: {path.name} ({path.stat().st_size / 1048576:.2f}MB, {verified})")
+            self._store(job, result)
+            return result
+        
+        self.logger.error(f"Failed to download after {attempt} attempts: {path.name} ({job['url']})")
+        return result
+    
+    def _stream(self, job: Dict[str, Any], part_path: Path) -> Tuple[int, str, str, Optional[str]]:
+        """Stream the JAR into a .part file, resuming with a Range request when possible"""
+        sha1, sha256 = hashlib.sha1(), hashlib.sha256()
+        headers = {}
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset:
+            headers['Range'] = f"bytes={offset}-"
         
-        # Handle special case for listenablefuture empty jar
-        if 'empty-to-avoid-conflict' in version:
-            # Extract the version number before the descriptor
-            parts = version.split('-')
-            if parts and parts[0]:
-                return parts[0]
-            return '9999.0'  # Default high version for empty jar
+        started = time.perf_counter()
+        status = None
+        transferred = 0
+        try:
+            # Only the wait for headers is hedged; the body comes from the mirror that answered first
+            with self._send(job, 'jar', lambda url: self.maven.request('GET', url, headers=headers, stream=True,
+                                                                       timeout=self.timeout)) as response:
+                status = response.status_code
+                if response.status_code == 416:
+                    # Partial file is stale or already complete; start over
+                    part_path.unlink()
+                    raise ValueError("stale partial download discarded")
+                response.raise_for_status()
+            
+                if offset and response.status_code == 206:
+                    # Hash the bytes already on disk so checksums cover the whole file
+                    self._hash_file(part_path, [sha1, sha256])
+                    mode = 'ab'
+                else:
+                    offset = 0
+                    mode = 'wb'
+            
+                expected_sha1 = job['sha1'] or self._checksum_header(response)
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                        f.write(chunk)
+                        sha1.update(chunk)
+                        sha256.update(chunk)
+                        transferred += len(chunk)
+        finally:
+            self.timings.request('jar', job['url'], time.perf_counter() - started, status, transferred)
         
-        return version
+        total = offset + transferred
+        if job['size'] is not None and total != job['size']:
+            # The response ended cleanly but with the wrong length; do not resume from it
+            part_path.unlink()
+            raise ValueError(f"size mismatch ({total} of {job['size']} bytes)")
+        if total == 0:
+            part_path.unlink()
+            raise ValueError("empty download")
+        return transferred, sha1.hexdigest(), sha256.hexdigest(), expected_sha1
     
-    def get_compatible_range(self, flink_version: str, dependency_type: str) -> Optional[Tuple[str, str]]:
-        """Get the compatible version range for a dependency"""
-        key = f'flink-{flink_version}'
-        if key in self.rules and dependency_type in self.rules[key]:
-            return self.rules[key][dependency_type]
+    def _fetch_remote_sha1(self, url: str) -> Optional[str]:
+        """Fetch the published .sha1 file when no checksum header was available"""
+        started = time.perf_counter()
+        try:
+            response = self.maven.request('GET', url + '.sha1', timeout=self.maven.timeout)
+            self.timings.request('sha1', url, time.perf_counter() - started, response.status_code,
+                                 len(response.content))
+            if response.ok:
+                checksum = response.text.strip().split()[0].lower() if response.text.strip() else ''
+                if len(checksum) == 40:
+                    return checksum
+        except requests.RequestException as e:
+            self.timings.request('sha1', url, time.perf_counter() - started)
+            self.logger.debug(f"Checksum fetch failed for {url}: {e}")
         return None
 
 
-class MavenRepository:
-    """Handles Maven repository interactions"""
+class ClasspathScanner:
+    """Indexes the classes and service files of JARs straight from their zip
+    central directory (mmap, no extraction) and reports duplicate classes,
+    split packages and conflicting META-INF/services files.
+    
+    Per-JAR indexes are cached by content sha256, so unchanged JARs are never
+    parsed twice.
+    """
     
-    def __init__(self, logger: Logger, timeout: int = 30, max_retries: int = 3):
+    CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+    LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+    SERVICES_PREFIX = 'META-INF/services/'
+    FACTORY_SERVICES = ('org.apache.flink.table.factories.Factory', 'org.apache.flink.table.factories.TableFactory')
+    PLATFORM_PACKAGES = ('java.', 'javax.', 'jdk.', 'sun.', 'com.sun.')
+    DESCRIPTOR_CLASS = re.compile(rb'L([A-Za-z_$][\w/$]*);')
+    INDEX_VERSION = 1
+    
+    def __init__(self, logger: Logger, cache_dir: str = None, workers: int = None):
         self.logger = logger
-        self.timeout = timeout
-        self.max_retries = max_retries
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Flink-Dependency-Manager/1.0'
-        })
+        self.cache_dir = Path(cache_dir) / 'classpath' if cache_dir else None
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = {'cached': 0, 'indexed': 0}
     
-    def get_metadata(self, group_id: str, artifact_id: str, repository: str = None) -> Optional[ET.Element]:
-        """Fetch Maven metadata for an artifact"""
-        if repository is None:
-            repository = "https://repo1.maven.org/maven2"
-            
-        group_path = group_id.replace('.', '/')
-        metadata_url = f"{repository}/{group_path}/{artifact_id}/maven-metadata.xml"
+    @classmethod
+    def _central_directory(cls, mm: mmap.mmap) -> Tuple[int, int]:
+        """Locate the central directory, following the ZIP64 locator when needed"""
+        eocd = mm.rfind(b'PK\x05\x06', max(0, len(mm) - 65557))
+        if eocd < 0:
+            raise ValueError("no end of central directory record")
+        entries, _, offset = struct.unpack_from('<HII', mm, eocd + 10)
+        if entries == 0xFFFF or offset == 0xFFFFFFFF:
+            locator = eocd - 20
+            if locator >= 0 and mm[locator:locator + 4] == b'PK\x06\x07':
+                eocd64 = struct.unpack_from('<Q', mm, locator + 8)[0]
+                entries, _, offset = struct.unpack_from('<QQQ', mm, eocd64 + 32)
+        return entries, offset
+    
+    @classmethod
+    def _read_entry(cls, mm: mmap.mmap, local_offset: int, method: int, compressed_size: int) -> bytes:
+        """Read one (small) entry's content through its local header"""
+        header = cls.LOCAL_HEADER.unpack_from(mm, local_offset)
+        start = local_offset + cls.LOCAL_HEADER.size + header[9] + header[10]
+        data = mm[start:start + compressed_size]
+        if method == 8:
+            return zlib.decompress(data, -15)
+        if method == 0:
+            return data
+        raise ValueError(f"unsupported compression method {method}")
+    
+    @classmethod
+    def _entries(cls, mm: mmap.mmap) -> Iterator[Tuple[str, int, int, int, int]]:
+        """Walk the central directory: (name, CRC-32, method, compressed size, local header offset)"""
+        entries, position = cls._central_directory(mm)
+        for _ in range(entries):
+            (signature, _, _, flags, method, _, _, crc, compressed_size, size, name_length, extra_length,
+             comment_length, _, _, _, local_offset) = cls.CENTRAL_HEADER.unpack_from(mm, position)
+            if signature != 0x02014b50:
+                raise ValueError("corrupt central directory")
+            name_start = position + cls.CENTRAL_HEADER.size
+            raw_name = mm[name_start:name_start + name_length]
+            if 0xFFFFFFFF in (size, compressed_size, local_offset):
+                extra = mm[name_start + name_length:name_start + name_length + extra_length]
+                compressed_size, local_offset = cls._zip64_fields(extra, size, compressed_size, local_offset)
+            yield raw_name.decode('utf-8' if flags & 0x800 else 'cp437'), crc, method, compressed_size, local_offset
+            position = name_start + name_length + extra_length + comment_length
+    
+    @staticmethod
+    def _is_class(name: str) -> bool:
+        # Multi-release overlays and module descriptors are not classpath duplicates
+        return name.endswith('.class') and not name.startswith('META-INF/') and not name.endswith('module-info.class')
+    
+    @classmethod
+    def _read_services(cls, mm: mmap.mmap, method: int, compressed_size: int, local_offset: int) -> List[str]:
+        content = cls._read_entry(mm, local_offset, method, compressed_size)
+        providers = [line.split('#', 1)[0].strip() for line in content.decode('utf-8', 'replace').splitlines()]
+        return sorted(p for p in providers if p)
+    
+    @classmethod
+    def index_jar(cls, path: str) -> Dict[str, Any]:
+        """Index a JAR: class name -> CRC-32, service file -> providers"""
+        classes = {}
+        services = {}
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for name, crc, method, compressed_size, local_offset in cls._entries(mm):
+                if cls._is_class(name):
+                    classes[name[:-6].replace('/', '.')] = crc
+                elif name.startswith(cls.SERVICES_PREFIX) and not name.endswith('/'):
+                    services[name[len(cls.SERVICES_PREFIX):]] = cls._read_services(
+                        mm, method, compressed_size, local_offset)
+        return {'version': cls.INDEX_VERSION, 'classes': classes, 'services': services}
+    
+    @staticmethod
+    def class_constants(data: bytes) -> Tuple[List[str], List[str], Optional[str]]:
+        """Read a class file's constant pool: (referenced classes, string constants, IDENTIFIER field value).
         
-        self.logger.debug(f"Fetching metadata from: {metadata_url}")
+        Referenced classes come from class entries and from type descriptors, so
+        field and method signatures count as references too.
+        """
+        if data[:4] != b'\xca\xfe\xba\xbe':
+            raise ValueError("not a class file")
+        count = struct.unpack_from('>H', data, 8)[0]
+        utf8: Dict[int, bytes] = {}
+        class_indexes = []
+        strings_at: Dict[int, int] = {}  # string constant index -> its UTF-8 entry
+        position = 10
+        index = 1
+        while index < count:
+            tag = data[position]
+            if tag == 1:
+                length = struct.unpack_from('>H', data, position + 1)[0]
+                utf8[index] = data[position + 3:position + 3 + length]
+                position += 3 + length
+            elif tag == 7:
+                class_indexes.append(struct.unpack_from('>H', data, position + 1)[0])
+                position += 3
+            elif tag == 8:
+                strings_at[index] = struct.unpack_from('>H', data, position + 1)[0]
+                position += 3
+            elif tag in (5, 6):
+                # Long and double take two slots
+                position += 9
+                index += 1
+            elif tag in (3, 4, 9, 10, 11, 12, 17, 18):
+                position += 5
+            elif tag == 15:
+                position += 4
+            elif tag in (16, 19, 20):
+                position += 3
+            else:
+                raise ValueError(f"unknown constant pool tag {tag}")
+            index += 1
         
-        for attempt in range(self.max_retries):
-            try:
-                response = self.session.get(metadata_url, timeout=self.timeout)
-                response.raise_for_status()
-                
-                return ET.fromstring(response.content)
-                
-            except Exception as e:
-                self.logger.debug(f"Attempt {attempt + 1} failed for {group_id}:{artifact_id}: {e}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(1)
-                    continue
-                    
-        self.logger.warning(f"Failed to fetch metadata for {group_id}:{artifact_id}")
-        return None
+        references = set()
+        for class_index in class_indexes:
+            name = utf8.get(class_index, b'')
+            if name.startswith(b'['):
+                continue  # array types are picked up through their descriptor below
+            references.add(name)
+        for value in utf8.values():
+            if b'L' in value and b';' in value:
+                references.update(ClasspathScanner.DESCRIPTOR_CLASS.findall(value))
+        strings = [utf8.get(i, b'').decode('utf-8', 'replace') for i in strings_at.values()]
+        
+        # static final String IDENTIFIER = "..." is how Flink factories name themselves
+        identifier = None
+        position += 6  # access flags, this class, super class
+        interfaces = struct.unpack_from('>H', data, position)[0]
+        position += 2 + 2 * interfaces
+        fields = struct.unpack_from('>H', data, position)[0]
+        position += 2
+        for _ in range(fields):
+            _, name_index, _, attributes = struct.unpack_from('>HHHH', data, position)
+            position += 8
+            for _ in range(attributes):
+                attribute_name, length = struct.unpack_from('>HI', data, position)
+                if (utf8.get(name_index) == b'IDENTIFIER' and utf8.get(attribute_name) == b'ConstantValue'
+                        and length == 2):
+                    value = strings_at.get(struct.unpack_from('>H', data, position + 6)[0])
+                    if value is not None:
+                        identifier = utf8.get(value, b'').decode('utf-8', 'replace')
+                position += 6 + length
+        return ([r.decode('utf-8', 'replace').replace('/', '.') for r in references], strings, identifier)
     
-    def get_latest_version(self, metadata: ET.Element, include_prereleases: bool = False) -> Optional[str]:
-        """Extract latest version from Maven metadata"""
-        if metadata is None:
-            return None
-            
-        versions = []
-        versioning = metadata.find('versioning')
-        if versioning is not None:
-            versions_elem = versioning.find('versions')
-            if versions_elem is not None:
-                for version_elem in versions_elem.findall('version'):
-                    if version_elem.text:
-                        versions.append(version_elem.text)
-        
-        if not versions:
-            return None
+    @classmethod
+    def index_references(cls, path: str) -> Dict[str, Any]:
+        """Index a JAR with its class references and the identifiers of its table factories"""
+        classes = {}
+        services = {}
+        class_entries = []
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for name, crc, method, compressed_size, local_offset in cls._entries(mm):
+                if cls._is_class(name):
+                    classes[name[:-6].replace('/', '.')] = crc
+                    class_entries.append((name[:-6].replace('/', '.'), method, compressed_size, local_offset))
+                elif name.startswith(cls.SERVICES_PREFIX) and not name.endswith('/'):
+                    services[name[len(cls.SERVICES_PREFIX):]] = cls._read_services(
+                        mm, method, compressed_size, local_offset)
             
-        # Filter out snapshots and pre-releases if not wanted
-        filtered_versions = []
-        for v in versions:
-            if 'SNAPSHOT' in v.upper():
+            factories = {provider for service in cls.FACTORY_SERVICES for provider in services.get(service, [])}
+            references = set()
+            identifiers = {}
+            for class_name, method, compressed_size, local_offset in class_entries:
+                try:
+                    refs, strings, identifier = cls.class_constants(
+                        cls._read_entry(mm, local_offset, method, compressed_size))
+                except (ValueError, IndexError, struct.error, zlib.error):
+                    continue
+                references.update(refs)
+                if class_name in factories:
+                    identifiers[class_name] = [identifier] if identifier else sorted(set(strings))
+        
+        references = sorted(r for r in references - set(classes) if not r.startswith(cls.PLATFORM_PACKAGES))
+        return {'version': cls.INDEX_VERSION, 'classes': classes, 'services': services,
+                'references': references, 'factories': identifiers}
+    
+    @classmethod
+    def _index_or_error(cls, path: str, deep: bool = False) -> Dict[str, Any]:
+        try:
+            return cls.index_references(path) if deep else cls.index_jar(path)
+        except (OSError, ValueError, struct.error, zlib.error) as e:
+            return {'error': str(e)}
+    
+    @staticmethod
+    def _zip64_fields(extra: bytes, size: int, compressed_size: int, local_offset: int) -> Tuple[int, int]:
+        """Read overflowed sizes/offset from the ZIP64 extra field"""
+        position = 0
+        while position + 4 <= len(extra):
+            header_id, length = struct.unpack_from('<HH', extra, position)
+            if header_id == 0x0001:
+                # Only overflowed fields are present, always in this order
+                values = list(struct.unpack_from(f'<{length // 8}Q', extra, position + 4))
+                if size == 0xFFFFFFFF and values:
+                    values.pop(0)
+                if compressed_size == 0xFFFFFFFF and values:
+                    compressed_size = values.pop(0)
+                if local_offset == 0xFFFFFFFF and values:
+                    local_offset = values.pop(0)
+                break
+            position += 4 + length
+        return compressed_size, local_offset
+    
+    def _cached_digest(self, path: Path, stat_index: Dict[str, List[Any]]) -> str:
+        """sha256 of a JAR, reusing the previous digest while size and mtime match"""
+        stat = path.stat()
+        known = stat_index.get(str(path))
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        stat_index[str(path)] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+    
+    def index(self, jars: List[Tuple[str, Path]], deep: bool = False) -> Dict[str, Dict[str, Any]]:
+        """Index (label, path) JARs in parallel, serving unchanged JARs from the cache.
+        
+        A deep index also parses every class for its references (see index_references).
+        """
+        suffix = '.refs.json' if deep else '.json'
+        stat_index = {}
+        if self.cache_dir is not None:
+            try:
+                with open(self.cache_dir / 'stat-index.json', 'r') as f:
+                    stat_index = json.load(f)
+            except (OSError, ValueError):
+                stat_index = {}
+        
+        indexes = {}
+        pending = []
+        for label, path in jars:
+            if self.cache_dir is None:
+                pending.append((label, path, None))
                 continue
-            if not include_prereleases:
-                if any(pre in v.upper() for pre in ['ALPHA', 'BETA', 'RC', 'M']):
+            digest = self._cached_digest(path, stat_index)
+            try:
+                with open(self.cache_dir / f"{digest}{suffix}", 'r') as f:
+                    cached = json.load(f)
+                if cached.get('version') == self.INDEX_VERSION:
+                    indexes[label] = cached
+                    self.stats['cached'] += 1
                     continue
-            filtered_versions.append(v)
+            except (OSError, ValueError):
+                pass
+            pending.append((label, path, digest))
         
-        if not filtered_versions:
-            return None
+        if pending:
+            # Parsing is CPU-bound, so spread it over processes rather than threads
+            workers = min(self.workers, len(pending))
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(functools.partial(self._index_or_error, deep=deep),
+                                                [str(path) for _, path, _ in pending]))
+            else:
+                results = [self._index_or_error(str(path), deep) for _, path, _ in pending]
             
-        # Sort versions and return latest
-        try:
-            sorted_versions = sorted(filtered_versions, key=pkg_version.parse, reverse=True)
-            return sorted_versions[0]
-        except Exception:
-            # Fallback to simple string sorting
-            return sorted(filtered_versions)[-1]
+            for (label, path, digest), result in zip(pending, results):
+                if 'error' in result:
+                    self.logger.warning(f"Skipping unreadable JAR {path}: {result['error']}")
+                    continue
+                indexes[label] = result
+                self.stats['indexed'] += 1
+                if digest is not None:
+                    self.cache_dir.mkdir(parents=True, exist_ok=True)
+                    MetadataCache._write_atomic(self.cache_dir / f"{digest}{suffix}",
+                                                json.dumps(result, separators=(',', ':')).encode('utf-8'))
+        
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            MetadataCache._write_atomic(self.cache_dir / 'stat-index.json', json.dumps(stat_index).encode('utf-8'))
+        return indexes
+    
+    @staticmethod
+    def winners(indexes: Dict[str, Dict[str, Any]], order: List[str]) -> Dict[str, Tuple[str, int]]:
+        """Class name -> (label, CRC-32) of the JAR that serves it when the labels are searched in order"""
+        found: Dict[str, Tuple[str, int]] = {}
+        for label in order:
+            for class_name, crc in indexes.get(label, {}).get('classes', {}).items():
+                found.setdefault(class_name, (label, crc))
+        return found
+    
+    @staticmethod
+    def analyze(indexes: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Find duplicate classes, split packages and conflicting service files"""
+        owners: Dict[str, List[Tuple[str, int]]] = {}
+        packages: Dict[str, Dict[str, int]] = {}
+        for label, index in indexes.items():
+            for class_name, crc in index['classes'].items():
+                owners.setdefault(class_name, []).append((label, crc))
+                package = class_name.rpartition('.')[0]
+                package_jars = packages.setdefault(package, {})
+                package_jars[label] = package_jars.get(label, 0) + 1
+        
+        # Group duplicates by the set of JARs that carry them to keep the report readable
+        duplicate_groups: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        duplicated_by_package: Dict[str, set] = {}
+        for class_name, class_owners in owners.items():
+            if len(class_owners) < 2:
+                continue
+            jars = tuple(sorted(label for label, _ in class_owners))
+            group = duplicate_groups.setdefault(jars, {'jars': list(jars), 'classes': 0, 'differing': 0,
+                                                       'examples': [], 'identical_examples': []})
+            group['classes'] += 1
+            if len({crc for _, crc in class_owners}) > 1:
+                group['differing'] += 1
+                if len(group['examples']) < 5:
+                    group['examples'].append(class_name)
+            elif len(group['identical_examples']) < 3:
+                group['identical_examples'].append(class_name)
+            duplicated_by_package.setdefault(class_name.rpartition('.')[0], set()).add(class_name)
+        # Prefer classes whose bytecode differs as examples
+        for group in duplicate_groups.values():
+            identical = group.pop('identical_examples')
+            group['examples'] = group['examples'] or identical
+        
+        # A split package has classes from several JARs that are not just copies of each other
+        split_packages = []
+        for package, package_jars in packages.items():
+            if len(package_jars) < 2:
+                continue
+            duplicated = len(duplicated_by_package.get(package, ()))
+            if any(count > duplicated for count in package_jars.values()):
+                split_packages.append({'package': package or '(default)', 'jars': sorted(package_jars)})
+        
+        services: Dict[str, Dict[str, List[str]]] = {}
+        for label, index in indexes.items():
+            for service, providers in index['services'].items():
+                services.setdefault(service, {})[label] = providers
+        service_conflicts = []
+        for service, by_jar in services.items():
+            missing = sorted({provider for providers in by_jar.values() for provider in providers
+                              if provider not in owners})
+            distinct = {tuple(providers) for providers in by_jar.values()}
+            if len(by_jar) > 1 and len(distinct) > 1 or missing:
+                service_conflicts.append({'service': service, 'providers': by_jar, 'missing_providers': missing})
+        
+        return {
+            'jars': len(indexes),
+            'classes': len(owners),
+            'duplicates': sorted(duplicate_groups.values(), key=lambda g: (-g['differing'], -g['classes'])),
+            'split_packages': sorted(split_packages, key=lambda p: p['package']),
+            'service_conflicts': sorted(service_conflicts, key=lambda s: s['service'])
+        }
 
 
-class Dependency:
-    """Represents a single dependency"""
+class PipelineAnalyzer:
+    """Finds the connectors, formats, catalogs, modules and classes Flink SQL scripts use.
     
-    def __init__(self, name: str, group_id: str, artifact_id: str, version: str, 
-                 description: str = "", repository: str = None):
-        self.name = name
+    Statements are split outside string literals and comments, and every
+    `'key' = 'value'` pair is read from them. The identifiers are the names
+    table factories answer to, so they can be looked up in a factory index.
+    Values that look like Java class names (JAAS login modules, callback
+    handlers, UDFs) are collected as well.
+    """
+    
+    KINDS = ('connector', 'format', 'catalog', 'module', 'class')
+    FORMAT_KEY = re.compile(r'^(?:key\.|value\.)?format$')
+    CLASS_NAME = re.compile(r'\b(?:[a-z_][a-z0-9_]*\.)+[A-Z][A-Za-z0-9_$]*\b')
+    LITERAL = '\x00{}\x00'
+    OPTION = re.compile(r"\x00(\d+)\x00\s*=\s*\x00(\d+)\x00")
+    FUNCTION = re.compile(r'\bCREATE\s+(?:TEMPORARY\s+)?(?:SYSTEM\s+)?FUNCTION\b.*?\bAS\s+\x00(\d+)\x00',
+                          re.IGNORECASE | re.DOTALL)
+    CATALOG = re.compile(r'\bCREATE\s+CATALOG\b', re.IGNORECASE)
+    MODULE = re.compile(r'\bLOAD\s+MODULE\s+`?(\w[\w-]*)`?', re.IGNORECASE)
+    
+    @classmethod
+    def split(cls, sql: str) -> List[Tuple[str, List[str]]]:
+        """Split a script into (statement with literals replaced by placeholders, literals)"""
+        statements = []
+        text: List[str] = []
+        literals: List[str] = []
+        i = 0
+        length = len(sql)
+        while i < length:
+            char = sql[i]
+            if char == "'":
+                # '' is an escaped quote inside a literal
+                j = i + 1
+                value = []
+                while j < length:
+                    if sql[j] == "'":
+                        if j + 1 < length and sql[j + 1] == "'":
+                            value.append("'")
+                            j += 2
+                            continue
+                        break
+                    value.append(sql[j])
+                    j += 1
+                text.append(cls.LITERAL.format(len(literals)))
+                literals.append(''.join(value))
+                i = j + 1
+            elif sql.startswith('--', i):
+                newline = sql.find('\n', i)
+                i = length if newline < 0 else newline
+            elif sql.startswith('/*', i):
+                end = sql.find('*/', i + 2)
+                i = length if end < 0 else end + 2
+            elif char == ';':
+                statements.append((''.join(text), literals))
+                text, literals = [], []
+                i += 1
+            else:
+                text.append(char)
+                i += 1
+        if ''.join(text).strip():
+            statements.append((''.join(text), literals))
+        return statements
+    
+    @classmethod
+    def analyze(cls, sql: str) -> Dict[str, set]:
+        """Identifiers per kind (connector, format, catalog, module) and referenced class names"""
+        found = {kind: set() for kind in cls.KINDS}
+        for statement, literals in cls.split(sql):
+            is_catalog = bool(cls.CATALOG.search(statement))
+            for key_index, value_index in cls.OPTION.findall(statement):
+                key, value = literals[int(key_index)], literals[int(value_index)].strip()
+                if '${' not in value:
+                    if key == 'connector':
+                        found['connector'].add(value)
+                    elif cls.FORMAT_KEY.match(key):
+                        found['format'].add(value)
+                    elif key == 'type' and is_catalog:
+                        found['catalog'].add(value)
+                found['class'].update(cls.CLASS_NAME.findall(value))
+            for literal_index in cls.FUNCTION.findall(statement):
+                found['class'].add(literals[int(literal_index)].strip())
+            found['module'].update(cls.MODULE.findall(statement))
+        return found
+
+
+class CatalogEntry:
+    """One unique (groupId, artifactId, repository) in an artifact catalog"""
+    
+    __slots__ = ('group_id', 'artifact_id', 'repository', 'index', 'resolved', 'declarations')
+    
+    def __init__(self, group_id: str, artifact_id: str, repository: str):
         self.group_id = group_id
         self.artifact_id = artifact_id
-        self.version = version
-        self.description = description
-        self.repository = repository or "https://repo1.maven.org/maven2"
+        self.repository = repository
+        self.index: Optional[VersionIndex] = None
+        self.resolved = False
+        self.declarations = 0  # how many versions files declare this artifact
+
+
+class ArtifactCatalog:
+    """Artifacts declared by several versions files, each resolved once.
     
-    def to_dict(self) -> Dict[str, Any]:
-        """Convert to dictionary for JSON serialization"""
-        result = {
-            'groupId': self.group_id,
-            'artifactId': self.artifact_id,
-            'version': self.version,
-            'description': self.description
-        }
-        if self.repository != "https://repo1.maven.org/maven2":
-            result['repository'] = self.repository
-        return result
+    Only the sorted version index of each artifact is kept; the metadata XML is
+    dropped as soon as it has been indexed. Coordinate strings are interned so
+    files declaring the same artifact share them.
+    """
     
-    @classmethod
-    def from_dict(cls, name: str, data: Dict[str, Any]) -> 'Dependency':
-        """Create from dictionary"""
-        return cls(
-            name=name,
-            group_id=data['groupId'],
-            artifact_id=data['artifactId'],
-            version=data['version'],
-            description=data.get('description', ''),
-            repository=data.get('repository')
-        )
+    def __init__(self):
+        self.entries: Dict[Tuple[str, str, str], CatalogEntry] = {}
+        self.declarations = 0
     
-    def get_dependency_type(self) -> str:
-        """Determine dependency type for compatibility checking using groupId and artifactId"""
-        name_lower = self.name.lower()
-        group_lower = self.group_id.lower()
-        artifact_lower = self.artifact_id.lower()
-        
-        # Flink native connectors
-        if (group_lower == 'org.apache.flink' and 
-            ('connector' in artifact_lower or 'sql-connector' in artifact_lower)):
-            return 'flink-connector'
-        
-        # Kafka ecosystem
-        if ('kafka' in name_lower or 'kafka' in artifact_lower or 
-            group_lower == 'org.apache.kafka'):
-            if 'clients' in artifact_lower:
-                return 'kafka-clients'
-            elif artifact_lower.startswith('kafka_2.'):
-                # This is the Kafka broker/server library (e.g., kafka_2.12, kafka_2.13)
-                return 'kafka'
-            return 'kafka'
-        
-        # Avro and schema registry
-        if ('avro' in name_lower or 'avro' in artifact_lower):
-            if 'confluent' in name_lower or 'confluent' in artifact_lower:
-                return 'confluent-avro'
-            return 'avro'
-        
-        if 'schema-registry' in name_lower or 'schema-registry' in artifact_lower:
-            return 'schema-registry'
-        
-        # Jackson JSON processing
-        if ('jackson' in name_lower or 'jackson' in artifact_lower or 
-            group_lower.startswith('com.fasterxml.jackson')):
-            if 'core' in artifact_lower:
-                return 'jackson-core'
-            elif 'databind' in artifact_lower:
-                return 'jackson-databind'
-            elif 'annotations' in artifact_lower:
-                return 'jackson-annotations'
-            return 'jackson'
-        
-        # Scala
-        if ('scala' in name_lower or 'scala' in artifact_lower or 
-            group_lower.startswith('org.scala-lang')):
-            if 'library' in artifact_lower:
-                return 'scala-library'
-            return 'scala'
-        
-        # Google libraries
-        if group_lower.startswith('com.google'):
-            if 'guava' in artifact_lower:
-                return 'google-guava'
-            elif 'auth' in artifact_lower:
-                return 'google-auth'
-            elif 'cloud' in artifact_lower:
-                return 'google-cloud'
-            elif 'api' in artifact_lower:
-                return 'google-api'
-            elif 'http' in artifact_lower:
-                return 'google-http'
-            elif 'gson' in artifact_lower:
-                return 'gson'
-            elif 'failureaccess' in artifact_lower:
-                return 'failureaccess'
-            elif 'listenablefuture' in artifact_lower:
-                return 'listenablefuture'
-            elif 'protobuf' in artifact_lower:
-                return 'protobuf'
-        
-        # JSR305 annotations
-        if 'jsr305' in artifact_lower or group_lower == 'com.google.code.findbugs':
-            return 'jsr305'
-        
-        # gRPC
-        if 'grpc' in name_lower or 'grpc' in artifact_lower or group_lower.startswith('io.grpc'):
-            return 'grpc'
-        
-        # Perfmark
-        if 'perfmark' in artifact_lower or group_lower.startswith('io.perfmark'):
-            return 'perfmark'
-        
-        # Protobuf
-        if 'protobuf' in name_lower or 'protobuf' in artifact_lower:
-            return 'protobuf'
-        
-        # Hadoop ecosystem
-        if ('hadoop' in name_lower or 'hadoop' in artifact_lower or 
-            group_lower.startswith('org.apache.hadoop')):
-            if 'client' in artifact_lower:
-                return 'hadoop-client'
-            elif 'common' in artifact_lower:
-                return 'hadoop-common'
-            return 'hadoop'
-        
-        # Logging
-        if 'slf4j' in name_lower or 'slf4j' in artifact_lower:
-            return 'slf4j'
-        if 'logback' in name_lower or 'logback' in artifact_lower:
-            return 'logback'
-        if 'log4j' in name_lower or 'log4j' in artifact_lower:
-            return 'log4j'
-        
-        # Apache Commons
-        if group_lower.startswith('org.apache.commons'):
-            if 'lang3' in artifact_lower:
-                return 'commons-lang3'
-            elif 'cli' in artifact_lower:
-                return 'commons-cli'
-            elif 'io' in artifact_lower:
-                return 'commons-io'
-            elif 'compress' in artifact_lower:
-                return 'commons-compress'
-        
-        # Compression libraries
-        if 'snappy' in artifact_lower:
-            return 'snappy'
-        if 'lz4' in artifact_lower:
-            return 'lz4'
-        if 'zstd' in artifact_lower:
-            return 'zstd'
-        
-        # Netty
-        if 'netty' in name_lower or 'netty' in artifact_lower:
-            return 'netty'
-        
-        # OpenCensus
-        if 'opencensus' in artifact_lower or group_lower.startswith('io.opencensus'):
-            return 'opencensus'
-        
-        # Miscellaneous
-        if 'snakeyaml' in artifact_lower:
-            return 'snakeyaml'
-        if 'swagger' in artifact_lower:
-            return 'swagger'
-        
-        # Other connectors
-        if 'elasticsearch' in name_lower or 'elasticsearch' in artifact_lower:
-            return 'elasticsearch'
-        if 'cassandra' in name_lower or 'cassandra' in artifact_lower:
-            return 'cassandra'
-        if 'mongodb' in name_lower or 'mongodb' in artifact_lower:
-            return 'mongodb'
-        
-        return 'unknown'
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    @staticmethod
+    def _key(dep: Dependency) -> Tuple[str, str, str]:
+        return (sys.intern(dep.group_id), sys.intern(dep.artifact_id), sys.intern(dep.repository.rstrip('/')))
+    
+    def add(self, dependencies: Dict[str, Dict[str, Dependency]]):
+        """Register every dependency of one versions file"""
+        for deps in dependencies.values():
+            for dep in deps.values():
+                key = self._key(dep)
+                entry = self.entries.get(key)
+                if entry is None:
+                    entry = self.entries[key] = CatalogEntry(*key)
+                entry.declarations += 1
+                self.declarations += 1
+    
+    def resolve(self, maven: MavenRepository) -> int:
+        """Fetch metadata for every artifact not resolved yet; returns how many were fetched"""
+        pending = [entry for entry in self.entries.values() if not entry.resolved]
+        with maven.timings.span('fetch'):
+            fetched = maven.get_metadata_many([(e.group_id, e.artifact_id, e.repository) for e in pending])
+        for entry, metadata in zip(pending, fetched):
+            entry.index = maven.get_version_index(metadata)
+            entry.resolved = True
+        return len(pending)
+    
+    def index_for(self, dep: Dependency) -> Optional[VersionIndex]:
+        """Version index of a dependency, or None if it is unknown or could not be resolved"""
+        entry = self.entries.get(self._key(dep))
+        return entry.index if entry is not None else None
 
 
 class DependencyManager:
     """Main dependency management class"""
     
-    def __init__(self, versions_file: str, logger: Logger):
+    # SQL pipelines analyzed by default, relative to the versions file
+    PIPELINES = '../../sql-executor/pipelines*/*.sql'
+    
+    def __init__(self, versions_file: str, logger: Logger,
+                 max_workers: int = MavenRepository.DEFAULT_MAX_WORKERS,
+                 per_repository_limit: int = MavenRepository.DEFAULT_PER_REPOSITORY_LIMIT,
+                 cache: MetadataCache = None, offline: bool = False, rules_file: str = None,
+                 rules_cache_dir: str = None, maven: MavenRepository = None, timings: Timings = None,
+                 state: ScanState = None, history_dir: str = None,
+                 mirrors: List[str] = None, health: MirrorHealth = None, rate_limit: float = None,
+                 solver: FamilySolver = None):
         self.versions_file = Path(versions_file)
         self.logger = logger
-        self.maven = MavenRepository(logger)
-        self.compatibility = CompatibilityMatrix(logger)
+        self.history = VersionsHistory(self.versions_file, history_dir, logger)
+        # Batch runs share one repository client (and its sessions) across versions files
+        self.maven = maven or MavenRepository(logger, max_workers=max_workers,
+                                              per_repository_limit=per_repository_limit,
+                                              cache=cache, offline=offline, timings=timings,
+                                              mirrors=mirrors, health=health, rate_limit=rate_limit)
+        self.timings = self.maven.timings
+        with self.timings.span('load'):
+            self.rules = DependencyRules.load(rules_file, cache_dir=rules_cache_dir, logger=logger)
+        self.compatibility = CompatibilityMatrix(logger, self.rules)
+        # Batch runs also share BOM indexes and models across versions files
+        self.solver = solver or FamilySolver(self.maven, logger)
         self.dependencies: Dict[str, Dict[str, Dependency]] = {}
+        self.families: List[DependencyFamily] = []
         self.metadata = {}
+        self.versions_digest = None
+        # Snapshot shared by every command in this invocation
+        self.scan_result: Optional[ScanResult] = None
+        self._scan_from_file = False
+        # Results of earlier scans, reused for artifacts whose metadata did not change
+        self.state = state
         
-        self._load_dependencies()
+        with self.timings.span('load'):
+            self._load_dependencies()
     
     def _load_dependencies(self):
         """Load dependencies from JSON file"""
@@ -510,21 +5092,38 @@ class DependencyManager:
             raise FileNotFoundError(f"Versions file not found: {self.versions_file}")
         
         try:
-            with open(self.versions_file, 'r') as f:
-                data = json.load(f)
+            raw = self.versions_file.read_bytes()
+            data = json.loads(raw)
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON in versions file: {e}")
         
+        self.versions_digest = hashlib.sha256(raw).hexdigest()
         self.metadata = data.get('metadata', {})
+        self.dependencies = {}
         dependencies_data = data.get('dependencies', {})
         
         for category, deps in dependencies_data.items():
             self.dependencies[category] = {}
             for dep_name, dep_data in deps.items():
                 self.dependencies[category][dep_name] = Dependency.from_dict(dep_name, dep_data)
+        self.families = []
+        for name, spec in self.metadata.get('families', {}).items():
+            try:
+                self.families.append(DependencyFamily.from_dict(name, spec, 'versions'))
+            except ValueError as e:
+                raise ValueError(f"Invalid family {name} in versions file: {e}")
+        # Mirrors listed in the versions file come after those given on the command line
+        self.maven.add_mirrors(self.metadata.get('mirrors', []))
     
-    def _save_dependencies(self):
-        """Save dependencies to JSON file"""
+    def family_members(self) -> List[Tuple[DependencyFamily, List[Tuple[str, str, Dependency]]]]:
+        """Candidate members of every family, versions file families first"""
+        declared = {family.name for family in self.families}
+        families = self.families + [DependencyFamily.from_dict(name, spec, 'rules')
+                                    for name, spec in self.rules.families.items() if name not in declared]
+        return DependencyFamily.assign(families, self.dependencies)
+    
+    def _save_dependencies(self, reason: str = 'update'):
+        """Save dependencies to JSON file and record the result in the history"""
         data = {
             'metadata': self.metadata,
             'dependencies': {}
@@ -541,13 +5140,34 @@ class DependencyManager:
         with open(self.versions_file, 'w') as f:
             json.dump(data, f, indent=2, sort_keys=True)
     
-    def create_backup(self) -> str:
-        """Create a backup of the current versions file"""
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = f"{self.versions_file}.backup.{timestamp}"
-        shutil.copy2(self.versions_file, backup_file)
-        self.logger.success(f"Backup created: {backup_file}")
-        return backup_file
+        # Versions changed, the current snapshot no longer describes them
+        content = self.versions_file.read_bytes()
+        self.versions_digest = hashlib.sha256(content).hexdigest()
+        self.history.record(content, reason)
+        self.scan_result = None
+        self._scan_from_file = False
+    
+    def create_backup(self, reason: str = 'backup') -> Optional[str]:
+        """Snapshot the current versions file into the history; returns the snapshot id"""
+        try:
+            entry, created = self.history.record(self.versions_file.read_bytes(), reason)
+        except ValueError as e:
+            self.logger.warning(f"Not recording {self.versions_file} in the history, it is not valid JSON: {e}")
+            return None
+        if created:
+            self.logger.success(f"Backup recorded: {entry['id']} ({len(entry['changes'])} versions changed)")
+        else:
+            self.logger.info(f"Versions file unchanged since snapshot {entry['id']} ({entry['created_at']})")
+        return entry['id']
+    
+    def _restore_content(self, content: bytes, reason: str):
+        """Replace the versions file, keeping what it held before in the history"""
+        self.create_backup('pre-restore')
+        self.versions_file.write_bytes(content)
+        self._load_dependencies()
+        self.scan_result = None
+        self._scan_from_file = False
+        self.history.record(content, reason)
     
     def restore_backup(self, backup_file: str):
         """Restore from a backup file"""
@@ -562,135 +5182,566 @@ class DependencyManager:
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON in backup file: {e}")
         
-        shutil.copy2(backup_path, self.versions_file)
-        self._load_dependencies()
+        self._restore_content(backup_path.read_bytes(), f"restore {backup_path.name}")
         self.logger.success(f"Restored from backup: {backup_file}")
     
+    def restore_snapshot(self, ref: str = None, before: datetime = None, where: Dict[str, str] = None) -> str:
+        """Restore a snapshot by id, or the newest one taken before a time and/or with given versions"""
+        if ref:
+            entry, _ = self.history.resolve(ref)
+        else:
+            found = self.history.find(before, where)
+            if found is None:
+                conditions = ([f"before {before.isoformat(sep=' ')}"] if before else []) + \
+                    [f"{name}={version}" for name, version in (where or {}).items()]
+                raise ValueError(f"No snapshot matches {' and '.join(conditions)} (see the 'history' command)")
+            entry = found[0]
+        self._restore_content(self.history.load(entry), f"restore {entry['id']}")
+        self.logger.success(f"Restored snapshot {entry['id']} taken {entry['created_at']} ({entry['reason']})")
+        return entry['id']
+    
+    def print_history(self, limit: int = 20, dependency: str = None) -> List[Dict[str, Any]]:
+        """List snapshots newest first, optionally only those that changed one dependency"""
+        shown = []
+        for entry, _ in self.history.replay():
+            changes = entry['changes']
+            if dependency is not None:
+                changes = {key: change for key, change in changes.items()
+                           if key == dependency or key.rpartition('/')[2] == dependency}
+                if not changes:
+                    continue
+            shown.append((entry, changes))
+        shown = shown[::-1][:limit] if limit else shown[::-1]
+        
+        if not shown:
+            self.logger.info(f"No snapshots in {self.history.index_path}")
+            return []
+        self.logger.info(f"History of {self.versions_file} ({self.history.history_dir}):")
+        for entry, changes in shown:
+            if entry.get('base') and dependency is None:
+                summary = f"{len(changes)} versions"
+            else:
+                parts = [f"{key} {old or '∅'} → {new or '∅'}" for key, (old, new) in list(changes.items())[:3]]
+                if len(changes) > 3:
+                    parts.append(f"+{len(changes) - 3} more")
+                summary = ', '.join(parts) or 'no version changes'
+            print(f"  {entry['id']}  {entry['created_at']}  {entry['reason']:<22} {summary}")
+        return [entry for entry, _ in shown]
+    
+    def diff_snapshots(self, a: str, b: str = 'current') -> Dict[str, List[Optional[str]]]:
+        """Print the version changes between two snapshots (or a snapshot and the current file)"""
+        def versions(ref: str) -> Dict[str, str]:
+            if ref == 'current':
+                return {f"{cat}/{dep_name}": dep.version for cat, deps in self.dependencies.items()
+                        for dep_name, dep in deps.items()}
+            return self.history.resolve(ref)[1]
+        
+        changes = VersionsHistory.changes(versions(a), versions(b))
+        if not changes:
+            self.logger.success(f"No version differences between {a} and {b}")
+            return changes
+        self.logger.info(f"{len(changes)} version differences between {a} and {b}:")
+        for key, (old, new) in changes.items():
+            if old is None:
+                print(f"  + {key}: {new}")
+            elif new is None:
+                print(f"  - {key}: {old}")
+            else:
+                print(f"    {key}: {old} → {new}")
+        return changes
+    
+    def load_scan(self, scan_file: str):
+        """Use a saved scan snapshot instead of scanning"""
+        scan = ScanResult.load(scan_file)
+        if scan.versions_digest != self.versions_digest:
+            self.logger.warning(f"Scan {scan_file} was taken from a different revision of "
+                                f"{scan.versions_file}; results may be stale")
+        self.scan_result = scan
+        self._scan_from_file = True
+        self.logger.info(f"Loaded scan snapshot from {scan_file} (taken {scan.created_at})")
+    
+    def save_scan(self, scan_file: str):
+        """Save the current scan snapshot"""
+        if self.scan_result is None:
+            self.logger.warning("No scan snapshot to save")
+            return
+        self.scan_result.save(scan_file)
+        self.logger.success(f"Scan snapshot saved: {scan_file}")
+    
+    def get_scan(self, category: str = None, include_prereleases: bool = False,
+                 exclude: List[str] = None, resolve: bool = True,
+                 targets: List[CompatibilityTarget] = None) -> ScanResult:
+        """Return the snapshot for this invocation, scanning only if it does not cover the request"""
+        scan = self.scan_result
+        if scan is not None and self._scan_from_file:
+            if resolve and not scan.covers(category, exclude):
+                self.logger.warning("Loaded scan did not resolve every requested dependency; "
+                                    "unresolved ones are reported without update information")
+            if resolve and scan.include_prereleases != include_prereleases:
+                self.logger.warning(f"Loaded scan was taken with include_prereleases={scan.include_prereleases}")
+            if not scan.covers_targets(targets):
+                # Targets only need classification and versions the snapshot already holds
+                self.logger.warning("Loaded scan did not evaluate every requested target; "
+                                    "those targets are evaluated for current versions only")
+                self._evaluate_targets(scan.entries, {}, targets, include_prereleases)
+                scan.targets = targets
+            return scan
+        
+        if scan is not None and (not resolve or (scan.covers(category, exclude)
+                                                 and scan.include_prereleases == include_prereleases)) \
+                and scan.covers_targets(targets):
+            return scan
+        
+        self.scan_result = self.scan(category, include_prereleases, exclude, resolve, targets)
+        return self.scan_result
+    
+    def scan(self, category: str = None, include_prereleases: bool = False,
+             exclude: List[str] = None, resolve: bool = True,
+             targets: List[CompatibilityTarget] = None, catalog: 'ArtifactCatalog' = None) -> ScanResult:
+        """Classify and evaluate every dependency once, resolving metadata for those in scope.
+        
+        With a catalog, version indexes come from it instead of the repositories.
+        """
+        # Entries arrive in completion order; the snapshot keeps file order so output stays deterministic
+        order = {key: i for i, key in enumerate((cat, dep_name) for cat, deps in self.dependencies.items()
+                                                for dep_name in deps)}
+        entries = sorted(self.iter_scan(category, include_prereleases, exclude, resolve, targets, catalog),
+                         key=lambda entry: order[(entry.category, entry.name)])
+        if resolve and catalog is None and self.maven.cache is not None:
+            stats = self.maven.cache.stats
+            self.logger.debug(f"Metadata cache: {stats['hits']} hits, {stats['revalidated']} revalidated, "
+                              f"{stats['misses']} misses")
+        
+        return ScanResult(self.metadata.get('flink_version', '2.0.0'), str(self.versions_file),
+                          self.versions_digest, include_prereleases, entries, targets=targets)
+    
+    def iter_scan(self, category: str = None, include_prereleases: bool = False,
+                  exclude: List[str] = None, resolve: bool = True,
+                  targets: List[CompatibilityTarget] = None, catalog: 'ArtifactCatalog' = None,
+                  only: Iterable[Tuple[str, str]] = None) -> Iterator[ScanEntry]:
+        """Yield one evaluated ScanEntry per dependency as soon as it is complete.
+        
+        Dependencies that need no metadata come first, in file order, then
+        family members, evaluated together family by family; the rest follow
+        in the order their metadata arrives. Each version index is
+        dropped once its entry is evaluated, so memory stays flat however many
+        artifacts are scanned. With ``only``, dependencies other than those
+        (category, name) pairs are skipped altogether.
+        """
+        exclude = exclude or []
+        only = set(only) if only is not None else None
+        flink_version = self.metadata.get('flink_version', '2.0.0')
+        ranges_cache: Dict[str, Tuple[List[VersionRange], VersionRange]] = {}
+        families = self._families_in_scope(category, exclude, only, include_prereleases) if resolve else []
+        family_of = {(cat, dep_name) for _, members in families for cat, dep_name, _ in members}
+        family_scope = set()
+        
+        state = self.state if resolve and catalog is None else None
+        context = None
+        if state is not None:
+            rules_digest = hashlib.sha256(self.rules.path.read_bytes()).hexdigest() if self.rules.path else None
+            context = ScanState.digest(ScanResult.FORMAT_VERSION, flink_version, include_prereleases, rules_digest,
+                                       [target.to_dict() for target in targets or []])
+            if state.begin(context):
+                self.logger.info(f"Resuming interrupted scan from {state.path}")
+        
+        to_fetch = []
+        for cat, deps in self.dependencies.items():
+            for dep_name, dep in deps.items():
+                if only is not None and (cat, dep_name) not in only:
+                    continue
+                in_scope = resolve and (category is None or cat == category) and dep_name not in exclude
+                if in_scope and (cat, dep_name) in family_of:
+                    # Never served from the scan state: a change to any member moves the others
+                    family_scope.add((cat, dep_name))
+                    continue
+                if in_scope and catalog is None:
+                    inputs = record = None
+                    if state is not None:
+                        inputs = ScanState.digest(context, dep.coordinate(), dep.repository)
+                        record = state.get(cat, dep_name, inputs)
+                        if state.resumable(record):
+                            state.stats['resumed'] += 1
+                            yield ScanEntry.from_dict(record['entry'])
+                            continue
+                    to_fetch.append((cat, dep_name, dep, inputs, record))
+                    continue
+                index = catalog.index_for(dep) if in_scope else None
+                yield self._scan_entry(cat, dep_name, dep, flink_version, in_scope, index,
+                                       include_prereleases, targets, ranges_cache)
+        
+        if family_scope:
+            yield from self._scan_families(families, family_scope, flink_version, include_prereleases,
+                                           targets, catalog, ranges_cache)
+        
+        if state is None:
+            fetched = self.maven.iter_metadata(((cat, dep_name, dep), dep.group_id, dep.artifact_id, dep.repository)
+                                               for cat, dep_name, dep, _, _ in to_fetch)
+            for (cat, dep_name, dep), metadata in fetched:
+                yield self._scan_entry(cat, dep_name, dep, flink_version, True,
+                                       self.maven.get_version_index(metadata),
+                                       include_prereleases, targets, ranges_cache,
+                                       metadata.last_updated if metadata is not None else None)
+            return
+        
+        try:
+            fetched = self.maven.iter_metadata(((item, item[2], item[4]) for item in to_fetch),
+                                               fetch=self._fetch_if_changed)
+            for (cat, dep_name, dep, inputs, record), result in fetched:
+                changed, metadata, etag, last_updated = result or (True, None, None, None)
+                if not changed:
+                    state.stats['unchanged'] += 1
+                    state.touch(record, etag, last_updated)
+                    yield ScanEntry.from_dict(record['entry'])
+                    continue
+                entry = self._scan_entry(cat, dep_name, dep, flink_version, True,
+                                         self.maven.get_version_index(metadata),
+                                         include_prereleases, targets, ranges_cache, last_updated)
+                # Artifacts whose metadata could not be read are looked at again next time
+                if metadata is not None:
+                    state.stats['evaluated'] += 1
+                    state.set(cat, dep_name, inputs, etag, last_updated, entry)
+                yield entry
+            state.finish(self.dependencies)
+            self.logger.debug(f"Scan state: {state.stats['resumed']} resumed, {state.stats['unchanged']} unchanged, "
+                              f"{state.stats['evaluated']} evaluated")
+        finally:
+            # Also runs when the scan is interrupted, so the next one can resume it
+            state.save()
+    
+    def _fetch_if_changed(self, dep: Dependency, record: Optional[Dict[str, Any]]
+                          ) -> Optional[Tuple[bool, Optional[MavenMetadata], Optional[str], Optional[str]]]:
+        """Fetch an artifact's metadata, parsing it only when it differs from the state record.
+        
+        Returns (changed, metadata, etag, lastUpdated), or None when the metadata is unavailable.
+        """
+        document = self.maven.fetch_metadata(dep.group_id, dep.artifact_id, dep.repository,
+                                             etag=record.get('etag') if record is not None else None)
+        if document is None:
+            return None
+        content, etag = document
+        if content is None:
+            # 304 to the ETag the record was evaluated from
+            return False, None, etag, None
+        last_updated = MavenMetadata.read_last_updated(content)
+        if record is not None and ScanState.unchanged(record, etag, last_updated):
+            return False, None, etag, last_updated
+        return True, self.maven.parse_metadata(content, dep.group_id, dep.artifact_id), etag, last_updated
+    
+    def _families_in_scope(self, category: Optional[str], exclude: List[str], only: Optional[set],
+                           include_prereleases: bool
+                           ) -> List[Tuple[DependencyFamily, List[Tuple[str, str, Dependency]]]]:
+        """Families with a member in scope, BOM families narrowed to the members their BOM manages.
+        
+        Candidates a BOM does not manage are left out, so they are scanned on their own.
+        """
+        families = []
+        for family, members in self.family_members():
+            if not any((category is None or cat == category) and dep_name not in exclude
+                       and (only is None or (cat, dep_name) in only) for cat, dep_name, _ in members):
+                continue
+            if family.bom:
+                with self.timings.span('families'):
+                    members, _ = self.solver.bom_members(family, members, include_prereleases)
+            if members:
+                families.append((family, members))
+        return families
+    
+    def _scan_families(self, families: List[Tuple[DependencyFamily, List[Tuple[str, str, Dependency]]]],
+                       wanted: set, flink_version: str, include_prereleases: bool,
+                       targets: Optional[List[CompatibilityTarget]], catalog: Optional['ArtifactCatalog'],
+                       ranges_cache: Dict[str, Tuple[List[VersionRange], VersionRange]]) -> Iterator[ScanEntry]:
+        """Evaluate the wanted family members, each moving only to the version set its whole family agrees on"""
+        for family, members in families:
+            if not any((cat, dep_name) in wanted for cat, dep_name, _ in members):
+                continue
+            indexes = None
+            if not family.bom:
+                with self.timings.span('families'):
+                    if catalog is not None:
+                        indexes = [catalog.index_for(dep) for _, _, dep in members]
+                    else:
+                        fetched = dict(self.maven.iter_metadata(((cat, dep_name), dep.group_id, dep.artifact_id,
+                                                                 dep.repository) for cat, dep_name, dep in members))
+                        indexes = [self.maven.get_version_index(fetched[(cat, dep_name)])
+                                   for cat, dep_name, _ in members]
+            
+            types = [dep.get_dependency_type(self.rules) for _, _, dep in members]
+            
+            def solve(range_of) -> Optional[Tuple[str, List[str]]]:
+                with self.timings.span('families'):
+                    return self.solver.solve(family, members, [range_of(dep_type) for dep_type in types],
+                                             include_prereleases, indexes)
+            
+            solution = solve(lambda dep_type: self.compatibility.compiled_range(flink_version, dep_type))
+            if solution is None:
+                self.logger.warning(f"No version set of the {family.name} family is compatible with "
+                                    f"Flink {flink_version}")
+            per_target = {}
+            combined = None
+            if targets:
+                for target in targets:
+                    per_target[target.name] = solve(lambda dep_type: self.compatibility.target_range(target,
+                                                                                                     dep_type))
+                combined = solve(lambda dep_type: CompatibilityMatrix.intersect(
+                    [self.compatibility.target_range(target, dep_type) for target in targets]))
+            
+            for i, (cat, dep_name, dep) in enumerate(members):
+                if (cat, dep_name) not in wanted:
+                    continue
+                entry = self._scan_entry(cat, dep_name, dep, flink_version, True, None,
+                                         include_prereleases, targets, ranges_cache)
+                entry.family = family.name
+                if solution is not None and solution[1][i] is not None:
+                    latest = solution[1][i]
+                    entry.family_version = solution[0]
+                    entry.latest_version = latest
+                    entry.latest_compatible = self.compatibility.is_compatible(flink_version, entry.dep_type, latest)
+                    entry.update_available = maven_version(latest) > maven_version(entry.current_version)
+                if targets:
+                    for target in targets:
+                        found = per_target[target.name]
+                        entry.targets[target.name]['latest'] = found[1][i] if found is not None else None
+                    entry.latest_all_targets = combined[1][i] if combined is not None else None
+                    # Updates across targets apply the combined set
+                    entry.family_version = combined[0] if entry.latest_all_targets is not None else None
+                yield entry
+    
+    def _scan_entry(self, cat: str, dep_name: str, dep: Dependency, flink_version: str, resolved: bool,
+                    index: Optional[VersionIndex], include_prereleases: bool,
+                    targets: Optional[List[CompatibilityTarget]],
+                    ranges_cache: Dict[str, Tuple[List[VersionRange], VersionRange]],
+                    last_updated: str = None) -> ScanEntry:
+        """Classify one dependency and evaluate it against the Flink version and any targets"""
+        with self.timings.span('classify'):
+            dep_type = dep.get_dependency_type(self.rules)
+        
+        with self.timings.span('compatibility'):
+            entry = ScanEntry(
+                category=cat,
+                name=dep_name,
+                group_id=dep.group_id,
+                artifact_id=dep.artifact_id,
+                repository=dep.repository,
+                current_version=dep.version,
+                dep_type=dep_type,
+                current_compatible=(dep_type != 'unknown' and
+                                    self.compatibility.is_compatible(flink_version, dep_type, dep.version)),
+                expected_range=self.compatibility.get_compatible_range(flink_version, dep_type),
+                resolved=resolved,
+                last_updated=last_updated
+            )
+            if index is not None:
+                self._evaluate_candidates(entry, index, flink_version, include_prereleases)
+            if targets:
+                self._evaluate_targets([entry], {(cat, dep_name): index}, targets, include_prereleases, ranges_cache)
+        return entry
+    
+    def _evaluate_targets(self, entries: List[ScanEntry], indexes: Dict[Tuple[str, str], Optional[VersionIndex]],
+                          targets: List[CompatibilityTarget], include_prereleases: bool,
+                          ranges_cache: Dict[str, Tuple[List[VersionRange], VersionRange]] = None):
+        """Evaluate every entry against every target using the metadata already resolved.
+        
+        Ranges are compiled once per (target, type) and their intersection once
+        per type, so each entry costs one version parse plus one bisection per
+        target regardless of how many targets share a type. Pass the same
+        ranges_cache to share that work across calls.
+        """
+        if ranges_cache is None:
+            ranges_cache = {}
+        for entry in entries:
+            cached = ranges_cache.get(entry.dep_type)
+            if cached is None:
+                ranges = [self.compatibility.target_range(target, entry.dep_type) for target in targets]
+                cached = ranges_cache[entry.dep_type] = (ranges, CompatibilityMatrix.intersect(ranges))
+            ranges, combined = cached
+            
+            current = self.compatibility.parse_version(entry.current_version)
+            index = indexes.get((entry.category, entry.name))
+            
+            entry.targets = {
+                target.name: {
+                    'current': version_range.contains(current),
+                    'latest': index.latest_in(version_range, include_prereleases) if index else None
+                }
+                for target, version_range in zip(targets, ranges)
+            }
+            entry.latest_all_targets = index.latest_in(combined, include_prereleases) if index else None
+    
+    def print_target_matrix(self, scan: ScanResult, category: str = None, show_latest: bool = True):
+        """Print the dependency × target compatibility matrix"""
+        targets = scan.targets
+        self.logger.info("Targets:")
+        for target in targets:
+            if target.kind == 'flink':
+                print(f"  {target.name}: Flink {target.version}")
+            else:
+                print(f"  {target.name}: Kafka broker {target.version} ({target.source})")
+        if any(target.source == 'default' for target in targets):
+            self.logger.warning("The manifests do not record broker versions; environments without "
+                                "--broker-version or a rules file entry use the default")
+        print()
+        
+        entries = [entry for entry in scan.entries if category is None or entry.category == category]
+        name_width = max([len('Dependency')] + [len(entry.name) for entry in entries])
+        version_width = max([len('Current')] + [len(entry.current_version) for entry in entries])
+        cell_width = max([len(target.name) for target in targets] +
+                         [len(info['latest'] or '-') + 2 for entry in entries for info in entry.targets.values()]
+                         if show_latest else [len(target.name) for target in targets])
+        
+        header = f"  {'Dependency'.ljust(name_width)}  {'Current'.ljust(version_width)}"
+        header += ''.join(f"  {target.name.ljust(cell_width)}" for target in targets)
+        if show_latest:
+            header += "  All targets"
+        print(header)
+        
+        for entry in entries:
+            row = f"  {entry.name.ljust(name_width)}  {entry.current_version.ljust(version_width)}"
+            for target in targets:
+                info = entry.targets.get(target.name, {})
+                mark = '✓' if info.get('current') else '✗'
+                cell = f"{mark} {info.get('latest') or '-'}" if show_latest else mark
+                color = Colors.GREEN if info.get('current') else Colors.RED
+                row += f"  {color}{cell.ljust(cell_width)}{Colors.NC}"
+            if show_latest:
+                row += f"  {entry.latest_all_targets or '-'}"
+            print(row)
+        print()
+    
+    def _evaluate_candidates(self, entry: ScanEntry, index: VersionIndex, flink_version: str,
+                             include_prereleases: bool):
+        """Fill in the latest compatible version and update verdict of a scan entry"""
+        # Find the latest compatible version instead of just the absolute latest, with one
+        # binary search on the compiled rule bounds instead of testing every version
+        latest_version = self.compatibility.latest_compatible(index, flink_version, entry.dep_type,
+                                                              include_prereleases)
+        if latest_version is None:
+            return
+        
+        entry.latest_version = latest_version
+        # Should be True since we filtered for compatible versions
+        entry.latest_compatible = self.compatibility.is_compatible(flink_version, entry.dep_type, latest_version)
+        entry.update_available = maven_version(latest_version) > maven_version(entry.current_version)
+    
     def check_updates(self, category: str = None, include_prereleases: bool = False, 
-                     exclude: List[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+                     exclude: List[str] = None,
+                     targets: List[CompatibilityTarget] = None) -> Dict[str, List[Dict[str, Any]]]:
         """Check for available updates"""
         exclude = exclude or []
-        categories_to_check = [category] if category else self.dependencies.keys()
+        scan = self.get_scan(category, include_prereleases, exclude, targets=targets)
+        if targets:
+            results = self._check_target_updates(scan, category, exclude)
+            self._report_families(scan, category, exclude, targets)
+            return results
+        categories_to_check = [category] if category else scan.categories()
         results = {}
         
-        flink_version = self.metadata.get('flink_version', '2.0.0')
-        
         for cat in categories_to_check:
-            if cat not in self.dependencies:
+            if cat not in scan.categories():
                 continue
                 
             self.logger.info(f"Checking updates for category: {cat}")
             results[cat] = []
             
-            for dep_name, dep in self.dependencies[cat].items():
-                if dep_name in exclude:
-                    self.logger.debug(f"Skipping excluded dependency: {dep_name}")
+            for entry in scan.entries_in(cat):
+                if entry.name in exclude:
+                    self.logger.debug(f"Skipping excluded dependency: {entry.name}")
                     continue
                 
-                self.logger.debug(f"Checking dependency: {dep_name}")
+                self.logger.debug(f"Checking dependency: {entry.name}")
                 
-                # Get latest version
-                metadata = self.maven.get_metadata(dep.group_id, dep.artifact_id, dep.repository)
-                if metadata is None:
+                if not entry.update_available:
                     continue
                 
-                # Get dependency type first to check compatibility constraints
-                dep_type = dep.get_dependency_type()
-                
-                # Find the latest compatible version instead of just the absolute latest
-                latest_version = self._get_latest_compatible_version(metadata, flink_version, dep_type, dep_name, include_prereleases)
-                if latest_version is None:
-                    continue
+                results[cat].append(entry.to_update_info())
                 
-                # Compare versions
-                try:
-                    current_pkg_version = pkg_version.parse(dep.version)
-                    latest_pkg_version = pkg_version.parse(latest_version)
-                    
-                    if latest_pkg_version > current_pkg_version:
-                        # Check compatibility (should be True since we filtered for compatible versions)
-                        is_compatible = self.compatibility.is_compatible(flink_version, dep_type, latest_version, dep_name)
-                        
-                        update_info = {
-                            'name': dep_name,
-                            'current_version': dep.version,
-                            'latest_version': latest_version,
-                            'compatible': is_compatible,
-                            'type': dep_type
-                        }
-                        results[cat].append(update_info)
-                        
-                        if is_compatible:
-                            self.logger.success(f"  {dep_name}: {dep.version} → {latest_version} (compatible)")
-                        else:
-                            self.logger.warning(f"  {dep_name}: {dep.version} → {latest_version} (⚠️  compatibility warning)")
-                    
-                except Exception as e:
-                    self.logger.debug(f"Version comparison failed for {dep_name}: {e}")
-                    continue
-        
-        return results
-    
-    def _get_latest_compatible_version(self, metadata: ET.Element, flink_version: str, 
-                                     dep_type: str, dep_name: str, include_prereleases: bool = False) -> Optional[str]:
-        """Get the latest version that's compatible with the given Flink version"""
-        if metadata is None:
-            return None
-            
-        # Get all available versions
-        versions = []
-        versioning = metadata.find('versioning')
-        if versioning is not None:
-            versions_elem = versioning.find('versions')
-            if versions_elem is not None:
-                for version_elem in versions_elem.findall('version'):
-                    if version_elem.text:
-                        versions.append(version_elem.text)
-        
-        if not versions:
-            return None
-            
-        # Filter out snapshots and pre-releases if not wanted
-        filtered_versions = []
-        for v in versions:
-            if 'SNAPSHOT' in v.upper():
-                continue
-            if not include_prereleases:
-                if any(pre in v.upper() for pre in ['ALPHA', 'BETA', 'RC', 'M']):
-                    continue
-            filtered_versions.append(v)
-        
-        if not filtered_versions:
-            return None
-            
-        # Sort versions in descending order (latest first)
-        try:
-            sorted_versions = sorted(filtered_versions, key=pkg_version.parse, reverse=True)
-        except Exception:
-            # Fallback to simple string sorting
-            sorted_versions = sorted(filtered_versions, reverse=True)
+                if entry.latest_compatible:
+                    self.logger.success(f"  {entry.name}: {entry.current_version} → {entry.latest_version} (compatible)")
+                else:
+                    self.logger.warning(f"  {entry.name}: {entry.current_version} → {entry.latest_version} (⚠️  compatibility warning)")
         
-        # Find the latest version that's compatible
-        for version in sorted_versions:
-            if self.compatibility.is_compatible(flink_version, dep_type, version, dep_name):
-                return version
+        self._report_families(scan, category, exclude)
+        return results
+    
+    def _report_families(self, scan: ScanResult, category: str = None, exclude: List[str] = None,
+                         targets: List[CompatibilityTarget] = None):
+        """Print the version each family aligns to and warn about members an update leaves out of line"""
+        exclude = exclude or []
+        families: Dict[str, List[ScanEntry]] = {}
+        for entry in scan.entries:
+            if entry.family and (category is None or entry.category == category):
+                families.setdefault(entry.family, []).append(entry)
+        if not families:
+            return
         
-        # If no compatible version found, return None
-        return None
+        members_of = {family.name: members for family, members in self.family_members()}
+        self.logger.info("Families:")
+        for name, entries in families.items():
+            aligned = next((entry.family_version for entry in entries if entry.family_version), None)
+            print(f"  {name}: {aligned or 'no compatible version set'} "
+                  f"({', '.join(entry.name for entry in entries)})")
+            unaligned = [entry.name for entry in entries if entry.family_version is None]
+            if aligned and unaligned:
+                self.logger.warning(f"  {', '.join(unaligned)} not managed by {aligned}; "
+                                    f"left at their current versions")
+            moving = False
+            for entry in entries:
+                latest = entry.latest_all_targets if targets else entry.latest_version
+                if latest is None or latest == entry.current_version:
+                    continue
+                if maven_version(latest) < maven_version(entry.current_version):
+                    self.logger.warning(f"  {entry.name} {entry.current_version} is ahead of the {name} family's "
+                                        f"{latest}; updates never downgrade it")
+                else:
+                    moving = True
+            left_out = [dep_name for _, dep_name, _ in members_of.get(name, []) if dep_name in exclude]
+            if moving and left_out:
+                self.logger.warning(f"  Excluded {', '.join(left_out)} will not move with the {name} family")
+    
+    def _check_target_updates(self, scan: ScanResult, category: str = None,
+                              exclude: List[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Report the matrix and the updates that satisfy every target at once"""
+        self.print_target_matrix(scan, category)
+        results = {}
+        for cat in ([category] if category else scan.categories()):
+            results[cat] = []
+            for entry in scan.entries_in(cat):
+                if entry.name in exclude or not entry.latest_all_targets:
+                    continue
+                if maven_version(entry.latest_all_targets) <= maven_version(entry.current_version):
+                    continue
+                update_info = entry.to_update_info()
+                update_info.update({'latest_version': entry.latest_all_targets, 'compatible': True})
+                results[cat].append(update_info)
+                self.logger.success(f"  {entry.name}: {entry.current_version} → {entry.latest_all_targets} "
+                                    f"(all {len(scan.targets)} targets)")
+        
+        blocked = [entry.name for entry in scan.entries
+                   if (category is None or entry.category == category) and entry.name not in exclude
+                   and entry.resolved and entry.latest_all_targets is None]
+        if blocked:
+            self.logger.warning(f"No version satisfies every target for: {', '.join(blocked)}")
+        return results
     
     def update_dependencies(self, category: str = None, include_prereleases: bool = False,
-                          exclude: List[str] = None, force: bool = False, dry_run: bool = False) -> int:
+                          exclude: List[str] = None, force: bool = False, dry_run: bool = False,
+                          targets: List[CompatibilityTarget] = None) -> int:
         """Update dependencies"""
         exclude = exclude or []
         
+        if (not dry_run and self._scan_from_file
+                and self.scan_result.versions_digest != self.versions_digest):
+            raise ValueError("Refusing to apply updates from a scan of a different versions file revision; "
+                             "re-run the scan or use --dry-run")
+        
         if dry_run:
             self.logger.info("DRY RUN MODE - No changes will be made")
         
-        # Create backup unless dry run
+        # Snapshot the current file unless dry run (free if the history already has it)
         if not dry_run:
             self.create_backup()
         
-        updates = self.check_updates(category, include_prereleases, exclude)
+        updates = self.check_updates(category, include_prereleases, exclude, targets)
         total_updates = 0
         
         for cat, category_updates in updates.items():
@@ -734,9 +5785,13 @@ class DependencyManager:
         
         return total_updates
     
-    def validate_dependencies(self) -> Tuple[int, int]:
+    def validate_dependencies(self, targets: List[CompatibilityTarget] = None) -> Tuple[int, int]:
         """Validate current dependencies for compatibility"""
-        flink_version = self.metadata.get('flink_version', '2.0.0')
+        # Validation only needs classification and verdicts, never metadata
+        scan = self.get_scan(resolve=False, targets=targets)
+        if targets:
+            return self._validate_targets(scan)
+        flink_version = scan.flink_version
         self.logger.info(f"Validating dependencies for Flink {flink_version} compatibility")
         
         total_deps = 0
@@ -747,40 +5802,38 @@ class DependencyManager:
         compatibility_issues = []
         unknown_types = []
         
-        for category, deps in self.dependencies.items():
-            for dep_name, dep in deps.items():
-                total_deps += 1
-                dep_type = dep.get_dependency_type()
+        for entry in scan.entries:
+            category, dep_name = entry.category, entry.name
+            total_deps += 1
                 
-                if dep_type == 'unknown':
-                    unknown_deps += 1
-                    unknown_types.append({
-                        'category': category,
-                        'name': dep_name,
-                        'groupId': dep.group_id,
-                        'artifactId': dep.artifact_id,
-                        'version': dep.version
-                    })
-                    self.logger.warning(f"{category}/{dep_name} has unknown type (groupId: {dep.group_id}, artifactId: {dep.artifact_id})")
-                    continue
+            if entry.dep_type == 'unknown':
+                unknown_deps += 1
+                unknown_types.append({
+                    'category': category,
+                    'name': dep_name,
+                    'groupId': entry.group_id,
+                    'artifactId': entry.artifact_id,
+                    'version': entry.current_version
+                })
+                self.logger.warning(f"{category}/{dep_name} has unknown type (groupId: {entry.group_id}, artifactId: {entry.artifact_id})")
+                continue
                 
-                if self.compatibility.is_compatible(flink_version, dep_type, dep.version, dep_name):
-                    compatible_deps += 1
-                    self.logger.debug(f"{category}/{dep_name} ({dep.version}) is compatible")
-                else:
-                    compatibility_issues.append({
-                        'category': category,
-                        'name': dep_name,
-                        'type': dep_type,
-                        'version': dep.version,
-                        'expected_range': self.compatibility.get_compatible_range(flink_version, dep_type)
-                    })
-                    self.logger.warning(f"{category}/{dep_name} ({dep.version}) may not be compatible with Flink {flink_version}")
+            if entry.current_compatible:
+                compatible_deps += 1
+                self.logger.debug(f"{category}/{dep_name} ({entry.current_version}) is compatible")
+            else:
+                compatibility_issues.append({
+                    'category': category,
+                    'name': dep_name,
+                    'type': entry.dep_type,
+                    'version': entry.current_version,
+                    'expected_range': entry.expected_range
+                })
+                self.logger.warning(f"{category}/{dep_name} ({entry.current_version}) may not be compatible with Flink {flink_version}")
                     
-                    # Show expected range if available
-                    compat_range = self.compatibility.get_compatible_range(flink_version, dep_type)
-                    if compat_range:
-                        self.logger.info(f"  Expected range: {compat_range[0]} - {compat_range[1]}")
+                # Show expected range if available
+                if entry.expected_range:
+                    self.logger.info(f"  Expected range: {entry.expected_range[0]} - {entry.expected_range[1]}")
         
         # Detailed reporting
         incompatible_deps = total_deps - compatible_deps - unknown_deps
@@ -800,10 +5853,120 @@ class DependencyManager:
         
         return compatible_deps, incompatible_deps + unknown_deps
     
+    def _validate_targets(self, scan: ScanResult) -> Tuple[int, int]:
+        """Validate current versions against every target and print the matrix"""
+        self.print_target_matrix(scan, show_latest=False)
+        compatible = 0
+        self.logger.info("Validation Summary:")
+        for target in scan.targets:
+            passing = sum(1 for entry in scan.entries if entry.targets.get(target.name, {}).get('current'))
+            print(f"  {target.name}: {passing}/{len(scan.entries)} compatible")
+        for entry in scan.entries:
+            if all(info.get('current') for info in entry.targets.values()):
+                compatible += 1
+        self.logger.success(f"  Compatible with all targets: {compatible}/{len(scan.entries)}")
+        return compatible, len(scan.entries) - compatible
+    
+    def stream_results(self, command: str, category: str = None, include_prereleases: bool = False,
+                       exclude: List[str] = None, targets: List[CompatibilityTarget] = None,
+                       keep: bool = False) -> Iterator[Dict[str, Any]]:
+        """Yield one result record per dependency as soon as it is evaluated, then a summary record.
+        
+        command is 'check' (resolves metadata) or 'validate' (current versions
+        only). With keep, the entries are also collected into scan_result so
+        --save-scan works; otherwise nothing is retained between records.
+        """
+        exclude = exclude or []
+        started = time.perf_counter()
+        resolve = command == 'check'
+        if self._scan_from_file:
+            entries = iter(self.get_scan(category, include_prereleases, exclude, resolve, targets).entries)
+            keep = False
+        else:
+            entries = self.iter_scan(category, include_prereleases, exclude, resolve, targets)
+        
+        kept = [] if keep else None
+        counts: Dict[str, int] = {}
+        for entry in entries:
+            if kept is not None:
+                kept.append(entry)
+            if (category is not None and entry.category != category) or entry.name in exclude:
+                continue
+            status = self._result_status(command, entry, targets)
+            counts[status] = counts.get(status, 0) + 1
+            record = {'event': 'dependency', 'status': status}
+            record.update(entry.to_dict())
+            yield record
+        
+        if kept is not None:
+            order = {key: i for i, key in enumerate((cat, dep_name) for cat, deps in self.dependencies.items()
+                                                    for dep_name in deps)}
+            kept.sort(key=lambda entry: order[(entry.category, entry.name)])
+            self.scan_result = ScanResult(self.metadata.get('flink_version', '2.0.0'), str(self.versions_file),
+                                          self.versions_digest, include_prereleases, kept, targets=targets)
+        yield {
+            'event': 'summary',
+            'command': command,
+            'flink_version': self.metadata.get('flink_version', '2.0.0'),
+            'targets': [target.name for target in targets] if targets else None,
+            'dependencies': sum(counts.values()),
+            'statuses': dict(sorted(counts.items())),
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+    
+    @staticmethod
+    def _result_status(command: str, entry: ScanEntry, targets: List[CompatibilityTarget] = None) -> str:
+        """One-word verdict of a streamed result record"""
+        if command == 'validate':
+            if targets:
+                return 'compatible' if all(info.get('current') for info in entry.targets.values()) else 'incompatible'
+            if entry.dep_type == 'unknown':
+                return 'unknown-type'
+            return 'compatible' if entry.current_compatible else 'incompatible'
+        
+        if not entry.resolved:
+            return 'not-checked'
+        latest = entry.latest_all_targets if targets else entry.latest_version
+        if latest is None:
+            # No metadata, or no published version satisfies the rules
+            return 'unresolved'
+        if maven_version(latest) > maven_version(entry.current_version):
+            return 'update-available'
+        return 'up-to-date'
+    
+    @staticmethod
+    def write_results(records: Iterator[Dict[str, Any]], output_format: str, out=None) -> Dict[str, Any]:
+        """Write streamed records as NDJSON (one line each) or as one JSON document; returns the summary.
+        
+        Both formats are written incrementally and flushed per record, so a
+        consumer sees the first result while the rest are still resolving.
+        """
+        out = out or sys.stdout
+        summary = {}
+        first = True
+        if output_format == 'json':
+            out.write('{"dependencies": [')
+        for record in records:
+            if record['event'] == 'summary':
+                summary = record
+                continue
+            if output_format == 'ndjson':
+                out.write(json.dumps(record) + '\n')
+            else:
+                del record['event']
+                out.write(('\n  ' if first else ',\n  ') + json.dumps(record))
+                first = False
+            out.flush()
+        if output_format == 'ndjson':
+            out.write(json.dumps(summary) + '\n')
+        else:
+            summary = {key: value for key, value in summary.items() if key != 'event'}
+            out.write(('' if first else '\n') + '],\n"summary": ' + json.dumps(summary) + '}\n')
+        out.flush()
+        return summary
+    
     def generate_report(self, output_file: str = None) -> str:
         """Generate a comprehensive compatibility report"""
-        flink_version = self.metadata.get('flink_version', '2.0.0')
-        
         if output_file is None:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             output_file = f"dependency-report-{timestamp}.md"
@@ -811,6 +5974,8 @@ class DependencyManager:
         # Gather data
         updates = self.check_updates()
         compatible_deps, incompatible_deps = self.validate_dependencies()
+        scan = self.get_scan()
+        flink_version = scan.flink_version
         
         # Generate report
         report_lines = [
@@ -822,7 +5987,7 @@ class DependencyManager:
             "",
             "## Summary",
             "",
-            f"- Total dependencies: {sum(len(deps) for deps in self.dependencies.values())}",
+            f"- Total dependencies: {len(scan.entries)}",
             f"- Compatible: {compatible_deps}",
             f"- Potential issues: {incompatible_deps}",
             f"- Available updates: {sum(len(cat_updates) for cat_updates in updates.values())}",
@@ -831,7 +5996,7 @@ class DependencyManager:
             ""
         ]
         
-        for category, deps in self.dependencies.items():
+        for category in scan.categories():
             report_lines.extend([
                 f"### {category}",
                 "",
@@ -842,9 +6007,9 @@ class DependencyManager:
             category_updates = updates.get(category, [])
             update_dict = {u['name']: u for u in category_updates}
             
-            for dep_name, dep in deps.items():
-                dep_type = dep.get_dependency_type()
-                is_current_compatible = self.compatibility.is_compatible(flink_version, dep_type, dep.version, dep_name)
+            for entry in scan.entries_in(category):
+                dep_name = entry.name
+                is_current_compatible = entry.current_compatible
                 
                 if dep_name in update_dict:
                     update_info = update_dict[dep_name]
@@ -854,14 +6019,14 @@ class DependencyManager:
                     status = "📈 Update Available"
                     compatible_status = "✅" if is_latest_compatible else "⚠️"
                 else:
-                    latest_version = dep.version
+                    latest_version = entry.current_version
                     status = "✅ Up to date"
                     compatible_status = "✅" if is_current_compatible else "⚠️"
                 
                 current_compatible = "✅" if is_current_compatible else "⚠️"
                 
                 report_lines.append(
-                    f"| {dep_name} | {dep.version} | {latest_version} | {status} | {current_compatible} → {compatible_status} |"
+                    f"| {dep_name} | {entry.current_version} | {latest_version} | {status} | {current_compatible} → {compatible_status} |"
                 )
             
             report_lines.append("")
@@ -891,25 +6056,1163 @@ class DependencyManager:
     
     def get_status(self) -> Dict[str, Any]:
         """Get current status summary"""
-        flink_version = self.metadata.get('flink_version', '2.0.0')
         last_updated = self.metadata.get('last_updated', 'unknown')
         
-        total_deps = sum(len(deps) for deps in self.dependencies.values())
         updates = self.check_updates()
         available_updates = sum(len(cat_updates) for cat_updates in updates.values())
         compatible_deps, incompatible_deps = self.validate_dependencies()
+        scan = self.get_scan()
         
         return {
-            'flink_version': flink_version,
+            'flink_version': scan.flink_version,
             'last_updated': last_updated,
-            'total_dependencies': total_deps,
-            'categories': len(self.dependencies),
+            'total_dependencies': len(scan.entries),
+            'categories': len(scan.categories()),
             'available_updates': available_updates,
             'compatible_dependencies': compatible_deps,
             'incompatible_dependencies': incompatible_deps,
             'versions_file': str(self.versions_file)
         }
 
+    def resolve_transitive(self, category: str = None, max_depth: int = None, include_optional: bool = False,
+                           ignore: List[str] = None, output_file: str = None) -> Tuple[int, int]:
+        """Compare the transitive runtime graph with the declared set; returns (missing, conflicts)"""
+        if category and category not in self.dependencies:
+            raise ValueError(f"Unknown category: {category}")
+        ignore = list(PomResolver.PROVIDED_BY_FLINK) + (ignore or [])
+        
+        selected = [(cat, name, dep)
+                    for cat, deps in self.dependencies.items() if not category or cat == category
+                    for name, dep in deps.items()]
+        # Everything declared counts as present, even outside the selected category
+        declared = {f"{dep.group_id}:{dep.artifact_id}": (f"{cat}.{name}", dep)
+                    for cat, deps in self.dependencies.items() for name, dep in deps.items()}
+        repositories = list(dict.fromkeys(dep.repository for _, _, dep in selected))
+        
+        self.logger.info(f"Resolving transitive dependencies of {len(selected)} declared artifacts...")
+        started = time.monotonic()
+        resolver = PomResolver(self.maven, self.logger, repositories)
+        with self.timings.span('resolve'):
+            result = resolver.resolve(selected, max_depth=max_depth, include_optional=include_optional)
+        elapsed = time.monotonic() - started
+        
+        def ignored(key: str) -> bool:
+            return any(fnmatch.fnmatchcase(key, pattern) for pattern in ignore)
+        
+        def describe(path: List[str]) -> str:
+            return ' -> '.join(part.split(':')[1] for part in path)
+        
+        missing = [node for key, node in result['nodes'].items()
+                   if node['depth'] > 0 and key not in declared and not ignored(key)]
+        missing.sort(key=lambda node: (node['depth'], node['group_id'], node['artifact_id']))
+        
+        conflicts = []
+        for key, (dep_name, dep) in declared.items():
+            node = result['nodes'].get(key)
+            # A transitive request for a declared artifact that lost mediation
+            requests_for_key = [r for r in result['conflicts'].get(key, []) if r['version'] != dep.version]
+            if node is not None and node['depth'] > 0:
+                requests_for_key.insert(0, {'version': node['version'], 'path': node['path']})
+            for request in requests_for_key:
+                newer = maven_version(request['version']) > maven_version(dep.version)
+                conflicts.append({'dependency': dep_name, 'declared': dep.version, 'requested': request['version'],
+                                  'newer': newer, 'path': request['path']})
+        
+        print()
+        if missing:
+            self.logger.warning(f"Missing transitive runtime dependencies ({len(missing)}):")
+            for node in missing:
+                print(f"  {node['group_id']}:{node['artifact_id']}:{node['version']} ({node['scope']}, via {describe(node['path'][:-1])})")
+        else:
+            self.logger.success("All transitive runtime dependencies are declared")
+        
+        print()
+        if conflicts:
+            self.logger.warning(f"Declared versions differing from transitive requests ({len(conflicts)}):")
+            for conflict in conflicts:
+                marker = f"{Colors.YELLOW}newer{Colors.NC}" if conflict['newer'] else "older"
+                print(f"  {conflict['dependency']}: declared {conflict['declared']}, {marker} {conflict['requested']} "
+                      f"requested via {describe(conflict['path'][:-1])}")
+        else:
+            self.logger.success("No version conflicts with declared dependencies")
+        
+        if result['unresolved']:
+            print()
+            self.logger.warning(f"POMs that could not be resolved ({len(result['unresolved'])}):")
+            for coordinate in result['unresolved']:
+                print(f"  {coordinate}")
+        
+        print()
+        self.logger.info(f"Walked {len(result['nodes'])} artifacts ({result['poms']} POMs incl. parents and BOMs) "
+                         f"in {elapsed:.1f}s")
+        
+        if output_file:
+            with open(output_file, 'w') as f:
+                json.dump({
+                    'missing': [{'coordinate': f"{n['group_id']}:{n['artifact_id']}:{n['version']}",
+                                 'scope': n['scope'], 'depth': n['depth'], 'path': n['path']} for n in missing],
+                    'conflicts': conflicts,
+                    'unresolved': result['unresolved']
+                }, f, indent=2)
+            self.logger.success(f"Resolution report written to: {output_file}")
+        
+        return len(missing), len(conflicts)
+    
+    def scan_classpath(self, base_dirs: List[str] = None, jar_dir: str = None, store: ArtifactStore = None,
+                       cache_dir: str = None, workers: int = None, output_file: str = None) -> Dict[str, Any]:
+        """Index the declared JARs plus base image JARs and report classpath clashes"""
+        with tempfile.TemporaryDirectory(prefix='flink-deps-classpath-') as tmp_dir:
+            jars = [(dep.jar_filename(), path) for _, _, dep, path in self._declared_jars(jar_dir, store, Path(tmp_dir))]
+            
+            for base_dir in base_dirs or []:
+                base_jars = sorted(Path(base_dir).glob('*.jar'))
+                if not base_jars:
+                    self.logger.warning(f"No JARs found in {base_dir}")
+                for path in base_jars:
+                    jars.append((f"base/{path.name}", path))
+            
+            self.logger.info(f"Indexing {len(jars)} JARs...")
+            started = time.monotonic()
+            scanner = ClasspathScanner(self.logger, cache_dir=cache_dir, workers=workers)
+            indexes = scanner.index(jars)
+            report = ClasspathScanner.analyze(indexes)
+            elapsed = time.monotonic() - started
+        
+        print()
+        self.logger.info(f"Scanned {report['jars']} JARs with {report['classes']} classes in {elapsed:.2f}s "
+                         f"({scanner.stats['indexed']} indexed, {scanner.stats['cached']} from cache)")
+        
+        print()
+        if report['duplicates']:
+            total = sum(group['classes'] for group in report['duplicates'])
+            self.logger.warning(f"Duplicate classes: {total} in {len(report['duplicates'])} JAR combinations")
+            for group in report['duplicates']:
+                color = Colors.RED if group['differing'] else Colors.YELLOW
+                print(f"  {color}{', '.join(group['jars'])}{Colors.NC}: {group['classes']} classes, "
+                      f"{group['differing']} with different bytecode (e.g. {', '.join(group['examples'])})")
+        else:
+            self.logger.success("No duplicate classes")
+        
+        print()
+        if report['split_packages']:
+            self.logger.warning(f"Split packages: {len(report['split_packages'])}")
+            shown = report['split_packages'] if self.logger.verbose else report['split_packages'][:20]
+            for split in shown:
+                print(f"  {split['package']}: {', '.join(split['jars'])}")
+            if len(shown) < len(report['split_packages']):
+                print(f"  ... {len(report['split_packages']) - len(shown)} more (use --verbose)")
+        else:
+            self.logger.success("No split packages")
+        
+        print()
+        if report['service_conflicts']:
+            self.logger.warning(f"Conflicting META-INF/services files: {len(report['service_conflicts'])}")
+            for conflict in report['service_conflicts']:
+                print(f"  {conflict['service']}: provided by {', '.join(sorted(conflict['providers']))}")
+                if conflict['missing_providers']:
+                    print(f"    {Colors.RED}providers without a class:{Colors.NC} {', '.join(conflict['missing_providers'])}")
+        else:
+            self.logger.success("No conflicting service files")
+        
+        if output_file:
+            with open(output_file, 'w') as f:
+                json.dump(report, f, indent=2)
+            self.logger.success(f"Classpath report written to: {output_file}")
+        
+        return report
+    
+    def _declared_jars(self, jar_dir: Optional[str], store: Optional[ArtifactStore],
+                       tmp_dir: Path) -> List[Tuple[str, str, Dependency, Path]]:
+        """Declared JARs from jar_dir, or from the artifact store into tmp_dir, downloading only what it lacks"""
+        declared = [(cat, name, dep) for cat, deps in self.dependencies.items() for name, dep in deps.items()]
+        jars = []
+        if jar_dir:
+            for cat, name, dep in declared:
+                path = Path(jar_dir) / dep.jar_filename()
+                if path.exists():
+                    jars.append((cat, name, dep, path))
+                else:
+                    self.logger.warning(f"Declared JAR not found in {jar_dir}: {dep.jar_filename()}")
+            return jars
+        
+        fetcher = ArtifactFetcher(self.maven, self.logger, store=store)
+        with self.timings.span('fetch'):
+            summary = fetcher.fetch(declared, tmp_dir)
+        dependencies = {(cat, name): dep for cat, name, dep in declared}
+        for result in summary['results']:
+            if result['status'] in ('failed', 'aborted'):
+                self.logger.warning(f"Could not fetch {result['file']}, leaving it out of the scan")
+            else:
+                jars.append((result['category'], result['name'], dependencies[(result['category'], result['name'])],
+                             tmp_dir / result['file']))
+        if store is not None:
+            store.save_stats()
+        return jars
+    
+    def analyze_pipelines(self, patterns: List[str] = None, jar_dir: str = None, store: ArtifactStore = None,
+                          cache_dir: str = None, workers: int = None, keep: List[str] = None,
+                          output_file: str = None) -> DependencyProfile:
+        """Work out which declared JARs the SQL pipelines need and write them as a profile.
+        
+        Connector, format, catalog and module identifiers are matched against
+        the table factories each JAR registers in META-INF/services; class
+        names are matched against the classes each JAR contains. Every JAR
+        chosen that way pulls in the JARs its bytecode references. Where
+        several JARs provide the same factory or class, the one that adds the
+        fewest bytes wins.
+        """
+        patterns = patterns or [str(self.versions_file.resolve().parent / self.PIPELINES)]
+        files = sorted({match for pattern in patterns
+                        for match in (glob.glob(pattern) if glob.has_magic(pattern) else [pattern])})
+        if not files:
+            raise ValueError(f"No pipeline files match: {', '.join(patterns)}")
+        usage: Dict[str, Dict[str, List[str]]] = {kind: {} for kind in PipelineAnalyzer.KINDS}
+        with self.timings.span('parse'):
+            for path in files:
+                with open(path, 'r') as f:
+                    found = PipelineAnalyzer.analyze(f.read())
+                for kind, values in found.items():
+                    for value in values:
+                        usage[kind].setdefault(value, []).append(path)
+        
+        with tempfile.TemporaryDirectory(prefix='flink-deps-pipelines-') as tmp_dir:
+            declared = self._declared_jars(jar_dir, store, Path(tmp_dir))
+            scanner = ClasspathScanner(self.logger, cache_dir=cache_dir, workers=workers)
+            with self.timings.span('index'):
+                indexes = scanner.index([(f"{cat}/{name}", path) for cat, name, _, path in declared], deep=True)
+            self.logger.info(f"Indexed factories and class references of {len(indexes)} JARs "
+                             f"({scanner.stats['indexed']} parsed, {scanner.stats['cached']} from cache)")
+            sizes = {f"{cat}/{name}": path.stat().st_size for cat, name, _, path in declared}
+        
+        owners: Dict[str, List[str]] = {}
+        providers: Dict[str, List[str]] = {}
+        for key, index in sorted(indexes.items()):
+            for class_name in index['classes']:
+                owners.setdefault(class_name, []).append(key)
+            for identifiers in index['factories'].values():
+                for identifier in identifiers:
+                    providers.setdefault(identifier, []).append(key)
+        
+        def expand(seed: str, included: Dict[str, List[str]]) -> Dict[str, List[str]]:
+            """JARs the seed pulls in through its class references, beyond those already included"""
+            added = {}
+            queue = collections.deque([seed])
+            while queue:
+                key = queue.popleft()
+                for reference in indexes[key]['references']:
+                    candidates = owners.get(reference)
+                    if not candidates or any(c in included or c in added for c in candidates):
+                        continue
+                    chosen = min(candidates, key=lambda c: (sizes[c], c))
+                    added[chosen] = [f"{reference} is used by {key}"]
+                    queue.append(chosen)
+            return added
+        
+        required: Dict[str, List[str]] = {}
+        
+        def require(candidates: List[str], reason: str):
+            present = [c for c in candidates if c in required]
+            if present:
+                required[present[0]].append(reason)
+                return
+            best = None
+            for candidate in sorted(set(candidates)):
+                trial = dict(required)
+                trial[candidate] = [reason]
+                added = expand(candidate, trial)
+                cost = sizes[candidate] + sum(sizes[k] for k in added)
+                if best is None or cost < best[0]:
+                    best = (cost, candidate, added)
+            required[best[1]] = [reason]
+            required.update(best[2])
+        
+        unresolved = []
+        for kind in PipelineAnalyzer.KINDS:
+            for value in sorted(usage[kind]):
+                candidates = owners.get(value) if kind == 'class' else providers.get(value)
+                if candidates:
+                    require(candidates, f"{kind} {value}")
+                elif not value.startswith(ClasspathScanner.PLATFORM_PACKAGES):
+                    unresolved.append(f"{kind} {value}")
+        for pattern in keep or []:
+            matched = [key for key in sorted(indexes) if fnmatch.fnmatch(key, pattern)
+                       or fnmatch.fnmatch(key.split('/', 1)[1], pattern)]
+            if not matched:
+                self.logger.warning(f"--keep {pattern} matches no declared JAR")
+            for key in matched:
+                require([key], f"kept by --keep {pattern}")
+        
+        excluded = sorted(set(indexes) - set(required))
+        total_bytes = sum(sizes[key] for key in indexes)
+        total_classes = sum(len(index['classes']) for index in indexes.values())
+        savings = {
+            'jars': len(excluded),
+            'bytes': sum(sizes[key] for key in excluded),
+            'classes': sum(len(indexes[key]['classes']) for key in excluded)
+        }
+        base_dir = self.versions_file.resolve().parent
+        profile = DependencyProfile(
+            Path(output_file) if output_file else DependencyProfile.default_path(self.versions_file),
+            required={key: required[key] for key in sorted(required)},
+            excluded=excluded,
+            pipelines=[os.path.relpath(Path(path).resolve(), base_dir) for path in files],
+            usage={kind: sorted(values) for kind, values in usage.items() if values},
+            unresolved=unresolved,
+            savings=savings
+        )
+        profile.save()
+        
+        print()
+        self.logger.info(f"Analyzed {len(files)} pipeline files:")
+        for kind, values in profile.usage.items():
+            print(f"  {kind}: {', '.join(values)}")
+        for item in unresolved:
+            print(f"  {Colors.YELLOW}not in any declared JAR (built into Flink?):{Colors.NC} {item}")
+        
+        print()
+        self.logger.info(f"Required JARs: {len(required)}")
+        for key in sorted(required):
+            print(f"  {key}: {'; '.join(required[key])}")
+        print()
+        self.logger.info(f"Left out: {len(excluded)} JARs")
+        for key in excluded:
+            print(f"  {key} ({sizes[key] / 1048576:.1f}MB, {len(indexes[key]['classes'])} classes)")
+        
+        print()
+        byte_share = 100.0 * savings['bytes'] / total_bytes if total_bytes else 0.0
+        class_share = 100.0 * savings['classes'] / total_classes if total_classes else 0.0
+        self.logger.success(f"Profile saves {savings['jars']} of {len(indexes)} JARs, "
+                            f"{savings['bytes'] / 1048576:.1f}MB of {total_bytes / 1048576:.1f}MB ({byte_share:.0f}%), "
+                            f"{savings['classes']} of {total_classes} classes ({class_share:.0f}%)")
+        print(f"  Profile: {profile.path} (use with fetch --profile)")
+        return profile
+    
+    def fetch_artifacts(self, dest: str, category: str = None,
+                        max_parallel: int = ArtifactFetcher.DEFAULT_MAX_PARALLEL,
+                        require_checksums: bool = False, store: ArtifactStore = None,
+                        store_max_bytes: int = None, lock: DependencyLock = None,
+                        profile: DependencyProfile = None) -> bool:
+        """Download dependency JARs into dest; returns True when every JAR was fetched"""
+        if category and category not in self.dependencies:
+            raise ValueError(f"Unknown category: {category}")
+        
+        selected = [(cat, name, dep)
+                    for cat, deps in self.dependencies.items() if not category or cat == category
+                    for name, dep in deps.items()]
+        if profile is not None:
+            for key in profile.unknown(self.dependencies):
+                self.logger.warning(f"{key} is not in profile {profile.path}, fetching it (re-run analyze-pipelines)")
+            left_out = len(selected)
+            selected = [(cat, name, dep) for cat, name, dep in selected if profile.includes(cat, name)]
+            self.logger.info(f"Using profile: {profile.path} ({left_out - len(selected)} JARs left out)")
+        
+        if lock is not None:
+            stale = [f"{cat}.{name}" for cat, name, dep in selected
+                     if not DependencyLock.is_current(lock.get(cat, name), dep)]
+            if stale:
+                raise ValueError(f"Lockfile {lock.path} is out of date for: {', '.join(stale)} "
+                                 f"(run the 'lock' command)")
+            self.logger.info(f"Using lockfile: {lock.path}")
+        
+        self.logger.info(f"Fetching {len(selected)} JARs into {dest} (up to {max_parallel} parallel downloads)")
+        fetcher = ArtifactFetcher(self.maven, self.logger, max_parallel=max_parallel,
+                                  require_checksums=require_checksums, store=store)
+        with self.timings.span('fetch'):
+            summary = fetcher.fetch(selected, Path(dest), lock=lock)
+        
+        megabytes = summary['bytes'] / 1048576
+        rate = megabytes / summary['seconds'] if summary['seconds'] > 0 else 0.0
+        print()
+        self.logger.info("Fetch Summary:")
+        print(f"  Downloaded: {summary['downloaded']} JARs ({megabytes:.1f}MB in {summary['seconds']:.1f}s, {rate:.1f}MB/s)")
+        print(f"  Up to date: {summary['unchanged']} JARs")
+        if store is not None:
+            linked = ', '.join(f"{store.stats[k]} {k}" for k in ('hardlinked', 'reflinked', 'copied') if store.stats[k])
+            print(f"  From store: {summary['cached']} JARs" + (f" ({linked})" if linked else ""))
+        print(f"  Failed: {len(summary['failed'])} JARs")
+        if summary['aborted']:
+            print(f"  Abandoned after lockfile mismatch: {summary['aborted']} JARs")
+        
+        for result in summary['unverified']:
+            self.logger.warning(f"No published checksum, not verified: {result['file']}")
+        for result in summary['failed']:
+            self.logger.error(f"Failed: {result['category']}.{result['name']} ({result['url']})")
+        
+        if store is not None:
+            store.save_stats()
+            if store_max_bytes is not None:
+                removed = store.gc(store_max_bytes)
+                if removed['blobs']:
+                    self.logger.info(f"Store GC evicted {removed['blobs']} blobs ({removed['bytes'] / 1048576:.1f}MB)")
+        
+        return not summary['failed'] and not summary['aborted']
+    
+    def lock_dependencies(self, lock_path: str = None, store: ArtifactStore = None,
+                          max_parallel: int = ArtifactFetcher.DEFAULT_MAX_PARALLEL) -> bool:
+        """Write the lockfile, re-resolving only entries whose coordinate or repository changed"""
+        lock = DependencyLock.load(Path(lock_path) if lock_path else DependencyLock.default_path(self.versions_file))
+        removed = lock.retain(self.dependencies)
+        
+        stale = [(cat, name, dep)
+                 for cat, deps in self.dependencies.items()
+                 for name, dep in deps.items()
+                 if not DependencyLock.is_current(lock.get(cat, name), dep)]
+        unchanged = sum(len(deps) for deps in self.dependencies.values()) - len(stale)
+        
+        failed = []
+        if stale:
+            self.logger.info(f"Resolving {len(stale)} changed artifacts ({unchanged} unchanged)")
+            # The JARs have to be hashed once; the store keeps them for the build that follows
+            fetcher = ArtifactFetcher(self.maven, self.logger, max_parallel=max_parallel,
+                                      require_checksums=True, store=store)
+            with tempfile.TemporaryDirectory(prefix='flink-deps-lock-') as tmp_dir:
+                with self.timings.span('fetch'):
+                    summary = fetcher.fetch(stale, Path(tmp_dir))
+            
+            dependencies = {(cat, name): dep for cat, name, dep in stale}
+            for result in summary['results']:
+                if result['status'] in ('failed', 'aborted') or not result['verified']:
+                    failed.append(result)
+                    continue
+                dep = dependencies[(result['category'], result['name'])]
+                lock.set(result['category'], result['name'], {
+                    'coordinate': dep.coordinate(),
+                    'repository': dep.repository,
+                    # Pin the artifact's own repository whichever mirror served it;
+                    # locked fetches hedge to the mirrors again by path
+                    'url': dep.jar_url(),
+                    'sha256': result['sha256'],
+                    'sha1': result['sha1'],
+                    'size': result['size']
+                })
+            if store is not None:
+                store.save_stats()
+        
+        for result in failed:
+            self.logger.error(f"Could not lock {result['category']}.{result['name']} ({result['url']})")
+        
+        if stale or removed or not lock.path.exists():
+            lock.save()
+        
+        print()
+        self.logger.info("Lock Summary:")
+        print(f"  Lockfile: {lock.path}")
+        print(f"  Unchanged: {unchanged}")
+        print(f"  Resolved: {len(stale) - len(failed)}")
+        print(f"  Removed: {removed}")
+        print(f"  Failed: {len(failed)}")
+        return not failed
+
+    def plan_layers(self, plan_path: str = None, layers: int = LayerPlan.DEFAULT_LAYERS) -> LayerPlan:
+        """Measure version churn and write the layer plan"""
+        keys = [f"{cat}/{name}" for cat, deps in self.dependencies.items() for name in deps]
+        with self.timings.span('layers_plan'):
+            plan = LayerPlan.measure(Path(plan_path) if plan_path else LayerPlan.default_path(self.versions_file),
+                                     self.versions_file, self.history, keys, layers, self.logger)
+        if plan.source == 'defaults':
+            self.logger.warning("Fewer than two recorded revisions; layers follow per-category defaults "
+                                "until version history accumulates")
+        plan.save()
+        
+        counts = collections.Counter(plan.layer_of(key) for key in keys)
+        print()
+        self.logger.info("Layer Plan:")
+        print(f"  Plan: {plan.path}")
+        print(f"  Churn measured from: {plan.source or 'nothing'} ({plan.revisions} revisions)")
+        for layer in range(plan.layers):
+            print(f"  {LayerPlan.name(layer)}: {counts.get(layer, 0)} dependencies")
+        return plan
+    
+    def build_layers(self, jar_dir: str, output_dir: str, plan_path: str = None, output_format: str = 'dir',
+                     compress: bool = False, prefix: str = 'opt/flink/lib',
+                     layers: int = LayerPlan.DEFAULT_LAYERS, profile: DependencyProfile = None) -> bool:
+        """Split the JARs in jar_dir into the planned layers; returns True when every JAR was placed"""
+        path = Path(plan_path) if plan_path else LayerPlan.default_path(self.versions_file)
+        plan = LayerPlan.load(path)
+        if plan is None:
+            self.logger.warning(f"No layer plan at {path}; using per-category defaults (run 'layers plan')")
+            plan = LayerPlan.seed(path, [f"{cat}/{name}" for cat, deps in self.dependencies.items() for name in deps],
+                                  layers)
+        if output_format == 'dir' and plan.layers != LayerPlan.DOCKERFILE_LAYERS:
+            # The Dockerfile copies a fixed set of layer-N directories; extra ones would be left out of the image
+            raise ValueError(f"Layer plan {path} has {plan.layers} layers but the Dockerfile copies "
+                             f"{LayerPlan.DOCKERFILE_LAYERS}; use --format tar and its Dockerfile.layers, "
+                             f"or re-run 'layers plan --layers {LayerPlan.DOCKERFILE_LAYERS}'")
+        
+        jar_path = Path(jar_dir)
+        if not jar_path.is_dir():
+            raise ValueError(f"JAR directory not found: {jar_dir}")
+        repacked = self._read_repack(jar_path)
+        if repacked is not None:
+            # A merged JAR changes whenever any of its members does
+            owners = {name: entry['dependencies'] for name, entry in repacked['jars'].items()}
+        else:
+            owners = {dep.jar_filename(): [f"{cat}/{name}"]
+                      for cat, deps in self.dependencies.items() for name, dep in deps.items()
+                      if profile is None or profile.includes(cat, name)}
+        assigned = collections.defaultdict(list)
+        for jar in sorted(jar_path.glob('*.jar')):
+            keys = owners.get(jar.name)
+            if not keys:
+                self.logger.warning(f"{jar.name} is not in {self.versions_file.name}; "
+                                    f"placing it in {LayerPlan.name(plan.layers - 1)}")
+                assigned[plan.layers - 1].append(jar)
+            else:
+                for key in keys:
+                    if key not in plan.churn:
+                        self.logger.warning(f"{key} is not in the layer plan; "
+                                            f"placing {jar.name} in {LayerPlan.name(plan.layers - 1)}")
+                assigned[max(plan.layer_of(key) for key in keys)].append(jar)
+        missing = sorted(set(owners) - {jar.name for jars in assigned.values() for jar in jars})
+        for name in missing:
+            self.logger.error(f"Missing JAR: {name}")
+        
+        output = Path(output_dir)
+        output.mkdir(parents=True, exist_ok=True)
+        mtime = int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+        writer = LayerWriter(prefix, mtime)
+        manifest_path = output / 'layers.json'
+        previous = {}
+        if manifest_path.exists():
+            try:
+                with open(manifest_path, 'r') as f:
+                    previous = {layer['name']: layer for layer in json.load(f).get('layers', [])}
+            except (json.JSONDecodeError, OSError, KeyError, TypeError):
+                previous = {}
+        
+        # Every planned layer is written, even empty, so Dockerfile COPY lines never miss a source
+        manifest = []
+        with self.timings.span('layers_build'):
+            for layer in range(plan.layers):
+                name = LayerPlan.name(layer)
+                jars = sorted(assigned.get(layer, []), key=lambda p: p.name)
+                entry = {'name': name, 'jars': [jar.name for jar in jars],
+                         'bytes': sum(jar.stat().st_size for jar in jars)}
+                if output_format == 'dir':
+                    writer.write_directory(output / name, jars)
+                else:
+                    filename = f"{name}.tar" + ('.gz' if compress else '')
+                    entry['file'] = filename
+                    entry.update(writer.write_tarball(output / filename, jars, compress))
+                manifest.append(entry)
+        
+        with open(manifest_path, 'w') as f:
+            json.dump({'format': output_format, 'prefix': writer.prefix, 'mtime': mtime, 'layers': manifest},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+        if output_format == 'tar':
+            with open(output / 'Dockerfile.layers', 'w') as f:
+                f.write(''.join(f"ADD {entry['file']} /\n" for entry in manifest))
+        
+        print()
+        self.logger.info("Layers:")
+        for entry in manifest:
+            old = previous.get(entry['name'])
+            if old is None:
+                change = 'new'
+            elif 'diff_id' in entry:
+                change = 'unchanged' if old.get('diff_id') == entry['diff_id'] else 'changed'
+            else:
+                change = 'unchanged' if old.get('jars') == entry['jars'] else 'changed'
+            digest = f" {entry['diff_id'][7:19]}" if 'diff_id' in entry else ''
+            print(f"  {entry['name']}: {len(entry['jars']):3d} JARs {entry['bytes'] / 1048576:8.1f}MB{digest} {change}")
+        print(f"  Manifest: {manifest_path}")
+        return not missing
+    
+    @staticmethod
+    def _read_repack(jar_dir: Path) -> Optional[Dict[str, Any]]:
+        """The repack.json a repack run left in jar_dir, if any"""
+        try:
+            with open(jar_dir / 'repack.json', 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in {jar_dir / 'repack.json'}: {e}")
+    
+    def repack_jars(self, jar_dir: str, output_dir: str, families: List[str] = None, merge: bool = True,
+                    compression: str = 'stored', level: int = None, strict: bool = False,
+                    sample: int = 2000, base_dirs: List[str] = None) -> bool:
+        """Merge each category's JARs into one JAR with the chosen entry compression.
+        
+        A merged JAR takes the classpath position of its deps-<category>.jar
+        name, so every class is looked up in the old and new lib/ order (with
+        the base image JARs of base_dirs) to find classes now served with
+        different bytes. Returns False when strict and either that happens or
+        some entry names carry different bytes in different JARs of one family.
+        """
+        source = Path(jar_dir)
+        output = Path(output_dir)
+        if not source.is_dir():
+            raise ValueError(f"JAR directory not found: {jar_dir}")
+        if output.resolve() == source.resolve():
+            raise ValueError("The output directory must differ from the JAR directory")
+        for family in families or []:
+            if family not in self.dependencies:
+                raise ValueError(f"Unknown category: {family}")
+        
+        members = {dep.jar_filename(): (cat, f"{cat}/{name}")
+                   for cat, deps in self.dependencies.items() for name, dep in deps.items()}
+        jars = sorted(source.glob('*.jar'))
+        groups: Dict[str, List[Path]] = {}
+        signed = set()
+        for jar in jars:
+            category = members.get(jar.name, (None,))[0]
+            if JarRepacker.is_signed(jar):
+                signed.add(jar.name)
+                self.logger.warning(f"{jar.name} is signed; copying it unchanged")
+                groups[jar.name] = [jar]
+            elif not merge or category is None or (families and category not in families):
+                groups[jar.name] = [jar]
+            else:
+                groups.setdefault(f"deps-{category}.jar", []).append(jar)
+        # A family of one keeps its own file name
+        groups = {(name if len(inputs) > 1 else inputs[0].name): inputs for name, inputs in groups.items()}
+        
+        output.mkdir(parents=True, exist_ok=True)
+        previous = self._read_repack(output)
+        if previous is not None:
+            for name in previous.get('jars', {}):
+                if name not in groups and (output / name).exists():
+                    (output / name).unlink()
+        
+        repacker = JarRepacker(compression, level, int(os.environ.get('SOURCE_DATE_EPOCH', 0)))
+        manifest = {}
+        conflicts = []
+        with self.timings.span('repack'):
+            for name in sorted(groups):
+                inputs = groups[name]
+                if name in signed:
+                    shutil.copyfile(inputs[0], output / name)
+                    result = {'entries': None, 'duplicates': 0, 'services': 0, 'conflicts': []}
+                else:
+                    result = repacker.merge(output / name, inputs)
+                manifest[name] = {
+                    'sources': [jar.name for jar in inputs],
+                    'dependencies': [members[jar.name][1] for jar in inputs if jar.name in members],
+                    'entries': result['entries'],
+                    'duplicates': result['duplicates'],
+                    'conflicts': result['conflicts']
+                }
+                conflicts.extend(dict(conflict, jar=name) for conflict in result['conflicts'])
+                if len(inputs) > 1:
+                    self.logger.debug(f"{name}: {len(inputs)} JARs, {result['entries']} entries, "
+                                      f"{result['duplicates']} duplicates, {result['services']} service files merged")
+        
+        # Flink searches lib/ in file name order, base image JARs included
+        base_jars = [path for base_dir in base_dirs or [] for path in sorted(Path(base_dir).glob('*.jar'))]
+        outputs = sorted(output.glob('*.jar'))
+        with self.timings.span('order'):
+            indexes = ClasspathScanner(self.logger).index(
+                [(f"in/{path.name}", path) for path in jars] + [(f"out/{path.name}", path) for path in outputs]
+                + [(f"base/{path.name}", path) for path in base_jars])
+            base = [f"base/{path.name}" for path in base_jars]
+            old_order = sorted([f"in/{path.name}" for path in jars] + base, key=lambda label: label.split('/', 1)[1])
+            new_order = sorted([f"out/{path.name}" for path in outputs] + base, key=lambda label: label.split('/', 1)[1])
+            before_winners = ClasspathScanner.winners(indexes, old_order)
+            after_winners = ClasspathScanner.winners(indexes, new_order)
+        reordered = []
+        for class_name, (label, crc) in sorted(before_winners.items()):
+            after_label, after_crc = after_winners.get(class_name, (None, None))
+            if after_crc != crc:
+                reordered.append({'class': class_name, 'before': label.split('/', 1)[1],
+                                  'after': after_label.split('/', 1)[1] if after_label else None})
+        
+        with open(output / 'repack.json', 'w') as f:
+            json.dump({'compression': compression, 'level': level, 'jars': manifest, 'reordered': reordered},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+        
+        # Time the same classes on both classpaths; Flink puts lib/ on the classpath in file name order
+        class_names = []
+        for jar in jars:
+            with zipfile.ZipFile(jar) as z:
+                class_names.extend(n[:-6].replace('/', '.') for n in z.namelist() if ClasspathScanner._is_class(n))
+        class_names = sorted(set(class_names))
+        class_names = class_names[::max(1, len(class_names) // sample)] if sample else class_names
+        with self.timings.span('measure'):
+            before = JarRepacker.measure(jars, class_names)
+            after = JarRepacker.measure(sorted(output.glob('*.jar')), class_names)
+        
+        print()
+        self.logger.info("Repack Summary:")
+        for name in sorted(groups):
+            if len(groups[name]) > 1:
+                entry = manifest[name]
+                print(f"  {name}: {len(entry['sources'])} JARs, {entry['entries']} entries, "
+                      f"{entry['duplicates']} duplicate entries dropped")
+        if conflicts:
+            self.logger.warning(f"Conflicting entries: {len(conflicts)} (the first JAR in file name order wins)")
+            shown = conflicts if self.logger.verbose else conflicts[:10]
+            for conflict in shown:
+                print(f"  {conflict['jar']}: {conflict['entry']} from {conflict['kept']}, "
+                      f"not {conflict['dropped']}")
+            if len(shown) < len(conflicts):
+                print(f"  ... {len(conflicts) - len(shown)} more (use --verbose)")
+        if reordered:
+            self.logger.warning(f"Classes served by a different JAR after repacking: {len(reordered)} "
+                                f"(merged JARs move in the lib/ order)")
+            shown = reordered if self.logger.verbose else reordered[:10]
+            for change in shown:
+                print(f"  {change['class']}: was {change['before']}, now {change['after'] or 'missing'}")
+            if len(shown) < len(reordered):
+                print(f"  ... {len(reordered) - len(shown)} more (use --verbose)")
+        if merge and not base_jars:
+            self.logger.info("Base image JARs were not checked; pass --base-lib with a copy of its lib/")
+        print()
+        print(f"  {'':8} {'JARs':>6} {'Size':>10} {'Open':>10} {'Lookup':>10}  ({before['classes']} classes, "
+              f"{compression})")
+        for label, result in (('Before', before), ('After', after)):
+            print(f"  {label:8} {result['jars']:6d} {result['bytes'] / 1048576:9.1f}M "
+                  f"{result['open_seconds'] * 1000:8.1f}ms {result['lookup_seconds'] * 1000:8.1f}ms")
+        print(f"  Manifest: {output / 'repack.json'}")
+        return not (strict and (conflicts or reordered))
+    
+    @classmethod
+    def batch(cls, patterns: List[str], logger: Logger, maven: MavenRepository, rules_file: str = None,
+              rules_cache_dir: str = None, include_prereleases: bool = False,
+              targets: List[CompatibilityTarget] = None, output_dir: str = None,
+              apply: bool = False, dry_run: bool = False) -> bool:
+        """Evaluate several versions files against one shared catalog.
+        
+        Every unique artifact is resolved once however many files declare it;
+        each file is then scanned from the catalog without further requests.
+        """
+        files = []
+        for pattern in patterns:
+            matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            if not matches:
+                logger.warning(f"No versions files match {pattern}")
+            files.extend(matches)
+        files = list(dict.fromkeys(files))
+        
+        managers = []
+        failed = []
+        catalog = ArtifactCatalog()
+        solver = FamilySolver(maven, logger)
+        for versions_file in files:
+            try:
+                manager = cls(versions_file, logger, rules_file=rules_file,
+                              rules_cache_dir=rules_cache_dir, maven=maven, solver=solver)
+            except (FileNotFoundError, ValueError, KeyError) as e:
+                logger.error(f"{versions_file}: {e}")
+                failed.append(versions_file)
+                continue
+            catalog.add(manager.dependencies)
+            managers.append(manager)
+        
+        start = time.monotonic()
+        fetched = catalog.resolve(maven)
+        logger.info(f"Resolved {fetched} unique artifacts for {catalog.declarations} declarations "
+                    f"across {len(managers)} files in {time.monotonic() - start:.1f}s")
+        
+        if output_dir:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+        # Variants often share a file name, so those are told apart by their directory
+        stems = [manager.versions_file.stem for manager in managers]
+        
+        rows = []
+        for manager in managers:
+            scan = manager.scan(include_prereleases=include_prereleases, targets=targets, catalog=catalog)
+            manager.scan_result = scan
+            if targets:
+                updates = [e for e in scan.entries if e.latest_all_targets
+                           and maven_version(e.latest_all_targets) > maven_version(e.current_version)]
+                incompatible = [e for e in scan.entries if not all(i['current'] for i in e.targets.values())]
+            else:
+                updates = [e for e in scan.entries if e.update_available]
+                incompatible = [e for e in scan.entries if e.dep_type != 'unknown' and not e.current_compatible]
+            rows.append({
+                'file': str(manager.versions_file),
+                'dependencies': len(scan.entries),
+                'updates': len(updates),
+                'incompatible': len(incompatible),
+                'unknown': sum(1 for e in scan.entries if e.dep_type == 'unknown')
+            })
+            
+            if output_dir:
+                stem = manager.versions_file.stem
+                if stems.count(stem) > 1:
+                    stem = f"{manager.versions_file.resolve().parent.name}-{stem}"
+                scan.save(str(Path(output_dir) / f"{stem}.scan.json"))
+            if apply:
+                logger.info(f"Applying updates to {manager.versions_file}")
+                manager.update_dependencies(include_prereleases=include_prereleases, dry_run=dry_run,
+                                            targets=targets)
+        
+        print()
+        logger.info("Batch Summary:")
+        file_width = max([len('File')] + [len(row['file']) for row in rows])
+        print(f"  {'File'.ljust(file_width)}  Deps  Updates  Incompatible  Unknown")
+        for row in rows:
+            print(f"  {row['file'].ljust(file_width)}  {row['dependencies']:>4}  {row['updates']:>7}  "
+                  f"{row['incompatible']:>12}  {row['unknown']:>7}")
+        print(f"  Unique artifacts: {len(catalog)} (of {catalog.declarations} declarations)")
+        if output_dir:
+            print(f"  Scan snapshots: {output_dir}")
+        for versions_file in failed:
+            logger.error(f"Could not load {versions_file}")
+        return not failed
+    
+    def check_rules(self) -> bool:
+        """Report rule problems and how the declared dependencies classify"""
+        self.logger.info(f"Rules file: {self.rules.path}")
+        print(f"  Classifier rules: {self.rules.rule_count}")
+        print(f"  Flink versions with compatibility rules: {', '.join(sorted(self.rules.compatibility)) or 'none'}")
+        for problem in self.rules.problems:
+            self.logger.warning(problem)
+        for family, members in self.family_members():
+            aligned_by = f"BOM {family.bom}" if family.bom else "shared version"
+            print(f"  Family {family.name} ({aligned_by}, from {family.source}): "
+                  f"{', '.join(f'{cat}.{dep_name}' for cat, dep_name, _ in members)}")
+        
+        unknown = [(cat, name, dep) for cat, deps in self.dependencies.items()
+                   for name, dep in deps.items() if dep.get_dependency_type(self.rules) == 'unknown']
+        for cat, name, dep in unknown:
+            self.logger.warning(f"{cat}/{name} is not classified ({dep.group_id}:{dep.artifact_id})")
+        
+        if not self.rules.problems and not unknown:
+            self.logger.success("Rules are consistent and classify every dependency")
+        return not self.rules.problems
+    
+    def benchmark_rules(self, count: int = 10000, seed: int = 0) -> List[Dict[str, Any]]:
+        """Time classification over synthetic catalogs of 1/10, 1x and 10x the given size"""
+        rng = random.Random(seed)
+        known_groups = sorted({dep.group_id for deps in self.dependencies.values() for dep in deps.values()})
+        words = ['core', 'client', 'api', 'common', 'kafka', 'avro', 'jackson', 'netty', 'grpc', 'util',
+                 'connector', 'runtime', 'json', 'protobuf', 'auth', 'http', 'sql', 'table', 'scala', 'log4j']
+        
+        def coordinate(i: int) -> Tuple[str, str]:
+            # Half the catalog lives under known groups, the rest under unrelated vendors
+            if known_groups and rng.random() < 0.5:
+                group_id = rng.choice(known_groups)
+            else:
+                group_id = f"com.vendor{rng.randrange(500)}.{rng.choice(words)}"
+            return group_id, f"{rng.choice(words)}-{rng.choice(words)}-{i}"
+        
+        results = []
+        for size in (max(1, count // 10), count, count * 10):
+            catalog = [coordinate(i) for i in range(size)]
+            # Fresh instance so the memo does not hide the lookup cost
+            rules = DependencyRules.load(self.rules.path)
+            start = time.perf_counter()
+            types = [rules.classify(g, a) for g, a in catalog]
+            elapsed = time.perf_counter() - start
+            results.append({
+                'coordinates': size,
+                'seconds': elapsed,
+                'per_artifact_us': elapsed / size * 1e6,
+                'unknown': types.count('unknown')
+            })
+        
+        compile_start = time.perf_counter()
+        DependencyRules.compile(self.rules.path)
+        compile_ms = (time.perf_counter() - compile_start) * 1000
+        
+        self.logger.info(f"Classifier benchmark ({self.rules.rule_count} rules, compile {compile_ms:.1f}ms)")
+        for result in results:
+            print(f"  {result['coordinates']:>8} coordinates: {result['seconds'] * 1000:8.1f}ms "
+                  f"({result['per_artifact_us']:.2f}µs/artifact, {result['unknown']} unknown)")
+        return results
+
+
+class DependencyWatcher:
+    """Keeps a DependencyManager resident and re-checks each dependency on its own schedule.
+    
+    Every dependency has a due time. A poll scans only the dependencies that
+    are due and schedules each one again ``interval`` seconds later, give or
+    take ``jitter`` of the interval. After the first pass each due time is
+    drawn from the whole interval, so the repositories see a steady trickle
+    of requests instead of one burst per interval. Results are kept in memory
+    and served over HTTP; a scrape renders from them and never touches a
+    repository.
+    """
+    
+    DEFAULT_INTERVAL = 6 * 3600  # seconds between checks of one dependency
+    DEFAULT_JITTER = 0.2  # fraction of the interval a due time may move either way
+    DEFAULT_PORT = 9477
+    RETRY_INTERVAL = 300  # seconds before an unresolved dependency is checked again
+    MAX_SLEEP = 30  # the versions file is re-read at least this often
+    
+    def __init__(self, manager: DependencyManager, interval: float = DEFAULT_INTERVAL,
+                 jitter: float = DEFAULT_JITTER, include_prereleases: bool = False,
+                 targets: List[CompatibilityTarget] = None):
+        self.manager = manager
+        self.logger = manager.logger
+        self.interval = max(1.0, interval)
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.include_prereleases = include_prereleases
+        self.targets = targets
+        self.results: Dict[Tuple[str, str], ScanEntry] = {}
+        self.checked_at: Dict[Tuple[str, str], float] = {}
+        self.polls = 0
+        self.last_poll: Optional[float] = None
+        self._due: List[Tuple[float, str, str]] = []  # heap of (due time, category, name)
+        self._scheduled: Dict[Tuple[str, str], float] = {}  # current due time; older heap items are stale
+        self._lock = threading.Lock()
+        self._rendered: Optional[Tuple[str, List[Tuple[str, float]]]] = None
+        self._stop = threading.Event()
+        self._versions_stamp: Optional[Tuple[int, int]] = None
+        self._random = random.Random()
+    
+    def _schedule(self, key: Tuple[str, str], when: float):
+        self._scheduled[key] = when
+        heapq.heappush(self._due, (when, key[0], key[1]))
+    
+    def _next_due(self, entry: ScanEntry, first: bool) -> float:
+        now = time.time()
+        if entry.last_updated is None and entry.latest_version is None:
+            # The metadata could not be fetched
+            return now + min(self.interval, self.RETRY_INTERVAL) * self._random.uniform(1.0, 1.0 + self.jitter)
+        if first:
+            # Spread the first pass over the interval so later polls stay small
+            return now + self.interval * self._random.uniform(1.0 - self.jitter, 1.0)
+        return now + self.interval * self._random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+    
+    def sync_dependencies(self):
+        """Re-read the versions file if it changed; new or changed dependencies are due at once"""
+        try:
+            stat = self.manager.versions_file.stat()
+        except OSError as e:
+            self.logger.warning(f"Cannot read versions file: {e}")
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._versions_stamp:
+            return
+        if self._versions_stamp is not None:
+            try:
+                self.manager._load_dependencies()
+            except (OSError, ValueError) as e:
+                # Probably caught mid-write; keep the previous dependencies and try again
+                self.logger.warning(f"Keeping previous dependencies: {e}")
+                return
+            self.logger.info(f"Reloaded {self.manager.versions_file}")
+        self._versions_stamp = stamp
+        
+        now = time.time()
+        declared = {(cat, dep_name): dep for cat, deps in self.manager.dependencies.items()
+                    for dep_name, dep in deps.items()}
+        with self._lock:
+            for key in list(self._scheduled):
+                if key not in declared:
+                    del self._scheduled[key]
+                    self.results.pop(key, None)
+                    self.checked_at.pop(key, None)
+            for key, dep in declared.items():
+                entry = self.results.get(key)
+                if key not in self._scheduled or (entry is not None and (
+                        entry.current_version != dep.version or entry.group_id != dep.group_id
+                        or entry.artifact_id != dep.artifact_id or entry.repository != dep.repository)):
+                    self._schedule(key, now)
+            self._rendered = None
+    
+    def poll(self) -> int:
+        """Check every dependency that is due; returns how many were checked"""
+        now = time.time()
+        due = []
+        with self._lock:
+            while self._due and self._due[0][0] <= now:
+                when, cat, dep_name = heapq.heappop(self._due)
+                if self._scheduled.get((cat, dep_name)) == when:
+                    due.append((cat, dep_name))
+        if not due:
+            return 0
+        
+        started = time.perf_counter()
+        pending = set(due)
+        try:
+            for entry in self.manager.iter_scan(include_prereleases=self.include_prereleases,
+                                                targets=self.targets, only=due):
+                key = (entry.category, entry.name)
+                pending.discard(key)
+                with self._lock:
+                    if key not in self._scheduled:
+                        continue  # dropped from the versions file meanwhile
+                    first = key not in self.results
+                    self.results[key] = entry
+                    self.checked_at[key] = time.time()
+                    self._schedule(key, self._next_due(entry, first))
+                    self._rendered = None
+        finally:
+            # Whatever a failed poll did not reach is retried soon instead of being lost
+            with self._lock:
+                for key in pending:
+                    if key in self._scheduled:
+                        self._schedule(key, time.time() + self.RETRY_INTERVAL)
+        with self._lock:
+            self.polls += 1
+            self.last_poll = time.time()
+            self._rendered = None
+        self.logger.debug(f"Checked {len(due)} dependencies in {time.perf_counter() - started:.1f}s; "
+                         f"{len(self._scheduled)} scheduled")
+        return len(due)
+    
+    def _wait_seconds(self) -> float:
+        with self._lock:
+            next_due = self._due[0][0] if self._due else time.time() + self.MAX_SLEEP
+        return min(max(next_due - time.time(), 0.1), self.MAX_SLEEP)
+    
+    def records(self, category: str = None, status: str = None) -> List[Dict[str, Any]]:
+        """Current results in versions-file order, as streamed by check --format json"""
+        with self._lock:
+            items = [(key, self.results[key], self.checked_at[key]) for key in self._scheduled if key in self.results]
+        order = {key: i for i, key in enumerate((cat, dep_name) for cat, deps in self.manager.dependencies.items()
+                                                for dep_name in deps)}
+        items.sort(key=lambda item: order.get(item[0], len(order)))
+        records = []
+        for key, entry, checked_at in items:
+            entry_status = DependencyManager._result_status('check', entry, self.targets)
+            if (category is not None and entry.category != category) or (status is not None and entry_status != status):
+                continue
+            record = {'status': entry_status}
+            record.update(entry.to_dict())
+            record['checked_at'] = datetime.fromtimestamp(checked_at, timezone.utc).isoformat(timespec='seconds')
+            records.append(record)
+        return records
+    
+    def summary(self) -> Dict[str, Any]:
+        """Counts by status plus schedule progress"""
+        with self._lock:
+            entries = list(self.results.values())
+            scheduled = len(self._scheduled)
+            last_poll = self.last_poll
+        statuses: Dict[str, int] = {}
+        for entry in entries:
+            entry_status = DependencyManager._result_status('check', entry, self.targets)
+            statuses[entry_status] = statuses.get(entry_status, 0) + 1
+        return {
+            'flink_version': self.manager.metadata.get('flink_version', '2.0.0'),
+            'targets': [target.name for target in self.targets] if self.targets else None,
+            'dependencies': scheduled,
+            'checked': len(entries),
+            'statuses': dict(sorted(statuses.items())),
+            'incompatible': sum(1 for entry in entries
+                                if DependencyManager._result_status('validate', entry, self.targets) == 'incompatible'),
+            'polls': self.polls,
+            'last_poll': datetime.fromtimestamp(last_poll, timezone.utc).isoformat(timespec='seconds')
+            if last_poll else None
+        }
+    
+    def _render(self) -> Tuple[str, List[Tuple[str, float]]]:
+        """Metrics that only change with the results, plus each newest release's timestamp"""
+        summary = self.summary()
+        lines = []
+        
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        metric('flink_deps_dependencies', 'gauge', 'Declared dependencies by check status')
+        for status in ('update-available', 'up-to-date', 'unresolved'):
+            lines.append(f"flink_deps_dependencies{Timings._labels(status=status)} "
+                         f"{summary['statuses'].get(status, 0)}")
+        lines.append(f"flink_deps_dependencies{Timings._labels(status='pending')} "
+                     f"{summary['dependencies'] - summary['checked']}")
+        metric('flink_deps_outdated_dependencies', 'gauge', 'Dependencies with a newer compatible release')
+        lines.append(f"flink_deps_outdated_dependencies {summary['statuses'].get('update-available', 0)}")
+        metric('flink_deps_incompatible_dependencies', 'gauge', 'Dependencies whose current version is incompatible')
+        lines.append(f"flink_deps_incompatible_dependencies {summary['incompatible']}")
+        metric('flink_deps_polls_total', 'counter', 'Polls that checked at least one dependency')
+        lines.append(f"flink_deps_polls_total {summary['polls']}")
+        if self.last_poll is not None:
+            metric('flink_deps_last_poll_timestamp_seconds', 'gauge', 'Time the last poll finished')
+            lines.append(f"flink_deps_last_poll_timestamp_seconds {self.last_poll:.3f}")
+        
+        releases = []
+        with self._lock:
+            entries = [self.results[key] for key in self._scheduled if key in self.results]
+        for entry in entries:
+            released = MavenMetadata.timestamp(entry.last_updated)
+            if released is not None:
+                releases.append((Timings._labels(category=entry.category, name=entry.name), released))
+        return '\n'.join(lines) + '\n', releases
+    
+    def metrics(self) -> str:
+        """Prometheus exposition; only the release ages are computed per scrape"""
+        with self._lock:
+            rendered = self._rendered
+        if rendered is None:
+            rendered = self._render()
+            with self._lock:
+                self._rendered = rendered
+        text, releases = rendered
+        lines = [text.rstrip('\n')]
+        if releases:
+            now = time.time()
+            lines.append('# HELP flink_deps_latest_release_age_seconds Age of the newest published release '
+                         '(maven-metadata lastUpdated)')
+            lines.append('# TYPE flink_deps_latest_release_age_seconds gauge')
+            lines.extend(f"flink_deps_latest_release_age_seconds{labels} {max(now - released, 0.0):.0f}"
+                         for labels, released in releases)
+        if self.manager.timings.enabled:
+            lines.append(self.manager.timings.to_prometheus('serve').rstrip('\n'))
+        return '\n'.join(lines) + '\n'
+    
+    class _Handler(BaseHTTPRequestHandler):
+        """GET /metrics, /dependencies[?category=&status=], /summary and /healthz"""
+        
+        watcher: 'DependencyWatcher' = None
+        
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+            watcher = self.watcher
+            if parsed.path == '/metrics':
+                self._send(200, watcher.metrics(), 'text/plain; version=0.0.4; charset=utf-8')
+            elif parsed.path == '/dependencies':
+                self._send_json({'summary': watcher.summary(),
+                                 'dependencies': watcher.records(query.get('category'), query.get('status'))})
+            elif parsed.path == '/summary':
+                self._send_json(watcher.summary())
+            elif parsed.path == '/healthz':
+                # Ready once every dependency has been checked at least once
+                summary = watcher.summary()
+                ready = summary['checked'] >= summary['dependencies']
+                self._send(200 if ready else 503, 'ok\n' if ready else 'starting\n', 'text/plain; charset=utf-8')
+            else:
+                self._send(404, 'not found\n', 'text/plain; charset=utf-8')
+        
+        def _send_json(self, data: Dict[str, Any]):
+            self._send(200, json.dumps(data, indent=2) + '\n', 'application/json')
+        
+        def _send(self, code: int, body: str, content_type: str):
+            payload = body.encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        
+        def log_message(self, format: str, *args):
+            self.watcher.logger.debug(f"HTTP {self.address_string()} {format % args}")
+    
+    def serve(self, host: str = '0.0.0.0', port: int = DEFAULT_PORT):
+        """Poll and serve until SIGTERM or Ctrl-C"""
+        handler = type('Handler', (self._Handler,), {'watcher': self})
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='http', daemon=True).start()
+        self.logger.success(f"Serving on http://{host}:{server.server_address[1]} "
+                            f"(/metrics, /dependencies, /summary, /healthz)")
+        self.logger.info(f"Each dependency is checked every {self.interval:.0f}s ± {self.jitter:.0%}")
+        
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: self._stop.set())
+        try:
+            while not self._stop.is_set():
+                self.sync_dependencies()
+                try:
+                    self.poll()
+                except Exception as e:
+                    self.logger.error(f"Poll failed: {e}")
+                self._stop.wait(self._wait_seconds())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            server.shutdown()
+            server.server_close()
+        self.logger.info("Stopped")
+
 
 def main():
     """Main entry point"""
@@ -924,28 +7227,101 @@ Examples:
   %(prog)s update                      # Apply updates
   %(prog)s update --category kafka     # Update specific category
   %(prog)s validate                    # Validate compatibility
-  %(prog)s backup                      # Create backup
-  %(prog)s restore backup.json         # Restore from backup
+  %(prog)s check --targets flink-2.0.0,flink-2.1.0,kafka-all  # Plan an upgrade across targets
+  %(prog)s check --format ndjson       # Stream one JSON result per dependency
+  %(prog)s check --state deps.state.json  # Only re-evaluate artifacts that published something new
+  %(prog)s backup                      # Snapshot the versions file into the history
+  %(prog)s history                     # List snapshots with the versions they changed
+  %(prog)s diff 3f2a9c1b current       # Version changes since a snapshot
+  %(prog)s restore --where kafka-clients=3.7.1  # Restore the newest snapshot with that version
   %(prog)s report                      # Generate report
+  %(prog)s fetch --dest /opt/flink/lib  # Download all JARs
+  %(prog)s check --mirror https://packages.confluent.io/maven  # Hedge requests to a mirror
+  %(prog)s resolve                     # Find missing transitive dependencies
+  %(prog)s scan-classpath --base-lib ./flink-lib  # Find classpath clashes
+  %(prog)s lock                        # Write dependency-versions.lock.json
+  %(prog)s analyze-pipelines           # Work out which JARs the SQL pipelines need
+  %(prog)s fetch --dest lib --profile dependency-versions.profile.json  # Fetch only those JARs
+  %(prog)s fetch --dest lib --locked   # Download exactly what the lockfile pins
+  %(prog)s store stats                 # Show artifact store usage
+  %(prog)s layers build --jar-dir lib --output-dir layers  # Split JARs into churn-ordered layers
+  %(prog)s repack --jar-dir lib --output-dir repacked  # Merge JAR families, entries stored uncompressed
+  %(prog)s rules check                 # Report ambiguous or shadowed rules
+  %(prog)s batch 'variants/*.json' --output-dir scans  # Evaluate many versions files at once
+  %(prog)s serve --port 9477 --interval 21600  # Poll on a jittered schedule and serve /metrics
+  %(prog)s --timings timings.json status  # Record per-phase timings and HTTP stats
+  %(prog)s --profile status.prof check  # Write cProfile stats and collapsed stacks
         """
     )
     
+    # Repository options shared by the network commands, fetch and lock
+    repository_parent = argparse.ArgumentParser(add_help=False)
+    repository_parent.add_argument('--mirror', action='append', default=[], metavar='URL',
+                                   help='Mirror or extra repository to hedge requests to (repeatable)')
+    repository_parent.add_argument('--rate-limit', type=float, metavar='RPS',
+                                   help='Never send more than RPS requests per second to one repository host '
+                                        '(default: unpaced until a host throttles)')
+    
+    # Options shared by every command that talks to Maven repositories
+    network_parent = argparse.ArgumentParser(add_help=False, parents=[repository_parent])
+    network_parent.add_argument('--max-workers', type=int, default=MavenRepository.DEFAULT_MAX_WORKERS,
+                                help=f'Maximum concurrent metadata requests (default: {MavenRepository.DEFAULT_MAX_WORKERS})')
+    network_parent.add_argument('--per-repo-limit', type=int, default=MavenRepository.DEFAULT_PER_REPOSITORY_LIMIT,
+                                help='Maximum concurrent requests per repository host '
+                                     f'(default: {MavenRepository.DEFAULT_PER_REPOSITORY_LIMIT})')
+    network_parent.add_argument('--cache-dir', default=MetadataCache.default_dir(),
+                                help='Metadata cache directory (default: %(default)s)')
+    network_parent.add_argument('--cache-ttl', type=int, default=MetadataCache.DEFAULT_TTL,
+                                help='Seconds before cached metadata is revalidated (default: %(default)s)')
+    network_parent.add_argument('--negative-ttl', type=int, default=MetadataCache.DEFAULT_NEGATIVE_TTL,
+                                help='Seconds a 404 for an artifact, or a mirror that did not answer, is remembered '
+                                     '(default: %(default)s)')
+    network_parent.add_argument('--no-cache', action='store_true', help='Disable the metadata cache')
+    network_parent.add_argument('--offline', action='store_true',
+                                help='Serve metadata from the cache only, never contact repositories')
+    
+    # Options for commands that render from a scan snapshot
+    scan_parent = argparse.ArgumentParser(add_help=False)
+    scan_parent.add_argument('--save-scan', metavar='FILE', help='Save the scan snapshot to a JSON file')
+    scan_parent.add_argument('--from-scan', metavar='FILE',
+                             help='Render from a saved scan snapshot instead of scanning (no network access)')
+    scan_parent.add_argument('--state', metavar='FILE',
+                             help='Incremental state file: reuse results for artifacts whose metadata is unchanged '
+                                  'and resume interrupted scans')
+    
+    # Options for commands that evaluate several Flink versions and Kafka brokers at once
+    targets_parent = argparse.ArgumentParser(add_help=False)
+    targets_parent.add_argument('--targets', metavar='LIST',
+                                help='Comma-separated targets: flink-<version>, kafka-<environment>, '
+                                     'kafka-all or kafka-<broker version>')
+    targets_parent.add_argument('--kafka-manifests', metavar='DIR',
+                                help='Directory with one Kafka environment per subdirectory '
+                                     f'(default: {CompatibilityTarget.DEFAULT_MANIFESTS_DIR})')
+    targets_parent.add_argument('--broker-version', action='append', default=[], metavar='ENV=VERSION',
+                                help='Kafka broker version of an environment (repeatable)')
+    
     # Commands
     subparsers = parser.add_subparsers(dest='command', help='Available commands')
     
     # Status command
-    status_parser = subparsers.add_parser('status', help='Show current dependency status')
+    status_parser = subparsers.add_parser('status', help='Show current dependency status',
+                                          parents=[network_parent, scan_parent])
     status_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
     
     # Check command
-    check_parser = subparsers.add_parser('check', help='Check for available updates')
+    check_parser = subparsers.add_parser('check', help='Check for available updates',
+                                         parents=[network_parent, scan_parent, targets_parent])
     check_parser.add_argument('--category', '-c', help='Check specific category only')
     check_parser.add_argument('--include-prereleases', action='store_true', help='Include pre-release versions')
     check_parser.add_argument('--exclude', help='Comma-separated list of dependencies to exclude')
+    check_parser.add_argument('--format', choices=['text', 'json', 'ndjson'], default='text',
+                              help='Output format; json and ndjson stream results as they resolve '
+                                   'and send log lines to stderr (default: %(default)s)')
     check_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
     
     # Update command
-    update_parser = subparsers.add_parser('update', help='Update dependencies')
+    update_parser = subparsers.add_parser('update', help='Update dependencies',
+                                          parents=[network_parent, scan_parent, targets_parent])
     update_parser.add_argument('--category', '-c', help='Update specific category only')
     update_parser.add_argument('--include-prereleases', action='store_true', help='Include pre-release versions')
     update_parser.add_argument('--exclude', help='Comma-separated list of dependencies to exclude')
@@ -954,26 +7330,229 @@ Examples:
     update_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
     
     # Validate command
-    validate_parser = subparsers.add_parser('validate', help='Validate current dependency versions')
+    validate_parser = subparsers.add_parser('validate', help='Validate current dependency versions',
+                                            parents=[scan_parent, targets_parent])
+    validate_parser.add_argument('--format', choices=['text', 'json', 'ndjson'], default='text',
+                                 help='Output format; json and ndjson send log lines to stderr (default: %(default)s)')
     validate_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
     
     # Backup command
-    backup_parser = subparsers.add_parser('backup', help='Create backup of versions file')
+    backup_parser = subparsers.add_parser('backup', help='Snapshot the versions file into the history')
     backup_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
     
     # Restore command
-    restore_parser = subparsers.add_parser('restore', help='Restore from backup file')
-    restore_parser.add_argument('backup_file', help='Backup file to restore from')
+    restore_parser = subparsers.add_parser('restore', help='Restore a snapshot from the history')
+    restore_parser.add_argument('snapshot', nargs='?',
+                                help='Snapshot id (or unique prefix) from history, or a legacy backup file')
+    restore_parser.add_argument('--before', metavar='DATE',
+                                help='Restore the newest snapshot taken before DATE (YYYY-MM-DD[THH:MM[:SS]][+HH:MM]; local time without an offset)')
+    restore_parser.add_argument('--where', action='append', default=[], metavar='NAME=VERSION',
+                                help='Restore the newest snapshot where dependency NAME (or category/NAME) '
+                                     'was at VERSION (repeatable)')
     restore_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
     
+    # History command
+    history_parser = subparsers.add_parser('history', help='List or prune versions file snapshots')
+    history_parser.add_argument('--limit', type=int, default=20, help='Snapshots to show, 0 for all (default: %(default)s)')
+    history_parser.add_argument('--dependency', metavar='NAME',
+                                help='Only snapshots that changed this dependency (NAME or category/NAME)')
+    history_parser.add_argument('--prune', action='store_true',
+                                help='Drop old snapshots and the objects only they referenced')
+    history_parser.add_argument('--keep', type=int, default=50,
+                                help='With --prune, always keep this many newest snapshots (default: %(default)s)')
+    history_parser.add_argument('--keep-days', type=float, default=90,
+                                help='With --prune, also keep snapshots younger than this (default: %(default)s)')
+    history_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Diff command
+    diff_parser = subparsers.add_parser('diff', help='Show version changes between two snapshots')
+    diff_parser.add_argument('a', help="Snapshot id, 'latest' or 'current' (the versions file as it is now)")
+    diff_parser.add_argument('b', nargs='?', default='current', help='Second snapshot (default: %(default)s)')
+    diff_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
     # Report command
-    report_parser = subparsers.add_parser('report', help='Generate comprehensive report')
+    report_parser = subparsers.add_parser('report', help='Generate comprehensive report',
+                                          parents=[network_parent, scan_parent])
     report_parser.add_argument('--output', '-o', help='Output file name')
     report_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
     
+    # Resolve command
+    resolve_parser = subparsers.add_parser('resolve', help='Find missing or conflicting transitive dependencies',
+                                           parents=[network_parent])
+    resolve_parser.add_argument('--category', '-c', help='Resolve specific category only')
+    resolve_parser.add_argument('--max-depth', type=int, help='Stop after this many levels of transitive dependencies')
+    resolve_parser.add_argument('--include-optional', action='store_true', help='Follow optional dependencies too')
+    resolve_parser.add_argument('--ignore', help='Comma-separated groupId:artifactId globs to leave out of the missing list')
+    resolve_parser.add_argument('--output', '-o', help='Write the findings to a JSON file')
+    resolve_parser.add_argument('--strict', action='store_true',
+                                help='Exit non-zero when dependencies are missing or conflicting')
+    resolve_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Scan-classpath command
+    classpath_parser = subparsers.add_parser('scan-classpath',
+                                             help='Report duplicate classes, split packages and service conflicts')
+    classpath_parser.add_argument('--base-lib', action='append', metavar='DIR',
+                                  help='Directory of base image JARs, e.g. a copy of /opt/flink/lib (repeatable)')
+    classpath_parser.add_argument('--jar-dir', help='Use declared JARs already fetched into this directory')
+    classpath_parser.add_argument('--store-dir', default=ArtifactStore.default_dir(),
+                                  help='Artifact store for declared JARs (default: %(default)s)')
+    classpath_parser.add_argument('--cache-dir', default=MetadataCache.default_dir(),
+                                  help='Cache directory for per-JAR indexes (default: %(default)s)')
+    classpath_parser.add_argument('--no-cache', action='store_true', help='Do not cache per-JAR indexes')
+    classpath_parser.add_argument('--workers', type=int, help='Processes used for indexing (default: CPU count)')
+    classpath_parser.add_argument('--output', '-o', help='Write the findings to a JSON file')
+    classpath_parser.add_argument('--strict', action='store_true',
+                                  help='Exit non-zero on duplicate classes with different bytecode or missing providers')
+    classpath_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Analyze-pipelines command
+    pipelines_parser = subparsers.add_parser('analyze-pipelines',
+                                             help='Find the JARs the SQL pipelines need and write a dependency profile')
+    pipelines_parser.add_argument('--pipelines', action='append', metavar='GLOB',
+                                  help=f'SQL files to analyze, relative globs are quoted (repeatable, '
+                                       f'default: <versions file dir>/{DependencyManager.PIPELINES})')
+    pipelines_parser.add_argument('--keep', action='append', metavar='PATTERN',
+                                  help='Always keep dependencies matching category/name or name (repeatable)')
+    pipelines_parser.add_argument('--output', '-o', help='Profile to write (default: <versions file>.profile.json)')
+    pipelines_parser.add_argument('--jar-dir', help='Use declared JARs already fetched into this directory')
+    pipelines_parser.add_argument('--store-dir', default=ArtifactStore.default_dir(),
+                                  help='Artifact store for declared JARs (default: %(default)s)')
+    pipelines_parser.add_argument('--cache-dir', default=MetadataCache.default_dir(),
+                                  help='Cache directory for per-JAR indexes (default: %(default)s)')
+    pipelines_parser.add_argument('--no-cache', action='store_true', help='Do not cache per-JAR indexes')
+    pipelines_parser.add_argument('--workers', type=int, help='Processes used for indexing (default: CPU count)')
+    pipelines_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Fetch command
+    fetch_parser = subparsers.add_parser('fetch', help='Download dependency JARs', parents=[repository_parent])
+    fetch_parser.add_argument('--dest', '-d', required=True, help='Directory to download JARs into')
+    fetch_parser.add_argument('--category', '-c', help='Fetch specific category only')
+    fetch_parser.add_argument('--max-parallel', type=int, default=ArtifactFetcher.DEFAULT_MAX_PARALLEL,
+                              help='Upper bound for concurrent downloads (default: %(default)s)')
+    fetch_parser.add_argument('--require-checksums', action='store_true',
+                              help='Fail when a JAR has no published SHA-1 checksum')
+    fetch_parser.add_argument('--locked', action='store_true',
+                              help='Download exactly what the lockfile pins (no metadata or checksum requests)')
+    fetch_parser.add_argument('--lockfile', help='Lockfile to use with --locked (default: <versions file>.lock.json)')
+    fetch_parser.add_argument('--store-dir', default=ArtifactStore.default_dir(),
+                              help='Content-addressed artifact store (default: %(default)s)')
+    fetch_parser.add_argument('--no-store', action='store_true', help='Do not use the artifact store')
+    fetch_parser.add_argument('--profile', dest='dependency_profile', metavar='FILE',
+                              help='Leave out the JARs this profile excludes (written by analyze-pipelines)')
+    fetch_parser.add_argument('--store-max-size', metavar='SIZE',
+                              help='Evict least recently used blobs after fetching until the store fits (e.g. 2G)')
+    fetch_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Lock command
+    lock_parser = subparsers.add_parser('lock', help='Write the lockfile with URLs, checksums and sizes',
+                                        parents=[repository_parent])
+    lock_parser.add_argument('--lockfile', help='Lockfile to write (default: <versions file>.lock.json)')
+    lock_parser.add_argument('--max-parallel', type=int, default=ArtifactFetcher.DEFAULT_MAX_PARALLEL,
+                             help='Upper bound for concurrent downloads (default: %(default)s)')
+    lock_parser.add_argument('--store-dir', default=ArtifactStore.default_dir(),
+                             help='Content-addressed artifact store (default: %(default)s)')
+    lock_parser.add_argument('--no-store', action='store_true', help='Do not use the artifact store')
+    lock_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Store command
+    store_parser = subparsers.add_parser('store', help='Inspect or prune the artifact store')
+    store_parser.add_argument('action', choices=['stats', 'gc'], help='Show usage and hit/miss stats, or collect garbage')
+    store_parser.add_argument('--store-dir', default=ArtifactStore.default_dir(),
+                              help='Content-addressed artifact store (default: %(default)s)')
+    store_parser.add_argument('--max-size', metavar='SIZE', default='2G',
+                              help='Size the store is pruned to by gc (default: %(default)s)')
+    store_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Layers command
+    layers_parser = subparsers.add_parser('layers', help='Group JARs into image layers by how often they change')
+    layers_parser.add_argument('action', choices=['plan', 'build'],
+                               help='Measure version churn into the plan, or split a JAR directory into layers')
+    layers_parser.add_argument('--plan', help='Layer plan file (default: <versions file>.layers.json)')
+    layers_parser.add_argument('--layers', type=int, default=LayerPlan.DEFAULT_LAYERS,
+                               help='Number of layers to plan, or to build without a plan (default: %(default)s)')
+    layers_parser.add_argument('--jar-dir', default='./jars', help='Directory of fetched JARs (default: %(default)s)')
+    layers_parser.add_argument('--output-dir', default='./layers', help='Where layers are written (default: %(default)s)')
+    layers_parser.add_argument('--format', choices=['dir', 'tar'], default='dir',
+                               help='Directories for COPY --link, or OCI layer tarballs (default: %(default)s)')
+    layers_parser.add_argument('--gzip', action='store_true', help='Compress layer tarballs')
+    layers_parser.add_argument('--prefix', default='opt/flink/lib',
+                               help='Path of the JARs inside each layer (default: %(default)s)')
+    layers_parser.add_argument('--profile', dest='dependency_profile', metavar='FILE',
+                               help='Only expect the JARs this profile keeps (as fetched with fetch --profile)')
+    layers_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Repack command
+    repack_parser = subparsers.add_parser('repack', help='Merge JAR families and rewrite entry compression')
+    repack_parser.add_argument('--jar-dir', default='./jars', help='Directory of fetched JARs (default: %(default)s)')
+    repack_parser.add_argument('--output-dir', default='./repacked',
+                               help='Where repacked JARs are written (default: %(default)s)')
+    repack_parser.add_argument('--family', action='append', metavar='CATEGORY',
+                               help='Only merge these categories (repeatable, default: every category)')
+    repack_parser.add_argument('--no-merge', action='store_true', help='Only rewrite compression, one JAR per input')
+    repack_parser.add_argument('--compression', choices=sorted(JarRepacker.COMPRESSION), default='stored',
+                               help='Entry compression of the written JARs (default: %(default)s)')
+    repack_parser.add_argument('--level', type=int, choices=range(0, 10), metavar='0-9',
+                               help='Deflate level with --compression deflate')
+    repack_parser.add_argument('--sample', type=int, default=2000,
+                               help='Classes looked up for the before/after timings, 0 for all (default: %(default)s)')
+    repack_parser.add_argument('--base-lib', action='append', metavar='DIR',
+                               help='Directory of base image JARs, e.g. a copy of /opt/flink/lib (repeatable)')
+    repack_parser.add_argument('--strict', action='store_true',
+                               help='Exit non-zero on entry conflicts within a family or on classes '
+                                    'served by a different JAR after repacking')
+    repack_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Batch command
+    batch_parser = subparsers.add_parser('batch', help='Evaluate several versions files with one shared catalog',
+                                         parents=[network_parent, targets_parent])
+    batch_parser.add_argument('files', nargs='+', metavar='FILE',
+                              help='Versions files or glob patterns (quote globs to expand them here)')
+    batch_parser.add_argument('--include-prereleases', action='store_true', help='Include pre-release versions')
+    batch_parser.add_argument('--output-dir', help='Write a scan snapshot per file into this directory')
+    batch_parser.add_argument('--update', action='store_true', help='Apply compatible updates to every file')
+    batch_parser.add_argument('--dry-run', '-n', action='store_true', help='With --update, only show what would change')
+    batch_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Serve command
+    serve_parser = subparsers.add_parser('serve', aliases=['watch'],
+                                         help='Stay resident, poll repositories on a schedule and serve the results',
+                                         parents=[network_parent, targets_parent])
+    serve_parser.add_argument('--host', default='0.0.0.0', help='Address to listen on (default: %(default)s)')
+    serve_parser.add_argument('--port', type=int, default=DependencyWatcher.DEFAULT_PORT,
+                              help='Port for /metrics, /dependencies, /summary and /healthz (default: %(default)s)')
+    serve_parser.add_argument('--interval', type=float, default=DependencyWatcher.DEFAULT_INTERVAL, metavar='SECONDS',
+                              help='How often each dependency is checked (default: %(default)s)')
+    serve_parser.add_argument('--jitter', type=float, default=DependencyWatcher.DEFAULT_JITTER, metavar='FRACTION',
+                              help='Random spread of each check time as a fraction of the interval '
+                                   '(default: %(default)s)')
+    serve_parser.add_argument('--include-prereleases', action='store_true', help='Include pre-release versions')
+    serve_parser.add_argument('--state', metavar='FILE',
+                              help='Incremental state file, so a restart does not re-evaluate unchanged artifacts')
+    serve_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
+    # Rules command
+    rules_parser = subparsers.add_parser('rules', help='Check or benchmark the classification rules')
+    rules_parser.add_argument('action', choices=['check', 'benchmark'],
+                              help='Report ambiguous or shadowed rules, or time classification')
+    rules_parser.add_argument('--count', type=int, default=10000,
+                              help='Synthetic catalog size for benchmark (default: %(default)s)')
+    rules_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    
     # Global options
     parser.add_argument('--versions-file', default='dependency-versions.json', 
                        help='Path to versions file (default: dependency-versions.json)')
+    parser.add_argument('--rules-file', default=None,
+                        help=f'Classification and compatibility rules (default: {DependencyRules.DEFAULT_FILE.name} '
+                             'next to this script)')
+    parser.add_argument('--history-dir', metavar='DIR',
+                        help=f'Snapshot history of the versions file (default: {VersionsHistory.DEFAULT_DIR_NAME} '
+                             'next to it)')
+    parser.add_argument('--timings', metavar='FILE',
+                        help='Record per-phase timings, HTTP latency histograms, retries and cache hits as JSON')
+    parser.add_argument('--timings-textfile', metavar='FILE',
+                        help='Write the same timings as a Prometheus textfile (node_exporter textfile collector)')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Write cProfile stats to FILE and collapsed stacks of all threads to FILE.collapsed')
     
     args = parser.parse_args()
     
@@ -981,76 +7560,279 @@ Examples:
     if args.command is None:
         args.command = 'status'
         args.verbose = False
+    elif args.command == 'watch':
+        args.command = 'serve'
     
     # Setup logger
     verbose = getattr(args, 'verbose', False)
-    logger = Logger(verbose=verbose)
+    output_format = getattr(args, 'format', 'text')
+    logger = Logger(verbose=verbose, stream=sys.stderr if output_format != 'text' else None)
     
+    # serve always keeps timings so /metrics can show its request volume
+    timings = Timings(enabled=bool(args.timings or args.timings_textfile or args.command == 'serve'))
+    profiler = sampler = None
+    if args.profile:
+        sampler = StackSampler()
+        sampler.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    
+    cache = health = None
     try:
         # Initialize dependency manager
-        manager = DependencyManager(args.versions_file, logger)
+        if hasattr(args, 'cache_ttl') and not args.no_cache:
+            cache = MetadataCache(args.cache_dir, ttl=args.cache_ttl, logger=logger, negative_ttl=args.negative_ttl)
+        rules_cache_dir = None if getattr(args, 'no_cache', False) else getattr(args, 'cache_dir',
+                                                                                MetadataCache.default_dir())
+        health = MirrorHealth.load(Path(rules_cache_dir) / 'mirrors.json' if rules_cache_dir else None)
+        targets = None
+        if getattr(args, 'targets', None):
+            broker_versions = {}
+            for item in args.broker_version:
+                environment, sep, version = item.partition('=')
+                if not sep or not version:
+                    raise ValueError(f"--broker-version expects ENV=VERSION, got {item}")
+                broker_versions[environment] = version
+            targets = CompatibilityTarget.parse(args.targets,
+                                                DependencyRules.load(args.rules_file, rules_cache_dir, logger),
+                                                args.kafka_manifests, broker_versions)
+        
+        if args.command == 'batch':
+            # Batch runs load their own versions files around one shared repository client
+            maven = MavenRepository(logger, max_workers=args.max_workers, per_repository_limit=args.per_repo_limit,
+                                    cache=cache, offline=args.offline, timings=timings,
+                                    mirrors=args.mirror, health=health, rate_limit=args.rate_limit)
+            if not DependencyManager.batch(args.files, logger, maven, rules_file=args.rules_file,
+                                           rules_cache_dir=rules_cache_dir,
+                                           include_prereleases=args.include_prereleases, targets=targets,
+                                           output_dir=args.output_dir, apply=args.update, dry_run=args.dry_run):
+                sys.exit(1)
+            return
+        
+        manager = DependencyManager(
+            args.versions_file, logger,
+            max_workers=getattr(args, 'max_workers', MavenRepository.DEFAULT_MAX_WORKERS),
+            per_repository_limit=getattr(args, 'per_repo_limit', MavenRepository.DEFAULT_PER_REPOSITORY_LIMIT),
+            cache=cache,
+            offline=getattr(args, 'offline', False),
+            rules_file=args.rules_file,
+            rules_cache_dir=rules_cache_dir,
+            timings=timings,
+            state=ScanState.load(args.state, logger) if getattr(args, 'state', None) else None,
+            history_dir=args.history_dir,
+            mirrors=getattr(args, 'mirror', None),
+            health=health,
+            rate_limit=getattr(args, 'rate_limit', None)
+        )
+        if getattr(args, 'from_scan', None):
+            with timings.span('load'):
+                manager.load_scan(args.from_scan)
         
-        # Execute command
-        if args.command == 'status':
-            status = manager.get_status()
+        # Execute command; phases the commands time themselves are excluded from render
+        with timings.span('render'):
+            if args.command == 'status':
+                status = manager.get_status()
+                
+                print(f"{Colors.CYAN}╔══════════════════════════════════════════════════════════════════════════════╗{Colors.NC}")
+                print(f"{Colors.CYAN}║                    Flink Dependency Management Status                        ║{Colors.NC}")
+                print(f"{Colors.CYAN}╚══════════════════════════════════════════════════════════════════════════════╝{Colors.NC}")
+                print()
+                
+                logger.info("Configuration:")
+                print(f"  Versions file: {status['versions_file']}")
+                print(f"  Flink version: {status['flink_version']}")
+                print(f"  Last updated: {status['last_updated']}")
+                print()
+                
+                logger.info("Dependencies:")
+                print(f"  Total: {status['total_dependencies']} dependencies across {status['categories']} categories")
+                print(f"  Available updates: {status['available_updates']}")
+                print(f"  Compatible: {status['compatible_dependencies']}")
+                if status['incompatible_dependencies'] > 0:
+                    print(f"  Potential issues: {status['incompatible_dependencies']}")
+                
+            elif args.command == 'check' and output_format != 'text':
+                DependencyManager.write_results(
+                    manager.stream_results('check', category=args.category,
+                                           include_prereleases=args.include_prereleases,
+                                           exclude=args.exclude.split(',') if args.exclude else [],
+                                           targets=targets, keep=bool(args.save_scan)),
+                    output_format)
             
-            print(f"{Colors.CYAN}╔══════════════════════════════════════════════════════════════════════════════╗{Colors.NC}")
-            print(f"{Colors.CYAN}║                    Flink Dependency Management Status                        ║{Colors.NC}")
-            print(f"{Colors.CYAN}╚══════════════════════════════════════════════════════════════════════════════╝{Colors.NC}")
-            print()
+            elif args.command == 'check':
+                exclude_list = args.exclude.split(',') if args.exclude else []
+                updates = manager.check_updates(
+                    category=args.category,
+                    include_prereleases=args.include_prereleases,
+                    exclude=exclude_list,
+                    targets=targets
+                )
+                
+                total_updates = sum(len(cat_updates) for cat_updates in updates.values())
+                if total_updates == 0:
+                    logger.success("All dependencies are up to date")
+                else:
+                    logger.info(f"Found {total_updates} available updates")
             
-            logger.info("Configuration:")
-            print(f"  Versions file: {status['versions_file']}")
-            print(f"  Flink version: {status['flink_version']}")
-            print(f"  Last updated: {status['last_updated']}")
-            print()
+            elif args.command == 'update':
+                exclude_list = args.exclude.split(',') if args.exclude else []
+                updated_count = manager.update_dependencies(
+                    category=args.category,
+                    include_prereleases=args.include_prereleases,
+                    exclude=exclude_list,
+                    force=args.force,
+                    dry_run=args.dry_run,
+                    targets=targets
+                )
+                
+                if not args.dry_run and updated_count > 0:
+                    logger.info("Run 'validate' command to check compatibility after updates")
             
-            logger.info("Dependencies:")
-            print(f"  Total: {status['total_dependencies']} dependencies across {status['categories']} categories")
-            print(f"  Available updates: {status['available_updates']}")
-            print(f"  Compatible: {status['compatible_dependencies']}")
-            if status['incompatible_dependencies'] > 0:
-                print(f"  Potential issues: {status['incompatible_dependencies']}")
+            elif args.command == 'validate':
+                if output_format != 'text':
+                    summary = DependencyManager.write_results(
+                        manager.stream_results('validate', targets=targets, keep=bool(args.save_scan)),
+                        output_format)
+                    incompatible = summary['dependencies'] - summary['statuses'].get('compatible', 0)
+                else:
+                    compatible, incompatible = manager.validate_dependencies(targets)
+                if args.save_scan:
+                    manager.save_scan(args.save_scan)
+                sys.exit(0 if incompatible == 0 else 1)
             
-        elif args.command == 'check':
-            exclude_list = args.exclude.split(',') if args.exclude else []
-            updates = manager.check_updates(
-                category=args.category,
-                include_prereleases=args.include_prereleases,
-                exclude=exclude_list
-            )
+            elif args.command == 'backup':
+                manager.create_backup()
             
-            total_updates = sum(len(cat_updates) for cat_updates in updates.values())
-            if total_updates == 0:
-                logger.success("All dependencies are up to date")
-            else:
-                logger.info(f"Found {total_updates} available updates")
-        
-        elif args.command == 'update':
-            exclude_list = args.exclude.split(',') if args.exclude else []
-            updated_count = manager.update_dependencies(
-                category=args.category,
-                include_prereleases=args.include_prereleases,
-                exclude=exclude_list,
-                force=args.force,
-                dry_run=args.dry_run
-            )
+            elif args.command == 'restore':
+                where = {}
+                for item in args.where:
+                    name, sep, version = item.partition('=')
+                    if not sep or not name or not version:
+                        raise ValueError(f"--where expects NAME=VERSION, got {item}")
+                    where[name] = version
+                before = datetime.fromisoformat(args.before) if args.before else None
+                if args.snapshot and (before or where):
+                    raise ValueError("Give either a snapshot or --before/--where, not both")
+                if args.snapshot and Path(args.snapshot).is_file():
+                    manager.restore_backup(args.snapshot)
+                elif args.snapshot or before or where:
+                    manager.restore_snapshot(args.snapshot, before=before, where=where)
+                else:
+                    raise ValueError("restore needs a snapshot id, --before or --where")
             
-            if not args.dry_run and updated_count > 0:
-                logger.info("Run 'validate' command to check compatibility after updates")
-        
-        elif args.command == 'validate':
-            compatible, incompatible = manager.validate_dependencies()
-            sys.exit(0 if incompatible == 0 else 1)
-        
-        elif args.command == 'backup':
-            manager.create_backup()
-        
-        elif args.command == 'restore':
-            manager.restore_backup(args.backup_file)
-        
-        elif args.command == 'report':
-            manager.generate_report(args.output)
+            elif args.command == 'history':
+                if args.prune:
+                    removed = manager.history.prune(args.keep, args.keep_days)
+                    logger.success(f"Pruned {removed['snapshots']} snapshots and {removed['objects']} objects")
+                manager.print_history(args.limit, args.dependency)
+            
+            elif args.command == 'diff':
+                manager.diff_snapshots(args.a, args.b)
+            
+            elif args.command == 'report':
+                manager.generate_report(args.output)
+            
+            elif args.command == 'resolve':
+                missing, conflicts = manager.resolve_transitive(
+                    category=args.category,
+                    max_depth=args.max_depth,
+                    include_optional=args.include_optional,
+                    ignore=args.ignore.split(',') if args.ignore else None,
+                    output_file=args.output
+                )
+                if args.strict and (missing or conflicts):
+                    sys.exit(1)
+            
+            elif args.command == 'scan-classpath':
+                report = manager.scan_classpath(
+                    base_dirs=args.base_lib,
+                    jar_dir=args.jar_dir,
+                    store=ArtifactStore(args.store_dir, logger=logger),
+                    cache_dir=None if args.no_cache else args.cache_dir,
+                    workers=args.workers,
+                    output_file=args.output
+                )
+                clashes = any(group['differing'] for group in report['duplicates']) or \
+                    any(conflict['missing_providers'] for conflict in report['service_conflicts'])
+                if args.strict and clashes:
+                    sys.exit(1)
+            
+            elif args.command == 'analyze-pipelines':
+                manager.analyze_pipelines(
+                    patterns=args.pipelines,
+                    jar_dir=args.jar_dir,
+                    store=ArtifactStore(args.store_dir, logger=logger),
+                    cache_dir=None if args.no_cache else args.cache_dir,
+                    workers=args.workers,
+                    keep=args.keep,
+                    output_file=args.output
+                )
+            
+            elif args.command == 'fetch':
+                store = None if args.no_store else ArtifactStore(args.store_dir, logger=logger)
+                store_max_bytes = ArtifactStore.parse_size(args.store_max_size) if args.store_max_size else None
+                lock = None
+                if args.locked or args.lockfile:
+                    lock = DependencyLock.load(args.lockfile or DependencyLock.default_path(manager.versions_file),
+                                               required=True)
+                profile = DependencyProfile.load(args.dependency_profile) if args.dependency_profile else None
+                if not manager.fetch_artifacts(args.dest, category=args.category,
+                                               max_parallel=args.max_parallel,
+                                               require_checksums=args.require_checksums,
+                                               store=store, store_max_bytes=store_max_bytes, lock=lock,
+                                               profile=profile):
+                    sys.exit(1)
+            
+            elif args.command == 'lock':
+                store = None if args.no_store else ArtifactStore(args.store_dir, logger=logger)
+                if not manager.lock_dependencies(args.lockfile, store=store, max_parallel=args.max_parallel):
+                    sys.exit(1)
+            
+            elif args.command == 'store':
+                store = ArtifactStore(args.store_dir, logger=logger)
+                if args.action == 'gc':
+                    removed = store.gc(ArtifactStore.parse_size(args.max_size))
+                    logger.success(f"Evicted {removed['blobs']} blobs ({removed['bytes'] / 1048576:.1f}MB), "
+                                   f"{removed['index_entries']} index entries")
+                usage = store.usage()
+                totals = store.load_stats()
+                requests_total = totals.get('hits', 0) + totals.get('misses', 0)
+                hit_rate = 100.0 * totals.get('hits', 0) / requests_total if requests_total else 0.0
+                logger.info(f"Artifact store: {store.store_dir}")
+                print(f"  Blobs: {usage['blobs']} ({usage['bytes'] / 1048576:.1f}MB)")
+                print(f"  Hits: {totals.get('hits', 0)}, misses: {totals.get('misses', 0)} ({hit_rate:.1f}% hit rate)")
+                print(f"  Materialized: {totals.get('hardlinked', 0)} hardlinked, "
+                      f"{totals.get('reflinked', 0)} reflinked, {totals.get('copied', 0)} copied")
+            
+            elif args.command == 'layers':
+                profile = DependencyProfile.load(args.dependency_profile) if args.dependency_profile else None
+                if args.action == 'plan':
+                    manager.plan_layers(args.plan, args.layers)
+                elif not manager.build_layers(args.jar_dir, args.output_dir, plan_path=args.plan,
+                                              output_format=args.format, compress=args.gzip, prefix=args.prefix,
+                                              layers=args.layers, profile=profile):
+                    sys.exit(1)
+            
+            elif args.command == 'repack':
+                if not manager.repack_jars(args.jar_dir, args.output_dir, families=args.family,
+                                           merge=not args.no_merge, compression=args.compression,
+                                           level=args.level, strict=args.strict, sample=args.sample,
+                                           base_dirs=args.base_lib):
+                    sys.exit(1)
+            
+            elif args.command == 'serve':
+                DependencyWatcher(manager, interval=args.interval, jitter=args.jitter,
+                                  include_prereleases=args.include_prereleases,
+                                  targets=targets).serve(args.host, args.port)
+            
+            elif args.command == 'rules':
+                if args.action == 'benchmark':
+                    manager.benchmark_rules(args.count)
+                elif not manager.check_rules():
+                    sys.exit(1)
+            
+        if getattr(args, 'save_scan', None):
+            manager.save_scan(args.save_scan)
         
     except KeyboardInterrupt:
         logger.info("Operation cancelled by user")
@@ -1061,6 +7843,33 @@ Examples:
             import traceback
             traceback.print_exc()
         sys.exit(1)
+    finally:
+        # Runs on sys.exit too, so failed and strict-mode runs are still measured
+        if profiler is not None:
+            profiler.disable()
+            sampler.stop()
+            profiler.dump_stats(args.profile)
+            sampler.write_collapsed(args.profile + '.collapsed')
+            logger.info(f"Profile written: {args.profile} (collapsed stacks: {args.profile}.collapsed)")
+        if health is not None:
+            health.save()
+        if timings.enabled:
+            if cache is not None:
+                timings.cache_stats = dict(cache.stats)
+            print(file=logger.stream)
+            logger.info("Timings:")
+            for line in timings.summary_lines():
+                print(line, file=logger.stream)
+            if health is not None and health.changed:
+                logger.info("Mirror health:")
+                for line in health.summary_lines():
+                    print(line, file=logger.stream)
+            if args.timings:
+                timings.write_json(args.timings)
+                logger.info(f"Timings written: {args.timings}")
+            if args.timings_textfile:
+                timings.write_prometheus(args.timings_textfile, args.command)
+                logger.info(f"Prometheus textfile written: {args.timings_textfile}")
 
 
 if __name__ == '__main__':
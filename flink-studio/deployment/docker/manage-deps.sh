@@ -91,7 +91,7 @@ install_dependencies() {
         pip install -r "$REQUIREMENTS_FILE"
     else
         # Install basic requirements if file doesn't exist
-        pip install requests packaging
+        pip install requests
     fi
     
     log_success "Dependencies installed"
@@ -104,7 +104,6 @@ create_requirements() {
         cat > "$REQUIREMENTS_FILE" << 'EOF'
 # Flink Dependency Management System Requirements
 requests>=2.28.0
-packaging>=21.0
 EOF
         log_success "Requirements file created at $REQUIREMENTS_FILE"
     fi
@@ -151,7 +150,7 @@ main() {
         activate_venv
         
         # Check if dependencies need updating
-        if ! python -c "import requests, packaging" >/dev/null 2>&1; then
+        if ! python -c "import requests" >/dev/null 2>&1; then
             log_warning "Dependencies missing or outdated. Installing..."
             install_dependencies
         fi
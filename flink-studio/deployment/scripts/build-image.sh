@@ -67,6 +67,11 @@ if [[ ! -f "${DOCKER_DIR}/dependency-versions.json" ]]; then
     exit 1
 fi
 
+if [[ ! -f "${DOCKER_DIR}/dependency_manager.py" ]]; then
+    print_error "dependency_manager.py not found at ${DOCKER_DIR}/dependency_manager.py"
+    exit 1
+fi
+
 print_status "All required files found. Starting build..."
 
 # Build the image
@@ -77,7 +82,8 @@ echo "----------------------------------------"
 cd "${DOCKER_DIR}"
 
 # Build with no-cache to see all stages and --progress=plain for better visibility
-docker build --platform linux/amd64 --progress=plain --no-cache -t "${FULL_IMAGE_NAME}" .
+# (BuildKit cache mounts such as the artifact store survive --no-cache)
+DOCKER_BUILDKIT=1 docker build --platform linux/amd64 --progress=plain --no-cache -t "${FULL_IMAGE_NAME}" .
 
 # Check if build succeeded
 if [ $? -ne 0 ]; then